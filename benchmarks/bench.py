@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""doxx benchmarks: times the render, build, pack, unpack, pull and search hot paths on synthetic workloads and writes the results as JSON.
+
+  python benchmarks/bench.py run [--tier smoke|quick|full] [--only <prefix>[,<prefix>]] [--repeat <n>] [--output <results.json>]
+  python benchmarks/bench.py compare <baseline.json> <results.json> [--threshold <percent>]
+
+The benchmarks import doxx from the lib directory of this repository.  The workloads are generated in a temporary directory
+and the doxx cache directory (~/.doxx) is redirected to it, the pull benchmarks use a local HTTP server and make no network requests.
+compare exits with status code 1 if a benchmark is slower than the baseline by more than the threshold (default 10%)"""
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+from contextlib import contextmanager
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), 'lib'))
+
+import workloads
+from httpserver import LocalHTTPServer
+
+from doxx import settings
+from doxx.commands.build import Builder
+from doxx.commands.pack import tar_gzip_package_directory, tar_package_directory, zip_package_directory, incremental_pack_directory, write_package_manifest
+from doxx.commands.pull import run_pull, pull_package_delta
+from doxx.commands.search import run_search
+from doxx.commands.unpack import unpack_run
+from doxx.utilities import fetcher
+
+if sys.version_info[0] == 2:
+    from doxx.renderer.inkpy2 import Template, Renderer
+else:
+    from doxx.renderer.inkpy3 import Template, Renderer
+
+try:
+    timer = time.perf_counter
+except AttributeError:
+    timer = time.time
+
+KB = 1024
+MB = 1024 * KB
+
+# workload sizes for each tier, smoke is a fast check that the benchmarks run, full covers the largest workloads
+TIERS = {
+    'smoke': {
+        'render': [(1 * KB, 10)],
+        'build': [(1, 10, 1 * KB), (10, 10, 1 * KB)],
+        'pack': [100],
+        'search': [1000],
+        'pull': [(100, 1 * MB)],
+    },
+    'quick': {
+        'render': [(1 * KB, 10), (100 * KB, 100), (1 * MB, 1000), (10 * MB, 10000)],
+        'build': [(1, 10, 1 * KB), (100, 10, 1 * KB), (1000, 10, 1 * KB), (1, 100, 10 * MB)],
+        'pack': [100, 1000],
+        'search': [1000, 100000],
+        'pull': [(1000, 10 * MB)],
+    },
+    'full': {
+        'render': [(1 * KB, 10), (100 * KB, 100), (1 * MB, 1000), (10 * MB, 10000), (100 * MB, 10000)],
+        'build': [(1, 10, 1 * KB), (100, 10, 1 * KB), (1000, 10, 1 * KB), (5000, 10, 1 * KB), (1, 100, 10 * MB), (1, 100, 100 * MB)],
+        'pack': [100, 1000, 10000],
+        'search': [1000, 100000, 1000000],
+        'pull': [(1000, 10 * MB), (10000, 100 * MB)],
+    },
+}
+
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 10.0  # percent
+SEARCH_STRING = "foxtrot"
+
+
+########################################
+#
+#  Benchmark definitions
+#
+########################################
+
+class Benchmark(object):
+    """a timed function with an untimed setup before each repeat.  [run] and [setup] are called in the [work_dir] working directory"""
+    def __init__(self, name, run, setup=None, work_dir=None, params=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.work_dir = work_dir
+        self.params = params or {}
+
+
+def _size_name(size_bytes):
+    if size_bytes >= MB:
+        return str(size_bytes // MB) + "MB"
+    return str(size_bytes // KB) + "KB"
+
+
+def _make_dir(*path_parts):
+    dir_path = os.path.join(*path_parts)
+    if os.path.isdir(dir_path):
+        shutil.rmtree(dir_path)
+    os.makedirs(dir_path)
+    return dir_path
+
+
+def _clear_dir(dir_path, keep=()):
+    for file_name in os.listdir(dir_path):
+        if file_name in keep:
+            continue
+        file_path = os.path.join(dir_path, file_name)
+        if os.path.isdir(file_path):
+            shutil.rmtree(file_path)
+        else:
+            os.remove(file_path)
+
+
+def _clear_doxx_cache():
+    doxx_cache_dir = os.path.join(os.path.expanduser("~"), ".doxx")
+    if os.path.isdir(doxx_cache_dir):
+        shutil.rmtree(doxx_cache_dir)
+
+
+def render_benchmarks(root_dir, sizes):
+    """Renderer.render of a compiled template (the template is compiled in the setup)"""
+    benchmarks = []
+    for size_bytes, variable_count in sizes:
+        state = {}
+        text = workloads.make_template_text(size_bytes, variable_count)
+        key = workloads.make_key_data(variable_count)
+
+        def setup(state=state, text=text):
+            state['template'] = Template(text)
+
+        def run(state=state, key=key):
+            Renderer(state['template'], key).render()
+
+        benchmarks.append(Benchmark("render/" + _size_name(size_bytes) + "-" + str(variable_count) + "vars", run, setup,
+                                    params={'template_bytes': size_bytes, 'variables': variable_count}))
+    return benchmarks
+
+
+def build_benchmarks(root_dir, sizes):
+    """Builder.run of a key with cold doxx caches (the compiled templates and the outputs are removed in the setup)"""
+    benchmarks = []
+    for template_count, variable_count, template_bytes in sizes:
+        work_dir = _make_dir(root_dir, "build-" + str(template_count) + "-" + str(variable_count) + "-" + str(template_bytes))
+        key_path = workloads.write_build_workload(work_dir, template_count, variable_count, template_bytes)
+
+        def setup(work_dir=work_dir):
+            _clear_doxx_cache()
+            _clear_dir(work_dir, keep=("key.yaml", "templates"))
+
+        def run(key_path=key_path):
+            Builder(key_path).run()
+
+        benchmarks.append(Benchmark("build/" + str(template_count) + "x" + _size_name(template_bytes) + "-" + str(variable_count) + "vars",
+                                    run, setup, work_dir, {'templates': template_count, 'template_bytes': template_bytes, 'variables': variable_count}))
+    return benchmarks
+
+
+def pack_benchmarks(root_dir, sizes):
+    """tar_gzip_package_directory and zip_package_directory of a project directory of 4KB text files, then unpack_run of the archives"""
+    benchmarks = []
+    for file_count in sizes:
+        project_dir = _make_dir(root_dir, "project-" + str(file_count))
+        workloads.write_package_directory(project_dir, file_count)
+        archive_dir = _make_dir(root_dir, "archive-" + str(file_count))
+        params = {'files': file_count, 'file_bytes': 4096}
+
+        def setup_pack(archive_dir=archive_dir):
+            _clear_dir(archive_dir)
+
+        def run_targz(project_dir=project_dir):
+            tar_gzip_package_directory("project", project_dir)
+
+        def run_targz_fast(project_dir=project_dir):
+            tar_package_directory("project", project_dir, codec="gzip", level=1)
+
+        def run_tarxz(project_dir=project_dir):
+            tar_package_directory("project", project_dir, codec="xz")
+
+        def run_zip(project_dir=project_dir):
+            zip_package_directory("project", project_dir)
+
+        def setup_incremental(archive_dir=archive_dir, project_dir=project_dir):
+            from doxx.datatypes.cache import DoxxPackStore
+            _clear_dir(archive_dir)
+            if DoxxPackStore().get_manifest(project_dir) is None:
+                incremental_pack_directory("project", project_dir)  # the timed runs are warm packs with an unchanged project
+
+        def run_targz_incremental(project_dir=project_dir):
+            incremental_pack_directory("project", project_dir)
+
+        benchmarks.append(Benchmark("pack/targz-" + str(file_count) + "files", run_targz, setup_pack, archive_dir, params))
+        benchmarks.append(Benchmark("pack/targz-fast-" + str(file_count) + "files", run_targz_fast, setup_pack, archive_dir, params))
+        benchmarks.append(Benchmark("pack/tarxz-" + str(file_count) + "files", run_tarxz, setup_pack, archive_dir, params))
+        benchmarks.append(Benchmark("pack/zip-" + str(file_count) + "files", run_zip, setup_pack, archive_dir, params))
+        benchmarks.append(Benchmark("pack/targz-incremental-" + str(file_count) + "files", run_targz_incremental, setup_incremental, archive_dir, params))
+
+        for extension, pack_function in ((".tar.gz", tar_gzip_package_directory), (".zip", zip_package_directory)):
+            unpack_dir = _make_dir(root_dir, "unpack-" + str(file_count) + extension)
+            current_dir = os.getcwd()
+            os.chdir(unpack_dir)
+            try:
+                pack_function("project", project_dir)
+            finally:
+                os.chdir(current_dir)
+
+            def setup_unpack(unpack_dir=unpack_dir, extension=extension):
+                _clear_dir(unpack_dir, keep=("project" + extension,))
+
+            def run_unpack(extension=extension):
+                unpack_run("project" + extension)
+
+            benchmarks.append(Benchmark("unpack/" + extension.lstrip(".").replace(".", "") + "-" + str(file_count) + "files",
+                                        run_unpack, setup_unpack, unpack_dir, params))
+    return benchmarks
+
+
+def search_benchmarks(root_dir, sizes):
+    """run_search of a cached package list, cold = the search index is built, warm = the cached search index is read"""
+    benchmarks = []
+    for name_count in sizes:
+        list_text = workloads.make_package_list(name_count)
+        params = {'names': name_count, 'search': SEARCH_STRING}
+
+        def setup_cold(list_text=list_text):
+            _write_package_list(list_text)
+
+        def setup_warm(list_text=list_text):
+            _write_package_list(list_text)
+            run_search(SEARCH_STRING)  # builds and caches the search index
+
+        def run():
+            run_search(SEARCH_STRING)
+
+        benchmarks.append(Benchmark("search/cold-" + str(name_count) + "names", run, setup_cold, params=params))
+        benchmarks.append(Benchmark("search/warm-" + str(name_count) + "names", run, setup_warm, params=params))
+    return benchmarks
+
+
+def _write_package_list(list_text):
+    from doxx.datatypes.cache import DoxxCache
+    _clear_doxx_cache()
+    DoxxCache().cache_packagerepo_list(list_text)  # a new cache file is not refreshed from the remote repository list
+
+
+def pull_benchmarks(root_dir, sizes, base_url, serve_dir):
+    """run_pull from the local HTTP server with an empty HTTP cache: a tar.gz project (unpacked as it is downloaded) and a text file"""
+    benchmarks = []
+    for file_count, text_bytes in sizes:
+        project_dir = _make_dir(root_dir, "pull-project-" + str(file_count))
+        workloads.write_package_directory(project_dir, file_count)
+        current_dir = os.getcwd()
+        os.chdir(serve_dir)
+        try:
+            tar_gzip_package_directory("project-" + str(file_count), project_dir)
+            write_package_manifest("project-" + str(file_count), project_dir)
+        finally:
+            os.chdir(current_dir)
+        text_file_name = "template-" + _size_name(text_bytes) + ".doxt"
+        workloads.write_template_file(os.path.join(serve_dir, text_file_name), text_bytes, 100)
+        pull_dir = _make_dir(root_dir, "pull-" + str(file_count))
+
+        def setup(pull_dir=pull_dir):
+            _clear_dir(pull_dir)
+            fetcher.HTTP_CACHE_DIR = _make_dir(root_dir, "http-cache")
+
+        def run_targz(url=base_url + "project-" + str(file_count) + ".tar.gz"):
+            run_pull(url)
+
+        def run_text(url=base_url + text_file_name):
+            run_pull(url)
+
+        benchmarks.append(Benchmark("pull/targz-" + str(file_count) + "files", run_targz, setup, pull_dir, {'files': file_count, 'file_bytes': 4096}))
+        delta_pull_dir = _make_dir(root_dir, "pull-delta-" + str(file_count))
+
+        def setup_delta(delta_pull_dir=delta_pull_dir, file_count=file_count):
+            fetcher.HTTP_CACHE_DIR = _make_dir(root_dir, "http-cache")
+            if not os.path.isfile(os.path.join(delta_pull_dir, ".project.doxxpull")):
+                pull_package_delta("project", base_url + "project-" + str(file_count) + ".tar.gz")
+            # one changed file: the local copy differs from the package file
+            with open(os.path.join(delta_pull_dir, "dir0", "file0.txt"), 'wb') as f:
+                f.write(b"local changes")
+
+        def run_delta(file_count=file_count):
+            pull_package_delta("project", base_url + "project-" + str(file_count) + ".tar.gz",
+                               base_url + "project-" + str(file_count) + ".manifest.json")
+
+        benchmarks.append(Benchmark("pull/text-" + _size_name(text_bytes), run_text, setup, pull_dir, {'text_bytes': text_bytes}))
+        benchmarks.append(Benchmark("pull/package-delta-" + str(file_count) + "files", run_delta, setup_delta, delta_pull_dir,
+                                    {'files': file_count, 'file_bytes': 4096, 'changed_files': 1}))
+    return benchmarks
+
+
+########################################
+#
+#  Runner
+#
+########################################
+
+@contextmanager
+def quiet_stdout():
+    """redirects the doxx messages on stdout (file descriptor 1, the build worker processes inherit it) to the null device"""
+    sys.stdout.flush()
+    saved_fd = os.dup(1)
+    null_fd = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(null_fd, 1)
+    os.close(null_fd)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_fd, 1)
+        os.close(saved_fd)
+
+
+def time_benchmark(benchmark, repeat):
+    """returns the list of run times in seconds, the setup is not timed"""
+    times = []
+    current_dir = os.getcwd()
+    try:
+        for x in range(repeat):
+            if benchmark.work_dir is not None:
+                os.chdir(benchmark.work_dir)
+            with quiet_stdout():
+                if benchmark.setup is not None:
+                    benchmark.setup()
+                gc.collect()
+                start_time = timer()
+                benchmark.run()
+                times.append(timer() - start_time)
+            os.chdir(current_dir)
+    finally:
+        os.chdir(current_dir)
+    return times
+
+
+def _median(values):
+    sorted_values = sorted(values)
+    middle = len(sorted_values) // 2
+    if len(sorted_values) % 2 == 1:
+        return sorted_values[middle]
+    return (sorted_values[middle - 1] + sorted_values[middle]) / 2.0
+
+
+def _is_selected(name, only):
+    return only is None or any(name.startswith(prefix) for prefix in only)
+
+
+def run_benchmarks(tier, only=None, repeat=DEFAULT_REPEAT, output=None):
+    sizes = TIERS[tier]
+    root_dir = tempfile.mkdtemp(prefix="doxx-bench-")
+    saved_home = os.environ.get("HOME")
+    saved_http_cache_dir = fetcher.HTTP_CACHE_DIR
+    os.environ["HOME"] = root_dir  # the doxx cache directory (~/.doxx) of the benchmarks
+    results = {}
+    try:
+        serve_dir = _make_dir(root_dir, "serve")
+        with LocalHTTPServer(serve_dir) as server:
+            benchmark_groups = (    # (group name, benchmark name prefixes of the group, benchmark definitions)
+                ("render", ("render",), lambda: render_benchmarks(root_dir, sizes['render'])),
+                ("build", ("build",), lambda: build_benchmarks(root_dir, sizes['build'])),
+                ("pack", ("pack", "unpack"), lambda: pack_benchmarks(root_dir, sizes['pack'])),
+                ("search", ("search",), lambda: search_benchmarks(root_dir, sizes['search'])),
+                ("pull", ("pull",), lambda: pull_benchmarks(root_dir, sizes['pull'], server.base_url, serve_dir)),
+            )
+            for group_name, group_prefixes, make_benchmarks in benchmark_groups:
+                if only is not None and not any(prefix.split("/")[0] in group_prefixes for prefix in only):
+                    continue  # skip the workload generation
+                sys.stderr.write("[*] generating " + group_name + " workloads...\n")
+                for benchmark in make_benchmarks():
+                    if not _is_selected(benchmark.name, only):
+                        continue
+                    times = time_benchmark(benchmark, repeat)
+                    results[benchmark.name] = {'min': min(times), 'median': _median(times), 'times': times, 'params': benchmark.params}
+                    sys.stderr.write("    %-36s min %10.4fs   median %10.4fs\n" % (benchmark.name, min(times), _median(times)))
+    finally:
+        fetcher.HTTP_CACHE_DIR = saved_http_cache_dir
+        if saved_home is None:
+            del os.environ["HOME"]
+        else:
+            os.environ["HOME"] = saved_home
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+    result_data = {
+        'meta': {
+            'doxx_version': settings.major_version + "." + settings.minor_version + "." + settings.patch_version,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpu_count': _get_cpu_count(),
+            'tier': tier,
+            'repeat': repeat,
+            'date': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        'results': results,
+    }
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(result_data, f, indent=2, sort_keys=True)
+        sys.stderr.write("[*] results written to " + output + "\n")
+    return result_data
+
+
+def _get_cpu_count():
+    try:
+        from multiprocessing import cpu_count
+        return cpu_count()
+    except NotImplementedError:
+        return None
+
+
+########################################
+#
+#  Compare
+#
+########################################
+
+def compare_results(baseline_data, result_data, threshold=DEFAULT_THRESHOLD):
+    """returns a (report lines, regression names) tuple.  The min times are compared, the min is the least noisy statistic for a
+    deterministic workload.  A benchmark that is slower than the baseline by more than [threshold] percent is a regression"""
+    lines = ["%-36s %12s %12s %9s" % ("benchmark", "baseline", "result", "change")]
+    regressions = []
+    baseline_results = baseline_data['results']
+    results = result_data['results']
+    for name in sorted(set(baseline_results) | set(results)):
+        if name not in results:
+            lines.append("%-36s %12.4f %12s %9s" % (name, baseline_results[name]['min'], "-", "missing"))
+            continue
+        if name not in baseline_results:
+            lines.append("%-36s %12s %12.4f %9s" % (name, "-", results[name]['min'], "new"))
+            continue
+        baseline_time = baseline_results[name]['min']
+        result_time = results[name]['min']
+        change = (result_time - baseline_time) / baseline_time * 100.0 if baseline_time > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        elif change < -threshold:
+            flag = "  faster"
+        lines.append("%-36s %12.4f %12.4f %+8.1f%%%s" % (name, baseline_time, result_time, change, flag))
+    return (lines, regressions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="doxx benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--tier", choices=sorted(TIERS), default="quick", help="workload sizes (default: quick)")
+    run_parser.add_argument("--only", default=None, help="comma separated benchmark name prefixes (e.g. render,build/1x)")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs of each benchmark (default: %d)" % DEFAULT_REPEAT)
+    run_parser.add_argument("--output", default=None, help="JSON results file path")
+    compare_parser = subparsers.add_parser("compare", help="compare a results file with a baseline results file")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="regression threshold in percent (default: %.0f)" % DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        only = args.only.split(",") if args.only else None
+        run_benchmarks(args.tier, only, max(1, args.repeat), args.output)
+        return 0
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline_data = json.load(f)
+        with open(args.results) as f:
+            result_data = json.load(f)
+        lines, regressions = compare_results(baseline_data, result_data, args.threshold)
+        sys.stdout.write("\n".join(lines) + "\n")
+        if len(regressions) > 0:
+            sys.stdout.write(str(len(regressions)) + " benchmark(s) slower than the baseline by more than " + str(args.threshold) + "%\n")
+            return 1
+        return 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Local HTTP stand-in server for the pull benchmarks, serves the files in a directory on 127.0.0.1 with keep-alive connections"""
+
+import os
+import threading
+
+try:
+    from http.server import SimpleHTTPRequestHandler
+    from socketserver import TCPServer, ThreadingMixIn
+except ImportError:
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import TCPServer, ThreadingMixIn
+
+
+class _QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def translate_path(self, path):
+        return os.path.join(self.server.serve_dir, path.split('?')[0].lstrip('/'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalHTTPServer(object):
+    """serves [serve_dir] on a free local port in a background thread, use as a context manager or call start and stop"""
+    def __init__(self, serve_dir):
+        self.serve_dir = serve_dir
+        self.server = None
+        self.thread = None
+        self.base_url = None
+
+    def start(self):
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), _QuietHTTPRequestHandler)
+        self.server.serve_dir = self.serve_dir
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/"
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
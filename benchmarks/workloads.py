@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Synthetic workloads for the doxx benchmarks.  Every generator is seeded so that a workload is the same on every run"""
+
+import os
+import io
+import random
+
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet", "kilo", "lima", "mike",
+         "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango", "uniform", "victor", "whiskey", "xray", "yankee", "zulu")
+
+
+def make_key_data(variable_count):
+    """returns a key dictionary with [variable_count] variables (var0 ... varN)"""
+    return dict((u"var" + str(x), u"value " + str(x)) for x in range(variable_count))
+
+
+def make_template_text(size_bytes, variable_count, seed=0):
+    """returns Ink template text of about [size_bytes] with every one of [variable_count] variables used at least once (if the size allows it).
+    Lines are 60-80 characters of literal text with one to three variable tags"""
+    rng = random.Random(seed)
+    lines = []
+    total_bytes = 0
+    variable_index = 0
+    while total_bytes < size_bytes:
+        words = [rng.choice(WORDS) for x in range(rng.randint(6, 9))]
+        for x in range(rng.randint(1, 3)):
+            words.insert(rng.randint(0, len(words)), u"{{var" + str(variable_index % variable_count) + u"}}")
+            variable_index += 1
+        line = u" ".join(words) + u"\n"
+        lines.append(line)
+        total_bytes += len(line)
+    return u"".join(lines)
+
+
+def write_template_file(file_path, size_bytes, variable_count, seed=0, basename=None):
+    """writes a doxx template file with the template text from make_template_text, large templates are written in blocks"""
+    header = u"---doxx---\nbasename: " + (basename or os.path.splitext(os.path.basename(file_path))[0]) + u"\nextension: txt\n---doxx---\n"
+    block_bytes = 1048576
+    with io.open(file_path, 'w', encoding='utf-8') as f:
+        f.write(header)
+        written_bytes = 0
+        block_number = 0
+        while written_bytes < size_bytes:
+            block_text = make_template_text(min(block_bytes, size_bytes - written_bytes), variable_count, seed + block_number)
+            f.write(block_text)
+            written_bytes += len(block_text)
+            block_number += 1
+
+
+def write_build_workload(root_dir, template_count, variable_count=10, template_bytes=1024):
+    """writes [template_count] templates and a key file that builds them to the out directory, returns the key file path"""
+    template_dir = os.path.join(root_dir, "templates")
+    if not os.path.isdir(template_dir):
+        os.makedirs(template_dir)
+    template_paths = []
+    for x in range(template_count):
+        template_path = os.path.join("templates", "t" + str(x) + ".doxt")
+        write_template_file(os.path.join(root_dir, template_path), template_bytes, variable_count, seed=x)
+        template_paths.append(template_path)
+    key_lines = [u"---"]
+    if template_count == 1:
+        key_lines.append(u"template: " + template_paths[0])
+    else:
+        key_lines.append(u"templates:")
+        for template_path in template_paths:
+            key_lines.append(u"  - " + template_path)
+    key_lines.append(u"---")
+    for variable_name, value in sorted(make_key_data(variable_count).items()):
+        key_lines.append(variable_name + u": " + value)
+    key_path = os.path.join(root_dir, "key.yaml")
+    with io.open(key_path, 'w', encoding='utf-8') as f:
+        f.write(u"\n".join(key_lines) + u"\n")
+    return key_path
+
+
+def write_package_directory(root_dir, file_count, file_bytes=4096, seed=0):
+    """writes a project directory of [file_count] text files in subdirectories of 100 files"""
+    rng = random.Random(seed)
+    for x in range(file_count):
+        dir_path = os.path.join(root_dir, "dir" + str(x // 100))
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        text = u" ".join(rng.choice(WORDS) for y in range(file_bytes // 6))[:file_bytes]
+        with io.open(os.path.join(dir_path, "file" + str(x) + ".txt"), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def make_package_list(name_count, seed=0):
+    """returns the text of a package repository list with [name_count] unique dash separated package names, one per line"""
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < name_count:
+        names.add(u"-".join(rng.choice(WORDS) for x in range(rng.randint(1, 3))) + u"-" + str(rng.randint(0, name_count)))
+    return u"\n".join(sorted(names))
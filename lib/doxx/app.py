@@ -9,12 +9,12 @@
 
 # Application start
 def main():
+    import os
     import sys
     from os.path import basename
     from Naked.commandline import Command
     from Naked.toolshed.system import stdout, stderr, is_dir, is_file, cwd
-    from doxx.commands.build import Builder
-    from doxx.commands.make import Maker
+    # command modules are imported in the command branches below, a command does not pay the import time of the other commands (e.g. requests)
 
     #------------------------------------------------------------------------------------------
     # [ Instantiate command line object ]
@@ -52,14 +52,86 @@ def main():
     #   Enter your command line parsing logic below
     #------------------------------------------------------------------------------------------
     elif c.cmd == "build":
-        if c.argc > 1:
+        if c.argc > 1 and not c.arg1.startswith("-"):
             key_path = c.arg1
         else:
             key_path = "key.yaml"
+        processes = None  # number of worker processes for multi-template builds, defaults to CPU count
+        if c.option_with_arg("--jobs"):
+            try:
+                processes = int(c.option_arg("--jobs"))
+            except ValueError:
+                stderr("[!] doxx: The --jobs option requires an integer number of worker processes.", exit=1)
+        if c.option("--offline"):
+            os.environ["DOXX_OFFLINE"] = "1"  # use cached copies of remote files without revalidation (inherited by the build worker processes)
+        if c.option("--watch"):
+            from doxx.commands.watch import DoxxWatcher
+            stdout("[*] doxx: Build started with the key file '" + key_path + "'...")
+            DoxxWatcher(key_path, incremental=c.option("--incremental"), processes=processes).run()
+            sys.exit(0)
         stdout("[*] doxx: Build started with the key file '" + key_path + "'...")
-        b = Builder(key_path)
-        b.run()
+        profile = c.option("--profile") or c.option_with_arg("--profile-json") or c.option_with_arg("--trace")
+        if profile:
+            from doxx.utilities.profiler import enable_profile
+            enable_profile()
+        # builds are forwarded to a doxx serve daemon only on request (--serve option or the DOXX_SOCKET environment variable of
+        # serve.SERVE_SOCKET_ENVIRONMENT_VARIABLE), the daemon builds with its own environment, sys.path, and Python interpreter
+        serve = c.option("--serve") or os.environ.get("DOXX_SOCKET", "") != ""
+        if serve and not c.option("--no-serve") and not profile:  # profiled builds run in this process
+            # forward the build to a running doxx serve daemon (skips the build module imports and template parsing in this process)
+            from doxx.commands.serve import forward_build
+            exit_code = forward_build(key_path, incremental=c.option("--incremental"), processes=processes, offline=c.option("--offline"))
+            if exit_code is not None:
+                if exit_code != 0:
+                    sys.exit(exit_code)
+                stdout("[*] doxx: Build complete.")
+                sys.exit(0)
+            if c.option("--serve"):
+                stdout("[*] doxx: A doxx serve daemon is not running, the build runs in this process.")
+        from doxx.commands.build import Builder
+        b = Builder(key_path, incremental=c.option("--incremental"), processes=processes)
+        try:
+            b.run()
+        finally:
+            # the profile is reported for failed builds too
+            if profile:
+                from doxx.utilities.profiler import format_profile_report, write_profile_json, write_trace_json
+                if c.option("--profile"):
+                    stdout(format_profile_report())
+                if c.option_with_arg("--profile-json"):
+                    write_profile_json(c.option_arg("--profile-json"))
+                if c.option_with_arg("--trace"):
+                    write_trace_json(c.option_arg("--trace"))
         stdout("[*] doxx: Build complete.")
+    elif c.cmd == "batch":
+        # positional arguments are key sources (a shell expands unquoted glob patterns into many key file paths)
+        key_sources = []
+        previous_arg = ""
+        for arg in c.argv[1:]:
+            if (arg == "-" or not arg.startswith("-")) and previous_arg not in ("--key", "--out", "--jobs"):
+                key_sources.append(arg)
+            previous_arg = arg
+        if len(key_sources) == 0:
+            stderr("[!] doxx: Please include a directory, glob pattern, or JSONL/CSV file of keys with the batch command.", exit=1)
+        template_key_path = "key.yaml"  # templates for JSONL/CSV key records
+        if c.option_with_arg("--key"):
+            template_key_path = c.option_arg("--key")
+        output_dir = "."
+        if c.option_with_arg("--out"):
+            output_dir = c.option_arg("--out")
+        processes = None
+        if c.option_with_arg("--jobs"):
+            try:
+                processes = int(c.option_arg("--jobs"))
+            except ValueError:
+                stderr("[!] doxx: The --jobs option requires an integer number of worker processes.", exit=1)
+        if c.option("--offline"):
+            os.environ["DOXX_OFFLINE"] = "1"
+        from doxx.commands.batch import BatchBuilder
+        stdout("[*] doxx: Batch build started...")
+        bb = BatchBuilder(key_sources, template_key_path=template_key_path, output_dir=output_dir, processes=processes)
+        bb.run()
+        stdout("[*] doxx: Batch build complete.")
     elif c.cmd == "browse":
         from doxx.commands.browse import browse_docs
         if c.argc > 1:
@@ -69,11 +141,24 @@ def main():
             # default to open the main documentation page
             query = "docs"
             browse_docs(query)
+    elif c.cmd == "serve":
+        from doxx.commands.serve import run_serve, stop_serve
+        socket_path = None  # default = $DOXX_SOCKET or a per-user socket in the temporary directory
+        if c.option_with_arg("--socket"):
+            socket_path = c.option_arg("--socket")
+        if c.option("--stop"):
+            if stop_serve(socket_path):
+                stdout("[*] doxx: Serve stopped.")
+            else:
+                stderr("[!] doxx: There is no running doxx serve daemon.", exit=1)
+        else:
+            run_serve(socket_path)
     elif c.cmd == "clean":
         from doxx.commands.clean import run_clean
         run_clean()  # execute the clean routines
     elif c.cmd == "make":
         if c.argc > 1:
+            from doxx.commands.make import Maker
             if c.cmd2 == "key":  # secondary command        
                 m = Maker()
                 if c.argc > 2:
@@ -94,29 +179,78 @@ def main():
         else:
             stderr("[!] doxx: Please include the secondary command 'key', 'project', or 'template' with the 'make' command.", exit=1)
     elif c.cmd == "pack":
-        from doxx.commands.pack import tar_gzip_package_directory, zip_package_directory 
-        if c.argc > 1:
-            if c.cmd2 == "zip":
-                if c.argc > 2:  # request for zip with a directory path
-                    if is_dir(c.arglp):
-                        zip_package_directory(c.arglp, c.arglp)
+        from doxx.commands.pack import tar_package_directory, zip_package_directory, incremental_pack_directory, write_package_manifest, get_pack_level
+        pack_args = []
+        previous_arg = ""
+        for arg in c.argv[1:]:
+            if not arg.startswith("-") and previous_arg not in ("--jobs", "--codec", "--level"):
+                pack_args.append(arg)
+            previous_arg = arg
+        processes = None  # number of compression threads, defaults to CPU count
+        if c.option_with_arg("--jobs"):
+            try:
+                processes = int(c.option_arg("--jobs"))
+            except ValueError:
+                stderr("[!] doxx: The --jobs option requires an integer number of compression threads.", exit=1)
+        zip_archive = len(pack_args) > 0 and pack_args[0] == "zip"
+        codec = "gzip"  # gzip = tar.gz archives and deflate compressed zip archive members
+        if c.option_with_arg("--codec"):
+            codec = c.option_arg("--codec")
+        level = None
+        if c.option_with_arg("--level"):
+            try:
+                level = int(c.option_arg("--level"))
+            except ValueError:
+                stderr("[!] doxx: The --level option requires an integer compression level.", exit=1)
+        try:
+            level = get_pack_level(codec, level, fast=c.option("--fast"), zip_archive=zip_archive)  # --fast = the fastest level of the codec
+        except ValueError as e:
+            stderr("[!] doxx: Unable to pack with the '" + codec + "' codec: " + str(e) + ".", exit=1)
+        delta = c.option("--delta")  # tar.gz archive of the changes since the last pack of the directory
+        incremental = c.option("--incremental") or delta  # reuse the compressed files of the last pack from the doxx pack store
+        if incremental:
+            if codec != "gzip":
+                stderr("[!] doxx: Incremental packs use the gzip codec (tar.gz and deflate zip archives).", exit=1)
+            if delta and zip_archive:
+                stderr("[!] doxx: The --delta option creates tar.gz archives.  Please remove the zip command.", exit=1)
+        if len(pack_args) > 0:
+            if zip_archive:
+                if len(pack_args) > 1:  # request for zip with a directory path
+                    if is_dir(pack_args[-1]):
+                        if incremental:
+                            incremental_pack_directory(pack_args[-1], pack_args[-1], zip_archive=True, level=level, processes=processes)
+                        else:
+                            zip_package_directory(pack_args[-1], pack_args[-1], processes=processes, codec=codec, level=level)
                     else:
-                        stderr("[!] doxx: '" + c.arglp + "' does not appear to be a directory.  Please enter the path to your project directory.", exit=1)
+                        stderr("[!] doxx: '" + pack_args[-1] + "' does not appear to be a directory.  Please enter the path to your project directory.", exit=1)
                 else:  # request for zip with current working directory
                     stderr("[!] doxx: Please include your project directory as an argument to the zip command", exit=1)
-            else:  # request for tar.gz with a directory path
-                if is_dir(c.arglp):
-                    tar_gzip_package_directory(c.arglp, c.arglp)
+            else:  # request for a tar archive with a directory path
+                if is_dir(pack_args[-1]):
+                    if incremental:
+                        incremental_pack_directory(pack_args[-1], pack_args[-1], delta=delta, level=level, processes=processes)
+                    else:
+                        tar_package_directory(pack_args[-1], pack_args[-1], codec=codec, level=level, processes=processes)
                 else:
-                    stderr("[!] doxx: '" + c.arglp + "' does not appear to be a directory.  Please enter the path to your project directory.", exit=1)
-        else:  # request for tar.gz in current working directory
+                    stderr("[!] doxx: '" + pack_args[-1] + "' does not appear to be a directory.  Please enter the path to your project directory.", exit=1)
+        else:  # request for a tar archive in current working directory
             root_dir = cwd()
             archive_name = basename(root_dir)
-            tar_gzip_package_directory(archive_name, root_dir)
+            if incremental:
+                incremental_pack_directory(archive_name, root_dir, delta=delta, level=level, processes=processes)
+            else:
+                tar_package_directory(archive_name, root_dir, codec=codec, level=level, processes=processes)
+        if c.option("--manifest"):  # package manifest and file objects for delta pulls of the package
+            if len(pack_args) > 0:
+                write_package_manifest(pack_args[-1], pack_args[-1])
+            else:
+                write_package_manifest(basename(cwd()), cwd())
         # end of the pack command
         stdout("[*] doxx: Pack complete")
     elif c.cmd == "pull":
         if c.argc > 1:
+            if c.option("--offline"):
+                os.environ["DOXX_OFFLINE"] = "1"
             from doxx.commands.pull import run_pull
             run_pull(c.arg1)
             stdout("[*] doxx: Pull complete")
@@ -135,14 +269,26 @@ def main():
         else:
             stderr("[!] doxx: Please include a search string after your command.", exit=1)
     elif c.cmd == "unpack":
-        if c.argc > 1:
-            if is_file(c.arg1):
+        unpack_args = []
+        previous_arg = ""
+        for arg in c.argv[1:]:
+            if not arg.startswith("-") and previous_arg != "--jobs":
+                unpack_args.append(arg)
+            previous_arg = arg
+        processes = None  # number of zip extraction worker processes, defaults to CPU count
+        if c.option_with_arg("--jobs"):
+            try:
+                processes = int(c.option_arg("--jobs"))
+            except ValueError:
+                stderr("[!] doxx: The --jobs option requires an integer number of worker processes.", exit=1)
+        if len(unpack_args) > 0:
+            if is_file(unpack_args[0]):
                 from doxx.commands.unpack import unpack_run, remove_compressed_archive_file
-                unpack_run(c.arg1)
-                remove_compressed_archive_file(c.arg1)
+                unpack_run(unpack_args[0], processes=processes, delta=c.option("--delta"))  # --delta: remove the files that a delta archive lists
+                remove_compressed_archive_file(unpack_args[0])
                 stdout("[*] doxx: Unpack complete")
             else:
-                stderr("[!] doxx: '" + c.arg1 + "' does not appear to be a file.  Please include a path to your compressed file.", exit=1)
+                stderr("[!] doxx: '" + unpack_args[0] + "' does not appear to be a file.  Please include a path to your compressed file.", exit=1)
         else:
             stderr("[!] doxx: Please include a path to your file.", exit=1)
     elif c.cmd == "whatis":
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import sys
+import csv
+import glob
+import json
+from multiprocessing import Pool, cpu_count
+
+from Naked.toolshed.system import make_path, stderr, stdout
+from Naked.toolshed.python import is_py2
+
+from doxx.datatypes.template import DoxxTemplate, RemoteDoxxTemplate
+from doxx.datatypes.key import DoxxKey, make_unicode_key_data
+from doxx.utilities.filesystem import _copy_file_atomic, _create_dirs, _write_file_atomic
+
+# need a different template for Python 2 & 3
+if is_py2():
+    from doxx.renderer.inkpy2 import Template as InkTemplate
+    from doxx.renderer.inkpy2 import Renderer as InkRenderer
+else:
+    from doxx.renderer.inkpy3 import Template as InkTemplate
+    from doxx.renderer.inkpy3 import Renderer as InkRenderer
+
+BATCH_KEY_FILE_EXTENSIONS = (".yaml", ".yml")  # key files that are included from a directory of keys
+BATCH_RECORD_FILE_EXTENSIONS = (".jsonl", ".json", ".csv")  # key record files (one key per JSON line or CSV row)
+BATCH_RECORD_NAME_FIELD = "id"  # key record field that names the key (and its output directory), records without it are named key-<record number>
+
+
+class BatchKey(object):
+    """The key data, templates, and output directory for one key in a batch build"""
+    def __init__(self, name, key_data, template_paths, output_root, no_replacements=False):
+        self.name = name                        # unique name of the key in the batch, used as the output directory name
+        self.key_data = key_data                # unicode key data dictionary
+        self.template_paths = template_paths    # tuple of the template paths that are rendered with the key
+        self.output_root = output_root          # directory that the template outfile paths are written relative to
+        self.no_replacements = no_replacements  # True if the key did not define replacement keys, templates are written verbatim
+
+
+class BatchBuilder(object):
+    """The BatchBuilder class renders one set of doxx templates with many keys.  Each template is read and compiled once for the
+    entire batch, the keys are rendered in parallel worker processes and every key writes to its own output directory"""
+    def __init__(self, key_sources, template_key_path="key.yaml", output_dir=".", processes=None):
+        self.key_sources = key_sources              # key file paths, directories or glob patterns of key files, JSONL/CSV key record files, or '-' for JSONL records on stdin
+        self.template_key_path = template_key_path  # key file with the templates build spec for key records (its key data are the default record values)
+        self.output_dir = output_dir                # each key is written to output_dir/<key name>
+        self.processes = processes                  # number of worker processes (default = CPU count)
+
+    def run(self):
+        batch_keys = self.load_batch_keys()
+        if len(batch_keys) == 0:
+            stderr("[!] doxx: Unable to find keys for the batch build in '" + "', '".join(self.key_sources) + "'.", exit=1)
+        compiled_templates = self.compile_templates(batch_keys)
+        failed_keys = batch_build(batch_keys, compiled_templates, self.processes)
+
+        if len(failed_keys) > 0:
+            stderr("[!] doxx: " + str(len(failed_keys)) + " of " + str(len(batch_keys)) + " keys failed to build:", exit=0)
+            for key_name in failed_keys:
+                stderr("    " + key_name, exit=0)
+            sys.exit(1)
+
+    def load_batch_keys(self):
+        """returns the list of BatchKey objects for the key sources, exits with an error message on invalid or duplicate keys"""
+        batch_keys = []
+        template_key = None  # the template key file is only read if there are key records
+        record_count = 0     # key records are numbered across all of the record sources
+        for source in self.key_sources:
+            if source == "-" or source.lower().endswith(BATCH_RECORD_FILE_EXTENSIONS):
+                if template_key is None:
+                    template_key = self._load_template_key()
+                record_batch_keys = self._make_record_batch_keys(source, template_key, record_count)
+                record_count += len(record_batch_keys)
+                batch_keys.extend(record_batch_keys)
+            else:
+                for key_path in _get_key_file_paths(source):
+                    batch_keys.append(self._make_key_file_batch_key(key_path))
+
+        # every key writes to its own output directory
+        key_names = set()
+        for batch_key in batch_keys:
+            if batch_key.name in key_names:
+                stderr("[!] doxx: The key name '" + batch_key.name + "' is used by more than one key in the batch.  Please use unique key file names or record '" + BATCH_RECORD_NAME_FIELD + "' values.", exit=1)
+            key_names.add(batch_key.name)
+        return batch_keys
+
+    def compile_templates(self, batch_keys):
+        """reads and compiles every template in the batch once, returns a dictionary of template path : (outfile, verbatim, text, segments, copy_range)"""
+        compiled_templates = {}
+        for batch_key in batch_keys:
+            for template_path in batch_key.template_paths:
+                if template_path not in compiled_templates:
+                    try:
+                        compiled_templates[template_path] = _compile_template(template_path)
+                    except Exception as e:
+                        stderr(str(e), exit=1)  # a template that does not compile fails every key in the batch, stop before the build
+        return compiled_templates
+
+    def _load_template_key(self):
+        template_key = DoxxKey(self.template_key_path)
+        if template_key.single_template_key is False and template_key.multi_template_key is False:
+            stderr("[!] doxx: The key file '" + self.template_key_path + "' does not include a template or templates field for the batch key records.", exit=1)
+        return template_key
+
+    def _make_key_file_batch_key(self, key_path):
+        key = DoxxKey(key_path)
+        if key.single_template_key is False and key.multi_template_key is False:
+            stderr("[!] doxx: The key file '" + key_path + "' does not include a template or templates field.  Batch builds render templates only.", exit=1)
+        name = os.path.splitext(os.path.basename(key_path))[0]
+        if name == "key":  # the default key file name, name the key with its directory (e.g. tenants/acme/key.yaml = acme)
+            name = os.path.basename(os.path.dirname(os.path.abspath(key_path)))
+        return BatchKey(name, key.key_data, _get_template_paths(key), make_path(self.output_dir, name), key.no_replacements)
+
+    def _make_record_batch_keys(self, source, template_key, record_count):
+        batch_keys = []
+        template_paths = _get_template_paths(template_key)
+        record_number = record_count
+        for record in _read_key_records(source):
+            record_number += 1
+            if not isinstance(record, dict):
+                stderr("[!] doxx: The key record " + str(record_number) + " in '" + source + "' is not a set of key : value pairs.", exit=1)
+            record_data = make_unicode_key_data(record)
+            key_data = dict(template_key.key_data)  # the key data in the template key file are the default values
+            key_data.update(record_data)
+            name = record_data.get(BATCH_RECORD_NAME_FIELD, u"")
+            if name == u"":
+                name = u"key-" + str(record_number)
+            if name in (u".", u"..") or u"/" in name or u"\\" in name:
+                stderr("[!] doxx: The key record name '" + name + "' in '" + source + "' cannot be used as an output directory name.", exit=1)
+            batch_keys.append(BatchKey(name, key_data, template_paths, make_path(self.output_dir, name)))
+        return batch_keys
+
+
+########################################
+#
+#  [batch_build]
+#       public function
+#       - render the compiled templates
+#           with every batch key
+#
+########################################
+
+def batch_build(batch_keys, compiled_templates, processes=None):
+    """renders the compiled templates for every key with a bounded pool of worker processes, returns the list of names of the keys that failed to build"""
+    if processes is None or processes < 1:
+        processes = cpu_count()              # default to one worker process per CPU
+    processes = min(processes, len(batch_keys))
+
+    failed_keys = []
+    if processes < 2:
+        # render in this process, skips the worker process start up
+        _init_batch_worker(compiled_templates)
+        results = (_batch_worker_runner(batch_key) for batch_key in batch_keys)
+        for key_name, output_root, error_message in results:
+            _report_batch_key(key_name, output_root, error_message, failed_keys)
+        return failed_keys
+
+    # keys are sent to the workers in chunks, the compiled templates are sent once to each worker in the pool initializer
+    chunksize, extra = divmod(len(batch_keys), processes * 4)
+    if extra:
+        chunksize += 1
+
+    # the workers return their errors, all stdout / stderr writes take place in this process so no output lock is needed
+    pool = Pool(processes, initializer=_init_batch_worker, initargs=(compiled_templates,))
+    try:
+        for key_name, output_root, error_message in pool.imap_unordered(_batch_worker_runner, batch_keys, chunksize):
+            _report_batch_key(key_name, output_root, error_message, failed_keys)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return failed_keys
+
+
+def _report_batch_key(key_name, output_root, error_message, failed_keys):
+    if error_message is None:
+        stdout("[+] doxx: -- " + output_root + " ... check")
+    else:
+        stderr(error_message, exit=0)
+        failed_keys.append(key_name)
+
+
+# compiled Ink templates for the worker processes in the batch_build pool, defined in _init_batch_worker
+_worker_templates = None
+
+
+def _init_batch_worker(compiled_templates):
+    global _worker_templates
+    _worker_templates = {}
+    for template_path in compiled_templates:
+        outfile, verbatim, text, segments, copy_range = compiled_templates[template_path]
+        if copy_range is not None:
+            _worker_templates[template_path] = (outfile, verbatim, text, None, copy_range)  # verbatim template text that is copied from the template file
+        else:
+            _worker_templates[template_path] = (outfile, verbatim, text, InkTemplate(text, segments=segments), copy_range)
+
+
+def _batch_worker_runner(batch_key):
+    """renders the templates for one key in a pool worker process, returns a (key name, output root, error message) tuple.  The error message is None for successful builds"""
+    for template_path in batch_key.template_paths:
+        outfile, verbatim, text, ink_template, copy_range = _worker_templates[template_path]
+        outfile_path = make_path(batch_key.output_root, outfile)
+        try:
+            if copy_range is not None:
+                _create_dirs(outfile_path)
+                _copy_file_atomic(outfile_path, template_path, copy_range[0], copy_range[1])
+                continue
+            elif verbatim is True or batch_key.no_replacements is True:
+                rendered_text = text
+            else:
+                rendered_text = InkRenderer(ink_template, batch_key.key_data).render()
+            _create_dirs(outfile_path)
+            _write_file_atomic(outfile_path, rendered_text)
+        except Exception as e:
+            return (batch_key.name, batch_key.output_root, "[!] doxx: Unable to build '" + outfile_path + "' for the key '" + batch_key.name + "'. Error: " + str(e))
+    return (batch_key.name, batch_key.output_root, None)
+
+
+def _compile_template(template_path):
+    """reads and parses a local or remote template, returns a (outfile, verbatim, text, segments, copy_range) tuple.  Raises an Exception with a doxx error message on failure"""
+    if len(template_path) > 6 and (template_path[0:7] == "http://" or template_path[0:8] == "https://"):
+        template = RemoteDoxxTemplate(template_path)
+        result = template.load_data()
+        if result[0] == False:
+            raise Exception(result[1])
+    elif os.path.isfile(template_path):
+        template = DoxxTemplate(template_path)
+        try:
+            template.load_data()
+        except Exception as e:
+            raise Exception("[!] doxx: Unable to read the local template file '" + template_path + "'. Error message: " + str(e))
+    else:
+        raise Exception("[!] doxx: Unable to find the requested template file " + template_path)
+
+    try:
+        template.split_data()
+    except Exception as e:
+        raise Exception("[!] doxx: Unable to parse the template data.  Please verify the template syntax and try again.  Error message: " + str(e))
+    error_parse_result = template.parse_template_for_errors()
+    if error_parse_result[0] == True:
+        raise Exception(error_parse_result[1])
+    try:
+        template.parse_template_text()
+    except Exception as e:
+        raise Exception("[!] doxx: An error occurred while parsing the template file. Error message: " + str(e))
+    return (template.outfile, template.verbatim, template.text, template.segments, template.copy_range)
+
+
+def _get_template_paths(key):
+    if key.multi_template_key is True:
+        return tuple(key.meta_data['templates'])
+    else:
+        return (key.meta_data['template'],)
+
+
+def _get_key_file_paths(source):
+    """returns the sorted key file paths for a key file path, a directory of key files, or a glob pattern"""
+    if os.path.isdir(source):
+        return sorted(make_path(source, file_name) for file_name in os.listdir(source) if file_name.lower().endswith(BATCH_KEY_FILE_EXTENSIONS))
+    elif glob.has_magic(source):
+        return sorted(file_path for file_path in glob.glob(source) if os.path.isfile(file_path))
+    else:
+        return [source]  # DoxxKey reports missing key files
+
+
+def _read_key_records(source):
+    """yields the key record dictionaries from a JSONL (one JSON object per line) or CSV (header row of key names) file, '-' reads JSONL from stdin"""
+    try:
+        if source == "-":
+            for record in _read_jsonl_records(sys.stdin):
+                yield record
+        elif source.lower().endswith(".csv"):
+            if is_py2():
+                with open(source, 'rb') as f:
+                    for row in csv.DictReader(f):
+                        yield dict((key.decode('utf-8'), value.decode('utf-8') if value is not None else None) for key, value in row.items())
+            else:
+                with open(source, 'r', encoding='utf-8', newline='') as f:
+                    for row in csv.DictReader(f):
+                        yield row
+        else:
+            with open(source, 'rb') as f:
+                for record in _read_jsonl_records(f):
+                    yield record
+    except (IOError, OSError, ValueError) as e:
+        stderr("[!] doxx: Unable to read the key records in '" + source + "'. Error: " + str(e), exit=1)
+
+
+def _read_jsonl_records(file_obj):
+    for line in file_obj:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.strip():
+            yield json.loads(line)
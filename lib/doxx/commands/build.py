@@ -3,75 +3,128 @@
 
 import sys
 import os
-from multiprocessing import Process, Lock
 
 from Naked.toolshed.file import FileWriter
-from Naked.toolshed.system import cwd, dir_exists, file_exists, make_dirs, make_path, stderr, stdout
+from Naked.toolshed.system import cwd, file_exists, make_path, stderr, stdout
 from Naked.toolshed.python import is_py2
 
-from doxx.datatypes.template import DoxxTemplate, RemoteDoxxTemplate
-from doxx.datatypes.key import DoxxKey
-from doxx.commands.pull import run_pull, is_url
-from doxx.commands.unpack import unpack_run
+from doxx.datatypes.template import RemoteDoxxTemplate, make_local_template
+from doxx.datatypes.key import load_key
+from doxx.datatypes.manifest import DoxxBuildManifest, hash_file, hash_text, hash_key_values
+from doxx.utilities.filesystem import _copy_file_atomic, _create_dirs, _write_chunks_atomic, _write_file_atomic
+from doxx.utilities.profiler import add_profile_spans, enable_profile, is_profile_enabled, pop_profile_spans, timed_phase
 
 # need a different template for Python 2 & 3
 if is_py2():    
     from doxx.renderer.inkpy2 import Template as InkTemplate
     from doxx.renderer.inkpy2 import Renderer as InkRenderer
+    from doxx.renderer.inkpy2 import StreamRenderer as InkStreamRenderer
 else:
     from doxx.renderer.inkpy3 import Template as InkTemplate
     from doxx.renderer.inkpy3 import Renderer as InkRenderer
+    from doxx.renderer.inkpy3 import StreamRenderer as InkStreamRenderer
 
 
-def multi_process_build(key, key_path):
-    processes = []       # list of spawned processes
-    iolock = Lock()      # file read / write lock
+def multi_process_build(key, key_path, manifest=None, processes=None):
+    """renders the templates in the key with a bounded pool of worker processes, returns the list of template paths that failed to build"""
+    from multiprocessing import Pool, Lock, cpu_count  # imported on use, single template builds do not start worker processes
+    template_list = key.meta_data['templates']
+    if len(template_list) == 0:
+        return []
+    if processes is None or processes < 1:
+        processes = cpu_count()              # default to one worker process per CPU
+    processes = min(processes, len(template_list))
     outputlock = Lock()  # stdout / stderr writes lock
     
-    # ## SINGLE PROCESS
-    # for template in key.meta_data['templates']:
-        # b = Builder()
-        # b.set_key_data(key)
-        # b.single_template_run(template)
+    # templates are sent to the workers in chunks, the key data are sent once to each worker in the pool initializer
+    chunksize, extra = divmod(len(template_list), processes * 4)
+    if extra:
+        chunksize += 1
     
-    ## MULTI-PROCESS    
-    # create worker processes
-    for template in key.meta_data['templates']:
-        p = Process(target=single_process_runner, args=(template, key, key_path, iolock, outputlock))
-        p.start()
-        processes.append(p)
-    # join worker processes upon completion or with 60 second timeout
-    for process in processes:
-        process.join(timeout=60)
+    failed_templates = []
+    outfile_templates = {}  # outfile path : template path
+    pool = Pool(processes, initializer=_init_build_worker, initargs=(key, key_path, manifest, outputlock, is_profile_enabled()))
+    try:
+        for template_path, build_ok, outfile_path, manifest_updates, profile_spans in pool.imap_unordered(_build_worker_runner, template_list, chunksize):
+            add_profile_spans(profile_spans)  # build phase spans from the worker process (empty list unless --profile)
+            if build_ok is False:
+                failed_templates.append(template_path)
+            elif outfile_path is not None:
+                # templates that write the same outfile path: the rename of the last template to finish replaces the others, warn the user
+                if outfile_path in outfile_templates:
+                    stderr("[!] doxx: Warning: '" + outfile_path + "' is written by both '" + outfile_templates[outfile_path] + "' and '" + template_path + "'. The file from the last template to finish is kept.", exit=0)
+                outfile_templates[outfile_path] = template_path
+            # collect the updated incremental build manifest entries from the worker processes
+            if manifest is not None:
+                manifest.entries.update(manifest_updates)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
     
-    # ## zombie process finder for testing
-    # active_child_processes = active_children()
-    
-    # if len(active_child_processes) > 0:
-        # print("active children detected")
-    # else:
-        # print("no active children detected")
+    return failed_templates
+
+
+# Builder instance and locks for the worker processes in the multi_process_build pool, defined in _init_build_worker
+_worker_builder = None
+_worker_outputlock = None
+
 
+def _init_build_worker(key, key_path, manifest, outputlock, profile):
+    global _worker_builder, _worker_outputlock
+    if profile:
+        enable_profile()
+    _worker_builder = Builder(key_path)
+    _worker_builder.set_key_data(key)
+    _worker_builder.manifest = manifest
+    _worker_outputlock = outputlock
 
-def single_process_runner(template_path, key, key_path, iolock, outputlock):
-    b = Builder(key_path)
-    b.set_key_data(key)
-    b.multi_process_run(template_path, iolock, outputlock)
+
+def _build_worker_runner(template_path):
+    """renders one template in a pool worker process, returns a (template path, build ok, outfile path, updated manifest entries, profile spans) tuple"""
+    if _worker_builder.manifest is not None:
+        _worker_builder.manifest.updated = {}
+    outfile_path = None
+    try:
+        outfile_path = _worker_builder.multi_process_run(template_path, _worker_outputlock)
+        build_ok = True
+    except SystemExit as se:
+        build_ok = se.code is None or se.code == 0  # multi_process_run reports the error and raises SystemExit(1) on failure
+    except Exception as e:
+        _worker_outputlock.acquire()
+        stderr("[!] doxx: Unable to build the template '" + template_path + "'. Error: " + str(e), exit=0)
+        _worker_outputlock.release()
+        build_ok = False
+    if _worker_builder.manifest is not None:
+        return (template_path, build_ok, outfile_path, _worker_builder.manifest.updated, pop_profile_spans())
+    else:
+        return (template_path, build_ok, outfile_path, {}, pop_profile_spans())
 
 
 class Builder(object):
     """The Builder class renders doxx templates from user provided keys"""
-    def __init__(self, key_path): 
+    def __init__(self, key_path, incremental=False, processes=None): 
         self.key_path = key_path   # the local key file path: key.yaml or as specified by user
         self.key_data = {}
         self.no_key_replacements = False
+        self.incremental = incremental  # skip templates with unchanged template text, key values, and output files (build manifest stored next to the key file)
+        self.manifest = None
+        self.processes = processes      # number of worker processes for multi-template builds (default = CPU count)
     
     def run(self):
-        doxxkey = DoxxKey(self.key_path)
+        with timed_phase("key", self.key_path):
+            doxxkey = load_key(self.key_path)  # parsed once per key file modification in doxx serve
         # detect single vs multiple keys in the template and execute replacements with every requested template
         self.set_key_data(doxxkey)  # assign key data from the doxx Key
         
+        failed_templates = []
         try:
+            # incremental builds: read the build manifest from the last build
+            if self.incremental is True and (doxxkey.multi_template_key is True or doxxkey.single_template_key is True):
+                self.manifest = DoxxBuildManifest(self.key_path)
+            
             
             # are there text file(s) to pull? if so, do it
             if doxxkey.textfile_key is True:
@@ -97,13 +150,27 @@ class Builder(object):
             if doxxkey.project_key is True:  # the key is set to run on a local or remote project archive
                 self.project_archive_run(doxxkey)
             elif doxxkey.multi_template_key is True:  # the key is set to run on multiple local or remote template files
-                multi_process_build(doxxkey, self.key_path)
+                failed_templates = multi_process_build(doxxkey, self.key_path, self.manifest, self.processes)
             elif doxxkey.single_template_key is True:
                 self.single_template_run(doxxkey.meta_data['template']) # the key is set to run on a single local or remote template file
             else:
                 pass  # no default condition
+            
+            # incremental builds: write the build manifest for the next build
+            if self.manifest is not None:
+                if doxxkey.multi_template_key is True:
+                    self.manifest.write(doxxkey.meta_data['templates'])
+                else:
+                    self.manifest.write([doxxkey.meta_data['template']])
         except Exception as e:
             stderr("[!] doxx: Error: " + str(e), exit=1)
+        
+        # report the templates that failed in a multi-template build
+        if len(failed_templates) > 0:
+            stderr("[!] doxx: " + str(len(failed_templates)) + " of " + str(len(doxxkey.meta_data['templates'])) + " templates failed to build:", exit=0)
+            for template_path in failed_templates:
+                stderr("    " + template_path, exit=0)
+            sys.exit(1)
             
     
     def set_key_data(self, key):
@@ -130,9 +197,10 @@ class Builder(object):
                 stderr("[!] doxx: Unable to load the remote template file '" + template_path + "'. Error message: " + str(e), exit=1)
         # local templates        
         elif file_exists(template_path):
-            template = DoxxTemplate(template_path)
+            template = make_local_template(template_path, self.no_key_replacements)  # DoxxStreamTemplate for large template files
             try:
-                template.load_data()
+                with timed_phase("load", template_path):
+                    template.load_data()
             except Exception as e:
                 stderr("[!] doxx: Unable to read the local template file '" + template_path + "'. Error message: " + str(e), exit=1)
         else:
@@ -140,7 +208,8 @@ class Builder(object):
          
         ## Split the data  
         try:
-            template.split_data()
+            with timed_phase("parse", template_path):
+                template.split_data()
         except Exception as e:
             stderr("[!] doxx: Unable to parse the template data.  Please verify the template syntax and try again.  Error message: " + str(e), exit=1)
         
@@ -152,22 +221,40 @@ class Builder(object):
         
         ## Then parse the template text and load instance attributes for the text replacement with Ink below
         try:
-            template.parse_template_text()
+            with timed_phase("parse", template_path):
+                template.parse_template_text()
         except Exception as e:
             stderr("[!] doxx: An error occurred while parsing the template file. Error message: " + str(e), exit=1)
+        
+        ## Skip the template in incremental builds if the template, key values, and output file are unchanged
+        if self.is_unchanged_template(template_path, template):
+            stdout("[-] doxx: -- " + make_path(os.path.dirname(self.key_path), template.outfile) + " ... unchanged")
+            return
     
+        # large templates are read, rendered, and written in chunks
+        if template.streamed is True:
+            try:
+                outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
+                with timed_phase("mkdir", template_path):
+                    _create_dirs(outfile_path)
+                with timed_phase("write", template_path):  # includes the streamed render
+                    self.stream_template_write(outfile_path, template)
+                self.record_built_template(template_path, template)
+                stdout("[+] doxx: -- " + outfile_path + " ... check")
+            except Exception as e:
+                stderr("[!] doxx: There was an error with the streamed render of '" + template_path + "'. Error message: " + str(e), exit=1)
         # determine whether this is a verbatim template file (no replacements) or the key file did not include replacement keys
-        if template.verbatim is True or self.no_key_replacements is True:
+        elif template.verbatim is True or self.no_key_replacements is True:
             # write template.text out verbatim
             try:
-            # if the requested destination directory path does not exist, make it
-                outfile_dir_path = make_path(os.path.dirname(self.key_path), os.path.dirname(template.outfile))
-                if not outfile_dir_path == '' and not dir_exists(outfile_dir_path):
-                    make_dirs(outfile_dir_path)
-                # write the file
                 outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
-                fw = FileWriter(outfile_path)
-                fw.write(template.text)
+                # if the requested destination directory path does not exist, make it
+                with timed_phase("mkdir", template_path):
+                    _create_dirs(outfile_path)
+                # write the file
+                with timed_phase("write", template_path):
+                    self.verbatim_write(outfile_path, template)
+                self.record_built_template(template_path, template)
                 stdout("[+] doxx: '" + outfile_path + "' build... check")
             except Exception as e:
                 stderr("[!] doxx: There was a file write error. Error message: " + str(e), exit=1)        
@@ -176,28 +263,29 @@ class Builder(object):
             # template text is in template.text
             # perform the text replacements:         
             try:
-                ink_template = InkTemplate(template.text)
-                ink_renderer = InkRenderer(ink_template, self.key_data)
-                rendered_text = ink_renderer.render()
+                with timed_phase("render", template_path):
+                    ink_template = InkTemplate(template.text, segments=template.segments)
+                    ink_renderer = InkRenderer(ink_template, self.key_data)
+                    rendered_text = ink_renderer.render()
             except Exception as e:
                 stderr("[!] doxx: An error occurred during the text replacement attempt.  Error message: " + str(e), exit=1)
         
             # if the requested destination directory path does not exist, make it
-            outfile_dir_path = make_path(os.path.dirname(self.key_path), os.path.dirname(template.outfile))
-            if not outfile_dir_path == '' and not dir_exists(outfile_dir_path):
-                make_dirs(outfile_dir_path)
+            outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
+            with timed_phase("mkdir", template_path):
+                _create_dirs(outfile_path)
     
             # write rendered file to disk
             try:
-                outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
-                fw = FileWriter(outfile_path)
-                fw.write(rendered_text)
+                with timed_phase("write", template_path):
+                    _write_file_atomic(outfile_path, rendered_text)
+                self.record_built_template(template_path, template)
                 stdout("[+] doxx: -- " + outfile_path + " ... check")
             except Exception as e:
                 stderr("[!] doxx: There was an error with the rendered file write. Error message: " + str(e), exit=1)
             
-    def multi_process_run(self, template_path, iolock, outputlock):
-        """Render replacements over multiple template files as defined in doxx key file using multiple processes (public method)"""
+    def multi_process_run(self, template_path, outputlock):
+        """Render replacements over multiple template files as defined in doxx key file using multiple processes, returns the outfile path (public method)"""
         #-------------------------------------------------------------------------------
         # NOTE : changes in this method require the same changes to single_template_run
         #-------------------------------------------------------------------------------
@@ -217,25 +305,25 @@ class Builder(object):
                 outputlock.release()
                 sys.exit(1)  # release the lock before raising SystemExit
         elif file_exists(template_path):
-            template = DoxxTemplate(template_path)
-            
-            iolock.acquire()  # acquire the IO lock for template file read
+            template = make_local_template(template_path, self.no_key_replacements)  # DoxxStreamTemplate for large template files
             try:
-                template.load_data()  # load local data
+                with timed_phase("load", template_path):
+                    template.load_data()  # load local data
             except Exception as e:
                 outputlock.acquire()
                 stderr("[!] doxx: Unable to read the local template file '" + template_path + "'. Error message: " + str(e), exit=0)
                 outputlock.release()
                 sys.exit(1)  # release the lock before raising SystemExit
-            iolock.release()  # release the IO lock for template file read
         else:
             outputlock.acquire()  # acquire the stderr lock
             stdout("[!] doxx: Unable to find the requested template file " + template_path)  # print error message in standard output, multi-file run so do not end execution of application       
             outputlock.release()  # release the stderr lock
+            return None  # ends this template build, a missing template is reported but does not fail the build (the exit status is 0)
 
         ## Split the data
         try:
-            template.split_data()  # split the data sections
+            with timed_phase("parse", template_path):
+                template.split_data()  # split the data sections
         except Exception as e:
             outputlock.acquire()
             stderr("[!] doxx: Unable to parse the template data.  Please verify the template syntax and try again.  Error message: " + str(e), exit=0)
@@ -253,38 +341,54 @@ class Builder(object):
     
         ## Parse the template text
         try:
-            template.parse_template_text()
+            with timed_phase("parse", template_path):
+                template.parse_template_text()
         except Exception as e:
             outputlock.acquire()
             stderr("[!] doxx: An error occurred during the attempt to parse the template file. Error message: " + str(e), exit=0)
             outputlock.release()
             sys.exit(1)  # release the lock before raising SystemExit
         
+        ## Skip the template in incremental builds if the template, key values, and output file are unchanged
+        if self.is_unchanged_template(template_path, template):
+            outputlock.acquire()
+            stdout("[-] doxx: -- " + make_path(os.path.dirname(self.key_path), template.outfile) + " ... unchanged")
+            outputlock.release()
+            return make_path(os.path.dirname(self.key_path), template.outfile)
+        
+        # file writes do not require a lock: directory creation tolerates concurrent creation of the same path and 
+        # files are written to a temporary file then renamed into place (two templates with the same outfile path never leave a partial file)
+        
+        # large templates are read, rendered, and written in chunks
+        if template.streamed is True:
+            try:
+                outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
+                with timed_phase("mkdir", template_path):
+                    _create_dirs(outfile_path)
+                with timed_phase("write", template_path):  # includes the streamed render
+                    self.stream_template_write(outfile_path, template)
+                self.record_built_template(template_path, template)
+                
+                outputlock.acquire()
+                stdout("[+] doxx: -- " + outfile_path + " ... check")
+                outputlock.release()
+            except Exception as e:
+                outputlock.acquire()
+                stderr("[!] doxx: There was an error with the streamed render of '" + template_path + "'. Error message: " + str(e), exit=0)
+                outputlock.release()
+                sys.exit(1)  # release the lock before raising SystemExit
         # determine whether this is a verbatim template file (no replacements) or the key file did not include replacement keys
-        if template.verbatim is True or self.no_key_replacements is True:
+        elif template.verbatim is True or self.no_key_replacements is True:
             # write template.text out verbatim
             try:
-                # if the requested destination directory path does not exist, make it
-                outfile_dir_path = make_path(os.path.dirname(self.key_path), os.path.dirname(template.outfile))
-                try:
-                    iolock.acquire()
-                    if not outfile_dir_path == '' and not dir_exists(outfile_dir_path):
-                        make_dirs(outfile_dir_path)
-                    iolock.release()
-                except Exception as e:
-                    iolock.release()  # release the lock then re-raise the exception
-                    raise e
-                # write the file
                 outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
+                # if the requested destination directory path does not exist, make it
+                with timed_phase("mkdir", template_path):
+                    _create_dirs(outfile_path)
                 # then write the file out verbatim
-                try:
-                    iolock.acquire()
-                    fw = FileWriter(outfile_path)
-                    fw.write(template.text)
-                    iolock.release()
-                except Exception as e:
-                    iolock.release()  # catch and release the iolock before re-raising the exception
-                    raise e
+                with timed_phase("write", template_path):
+                    self.verbatim_write(outfile_path, template)
+                self.record_built_template(template_path, template)
                 
                 outputlock.acquire()
                 stdout("[+] doxx: -- " + outfile_path + " ... check")
@@ -299,49 +403,94 @@ class Builder(object):
             # template text is in template.text
             # perform the text replacements:
             try:
-                ink_template = InkTemplate(template.text)
-                ink_renderer = InkRenderer(ink_template, self.key_data)
-                rendered_text = ink_renderer.render()
+                with timed_phase("render", template_path):
+                    ink_template = InkTemplate(template.text, segments=template.segments)
+                    ink_renderer = InkRenderer(ink_template, self.key_data)
+                    rendered_text = ink_renderer.render()
             except Exception as e:
                 outputlock.acquire()
                 stderr("[!] doxx: An error occurred during the text replacement attempt.  Error message: " + str(e), exit=0)            
                 outputlock.release()
                 sys.exit(1)  # release the lock before raising SystemExit
         
+            outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
+            
             # if the requested destination directory path does not exist, make it
-            outfile_dir_path = make_path(os.path.dirname(self.key_path), os.path.dirname(template.outfile))
             try:
-                iolock.acquire()
-                if not outfile_dir_path == '' and not dir_exists(outfile_dir_path):
-                    make_dirs(outfile_dir_path)
-                iolock.release()
+                with timed_phase("mkdir", template_path):
+                    _create_dirs(outfile_path)
             except Exception as e:
                 outputlock.acquire()
-                stderr("[!] doxx: Unable to create directory path '" + outfile_dir_path + "' for your file write. Error: " + str(e), exit=0)
+                stderr("[!] doxx: Unable to create directory path '" + os.path.dirname(outfile_path) + "' for your file write. Error: " + str(e), exit=0)
                 outputlock.release()
-                iolock.release()
-                sys.exit(1)  # release the iolock before raising SystemExit
-                
-            outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
+                sys.exit(1)  # release the lock before raising SystemExit
             
             try:
-                iolock.acquire()
-                fw = FileWriter(outfile_path)
-                fw.write(rendered_text)
-                iolock.release()
+                with timed_phase("write", template_path):
+                    _write_file_atomic(outfile_path, rendered_text)
             except Exception as e:
                 outputlock.acquire()
                 stderr("[!] doxx: Unable to write the file '" + outfile_path + "'. Error: " + str(e), exit=0)
                 outputlock.release()
-                iolock.release()
-                sys.exit(1)  # release the iolock before raising SystemExit
+                sys.exit(1)  # release the lock before raising SystemExit
+            self.record_built_template(template_path, template)
                 
             outputlock.acquire()
             stdout("[+] doxx: -- " + outfile_path + " ... check")
             outputlock.release()
         
+        return outfile_path  # used by multi_process_build to detect templates that write the same file
+
+
+    def verbatim_write(self, outfile_path, template):
+        """writes the template text without replacements, a template with a copy_range is copied from the template file without a decode"""
+        if template.copy_range is not None:
+            _copy_file_atomic(outfile_path, template.inpath, template.copy_range[0], template.copy_range[1])
+        else:
+            _write_file_atomic(outfile_path, template.text)
 
+    def stream_template_write(self, outfile_path, template):
+        """renders a DoxxStreamTemplate one text chunk at a time and writes the rendered chunks to outfile_path, the template text is never held in memory"""
+        if template.copy_range is not None:
+            _copy_file_atomic(outfile_path, template.inpath, template.copy_range[0], template.copy_range[1])
+            return
+        text_chunks = template.iter_text_chunks()
+        if not (template.verbatim is True or self.no_key_replacements is True):
+            text_chunks = InkStreamRenderer(self.key_data).render_chunks(text_chunks)
+        _write_chunks_atomic(outfile_path, text_chunks)
+
+    def is_unchanged_template(self, template_path, template):
+        """incremental builds: returns True if the template text, the key values that it uses, and the output file match the build manifest"""
+        if self.manifest is None:
+            return False
+        outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
+        try:
+            return self.manifest.is_current(template_path, self._make_template_hash(template), self._make_key_hash(template), outfile_path)
+        except Exception:
+            return False  # build the template if the manifest check fails
+    
+    def record_built_template(self, template_path, template):
+        """incremental builds: records the hashes for a template that was written in the build manifest"""
+        if self.manifest is None:
+            return
+        outfile_path = make_path(os.path.dirname(self.key_path), template.outfile)
+        self.manifest.update_entry(template_path, self._make_template_hash(template), self._make_key_hash(template), outfile_path)
+    
+    def _make_template_hash(self, template):
+        if template.streamed is True or template.copy_range is not None:
+            return hash_file(template.inpath)  # streamed and copied template text is not in memory
+        return hash_text(template.raw_text)
+    
+    def _make_key_hash(self, template):
+        no_replacements = template.verbatim is True or self.no_key_replacements is True
+        if no_replacements:
+            return hash_key_values(self.key_data, set(), no_replacements)
+        elif template.streamed is True:
+            return hash_key_values(self.key_data, set(self.key_data), no_replacements)  # the variables of a streamed template are not known before the render, use all key values
+        return hash_key_values(self.key_data, set(template.segments[1::2]), no_replacements)
+    
     def project_archive_run(self, key):
+        from doxx.commands.pull import run_pull, is_url  # imported on use, pull imports the HTTP libraries
         try:
             project_path = key.meta_data['project']
             # Remote .tar.gz or .zip project archives
@@ -381,6 +530,7 @@ class Builder(object):
                 
     
     def unpack_and_get_keypath(self, project_path):
+        from doxx.commands.unpack import unpack_run
         # unpack the archive and get the root directory from the archive
         root_directory = unpack_run(project_path)
         
@@ -2,43 +2,841 @@
 # encoding: utf-8
 
 import os
+import bz2
+import json
+import stat
+import time
+import zlib
+import struct
 import shutil
+import hashlib
 import tarfile
 import zipfile
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from Naked.toolshed.system import stderr
+from Naked.toolshed.python import is_py2
+from doxx.datatypes.manifest import PACK_DELTA_FILE_NAME
 
+try:
+    import lzma
+except ImportError:
+    lzma = None  # Python 2, the xz codec is not available
 
-def tar_gzip_package_directory(archive_name, root_dir):
+PACK_COMPRESS_LEVEL = 9             # deflate compression level of tar.gz archives
+PACK_ZIP_COMPRESS_LEVEL = zlib.Z_DEFAULT_COMPRESSION  # deflate compression level of zip archive members (the ZipFile.write level)
+PACK_BLOCK_SIZE = 1048576           # tar.gz archives: bytes of tar data in each block that is compressed by a pool thread
+PACK_DICTIONARY_SIZE = 32768        # tar.gz archives: each block is primed with the last 32KB (the deflate window) of the previous block
+PACK_ZIP_MEMORY_LIMIT = 67108864    # zip archives: members that are larger are compressed with a streamed write in the main thread
+PACK_ZIP64_LIMIT = zipfile.ZIP64_LIMIT  # zip archives: sizes and offsets that are larger are written in zip64 extra fields (the ZipFile limit)
+
+# tar archive codecs, codec name : (archive file extension, default level, (fastest level, smallest level)).  The archive type is identified
+# from the magic bytes of the compressed file by doxx unpack and doxx pull, the extension selects the streamed unpack of doxx pull
+PACK_CODECS = {
+    'gzip': (".tar.gz", PACK_COMPRESS_LEVEL, (1, 9)),
+    'bz2': (".tar.bz2", 9, (1, 9)),
+    'xz': (".tar.xz", 6, (0, 9)),
+    'stored': (".tar", None, None),
+}
+PACK_ZIP_CODECS = {   # zip member compression, gzip = deflate
+    'gzip': (".zip", PACK_ZIP_COMPRESS_LEVEL, (1, 9)),
+    'stored': (".zip", None, None),
+}
+
+
+def get_pack_level(codec, level=None, fast=False, zip_archive=False):
+    """returns the compression level for a codec: [level] if it is defined, the fastest level of the codec for the --fast preset, or the
+    default level of the codec.  Raises ValueError for unknown codecs and levels that are outside of the codec range"""
+    codecs = PACK_ZIP_CODECS if zip_archive else PACK_CODECS
+    if codec not in codecs:
+        raise ValueError("the " + ("zip" if zip_archive else "tar") + " archive codecs are " + ", ".join(sorted(codecs)))
+    if codec == 'xz' and lzma is None:
+        raise ValueError("the xz codec requires the lzma module of Python 3")
+    extension, default_level, level_range = codecs[codec]
+    if level_range is None:
+        return None
+    if level is not None:
+        if level != default_level and (level < level_range[0] or level > level_range[1]):  # the zip default level is zlib.Z_DEFAULT_COMPRESSION (-1)
+            raise ValueError("the " + codec + " compression levels are " + str(level_range[0]) + " to " + str(level_range[1]))
+        return level
+    if fast is True:
+        return level_range[0]
+    return default_level
+
+
+def tar_gzip_package_directory(archive_name, root_dir, processes=None, level=PACK_COMPRESS_LEVEL):
+    tar_package_directory(archive_name, root_dir, codec='gzip', level=level, processes=processes)
+
+
+def tar_package_directory(archive_name, root_dir, codec='gzip', level=None, processes=None):
+    """writes the [root_dir] directory to a tar archive with the [codec] compression in the current working directory, returns the archive
+    file name.  gzip archives are compressed with [processes] threads, the bz2 and xz codecs are single stream compressors (the tarfile
+    stream mode of doxx pull does not read concatenated streams)"""
+    current_dir = os.getcwd()
+    archive_file_name = archive_name + PACK_CODECS[codec][0]
+    level = get_pack_level(codec, level)
+    out_file = None
     try:
-        current_dir = os.getcwd()  
-        archive_gz_name = archive_name + ".tar.gz"
-        tar = tarfile.open(archive_gz_name, mode="w:gz", compresslevel=9)    # file writes to current working directory
+        if codec == 'gzip':
+            out_file = ParallelGzipWriter(open(archive_file_name, 'wb'), level=level, processes=processes)    # file writes to current working directory
+        elif codec == 'bz2':
+            out_file = bz2.BZ2File(archive_file_name, 'w', compresslevel=level)
+        elif codec == 'xz':
+            out_file = lzma.LZMAFile(archive_file_name, 'w', preset=level)
+        else:
+            out_file = open(archive_file_name, 'wb')
+        tar = tarfile.open(fileobj=out_file, mode="w|")  # stream mode, the tar data are written to the compressed file in order
         os.chdir(root_dir)  # navigate to the root directory to add the files to the archive
-        tar.add(".")     # make tar.gz archive
+        tar.add(".")     # make tar archive
         tar.close()
+        out_file.close()
         os.chdir(current_dir)  # navigate back to user's current working directory
+        return archive_file_name
     except Exception as e:
         os.chdir(current_dir)  # if exception was raised, make sure that user is back in their current working directory before raising system exit
-        tar.close()
+        if isinstance(out_file, ParallelGzipWriter):
+            out_file.abort()
+        elif out_file is not None:
+            out_file.close()
         stderr("[!] doxx: Unable to pack the directory '" + root_dir + "'. Error: " + str(e))
-        
 
-def zip_package_directory(archive_name, path):
+
+def zip_package_directory(archive_name, path, processes=None, codec='gzip', level=None):
+    current_dir = os.getcwd()
+    archive_path = os.path.join(current_dir, archive_name + '.zip')
+    level = get_pack_level(codec, level, zip_archive=True)
+    zipper = None
     try:
-        current_dir = os.getcwd()
-        archive_name = archive_name + '.zip'
         archive_file_list = []
         os.chdir(path)
         for root, dirs, files in os.walk(os.getcwd()):
-            for the_file in files:      
+            for the_file in files:
                 archive_file_list.append((os.path.relpath(os.path.join(root, the_file))))
-        zipper = zipfile.ZipFile(archive_name, 'w')
-        for zip_file in archive_file_list:
-            zipper.write(zip_file)
+        if codec == 'stored':
+            zipper = zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED)
+            for zip_file in archive_file_list:
+                zipper.write(zip_file)
+        else:
+            zipper = _ZipArchiveWriter(open(archive_path, 'wb'))
+            write_zip_members(zipper, archive_file_list, processes=processes, level=level)
         zipper.close()
-        shutil.move(archive_name, os.path.join(current_dir, archive_name))
         os.chdir(current_dir)
+        return archive_name + '.zip'
     except Exception as e:
         os.chdir(current_dir)
-        zipper.close()
+        if zipper is not None:
+            zipper.close()
         stderr("[!] doxx: Unable to pack the directory '" + path + "'. Error: " + str(e))
+
+
+########################################
+#
+#  [ParallelGzipWriter]
+#       public class
+#       - block parallel gzip compression
+#
+########################################
+
+class ParallelGzipWriter(object):
+    """The ParallelGzipWriter class is a write only file object that compresses the data with a thread pool (zlib releases the GIL) and writes a
+    single member gzip stream (the pigz format).  The data are split into blocks, each block is a raw deflate stream that is primed with the
+    last 32KB of the previous block and ended with a sync flush, the blocks are written in order as one deflate stream.  Stock gzip tools and
+    the tarfile stream mode (doxx pull of tar.gz archives) read the archives, the tarfile stream mode does not read multi-member gzip streams"""
+    def __init__(self, fileobj, level=PACK_COMPRESS_LEVEL, processes=None, block_size=PACK_BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        if processes is None or processes < 1:
+            processes = cpu_count()
+        if is_py2():
+            processes = 1  # the zlib module of Python 2 does not support deflate dictionaries, compress with one deflate stream
+        self.processes = processes
+        self.pool = None                  # started when the second block is complete, small archives are compressed in this thread
+        self.first_block = None           # (block, dictionary, level) job that is compressed in this thread if there is no second block
+        self.pending_blocks = deque()     # compressed block results in the order of the data, bounded to two blocks per thread
+        self.buffer = bytearray()
+        self.dictionary = b""             # last 32KB of the previous block
+        self.compressor = None            # single thread deflate stream
+        self.crc = zlib.crc32(b"")
+        self.size = 0
+        xfl = b"\x02" if level == 9 else (b"\x04" if level == 1 else b"\x00")
+        self.fileobj.write(b"\x1f\x8b\x08\x00" + struct.pack("<I", int(time.time()) & 0xffffffff) + xfl + b"\xff")
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        if self.processes == 1:
+            if self.compressor is None:
+                self.compressor = _make_raw_compressor(self.level)
+            self.fileobj.write(self.compressor.compress(data))
+            return
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self._add_block(block)
+
+    def close(self):
+        if self.fileobj is None:
+            return
+        if self.processes == 1:
+            if self.compressor is None:
+                self.compressor = _make_raw_compressor(self.level)
+            self.fileobj.write(self.compressor.flush(zlib.Z_FINISH))
+        else:
+            if len(self.buffer) > 0:
+                self._add_block(bytes(self.buffer))
+                self.buffer = bytearray()
+            if self.first_block is not None:
+                self.fileobj.write(_deflate_block(self.first_block))
+                self.first_block = None
+            while len(self.pending_blocks) > 0:
+                self._write_block()
+            self.fileobj.write(_make_raw_compressor(self.level).flush(zlib.Z_FINISH))  # empty final deflate block
+            self._close_pool()
+        self.fileobj.write(struct.pack("<II", self.crc & 0xffffffff, self.size & 0xffffffff))
+        self.fileobj.close()
+        self.fileobj = None
+
+    def abort(self):
+        """stops the compression threads and closes the file without the gzip trailer"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
+
+    def _add_block(self, block):
+        dictionary = self.dictionary
+        self.dictionary = block[-PACK_DICTIONARY_SIZE:]
+        if self.pool is None:
+            if self.first_block is None:
+                self.first_block = (block, dictionary, self.level)  # the first block waits in case it is the only block of the archive
+                return
+            self.pool = ThreadPool(processes=self.processes)
+            self.pending_blocks.append(self.pool.apply_async(_deflate_block, (self.first_block,)))
+            self.first_block = None
+        self.pending_blocks.append(self.pool.apply_async(_deflate_block, ((block, dictionary, self.level),)))
+        while len(self.pending_blocks) > self.processes * 2:
+            self._write_block()
+
+    def _write_block(self):
+        self.fileobj.write(self.pending_blocks.popleft().get())
+
+    def _close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def _make_raw_compressor(level, dictionary=None):
+    if dictionary:
+        return zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    return zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+
+def _deflate_block(job):
+    block, dictionary, level = job
+    compressor = _make_raw_compressor(level, dictionary)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)  # byte aligned, the next block continues the deflate stream
+
+
+########################################
+#
+#  [write_zip_members]
+#       public function
+#       - parallel zip member compression
+#
+########################################
+
+def write_zip_members(zipper, file_paths, processes=None, level=PACK_ZIP_COMPRESS_LEVEL):
+    """compresses the files at the deflate [level] with a thread pool and writes them to the open _ZipArchiveWriter [zipper] in the order of
+    [file_paths].  Members that do not compress are stored, members that are larger than PACK_ZIP_MEMORY_LIMIT are compressed in this thread
+    with a streamed write"""
+    if processes is None or processes < 1:
+        processes = cpu_count()
+    if is_py2() or processes == 1 or len(file_paths) < 2:
+        for file_path in file_paths:
+            _write_zip_member(zipper, _deflate_zip_member(file_path, level), level)
+        return
+    pool = ThreadPool(processes=min(processes, len(file_paths)))
+    try:
+        pending_members = deque()  # bounded to four members per thread, the members are written in order
+        for file_path in file_paths:
+            pending_members.append(pool.apply_async(_deflate_zip_member, (file_path, level)))
+            while len(pending_members) > processes * 4:
+                _write_zip_member(zipper, pending_members.popleft().get(), level)
+        while len(pending_members) > 0:
+            _write_zip_member(zipper, pending_members.popleft().get(), level)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _deflate_zip_member(file_path, level):
+    """returns a (file path, ZipInfo, compressed member data) tuple, the data are None for members that are written with a streamed write"""
+    file_stat = os.stat(file_path)
+    zinfo = _make_zip_info(file_path, file_stat)
+    if file_stat.st_size > PACK_ZIP_MEMORY_LIMIT:
+        return (file_path, zinfo, None)
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data) & 0xffffffff
+    compressor = _make_raw_compressor(level)
+    compressed_data = compressor.compress(data) + compressor.flush(zlib.Z_FINISH)
+    if len(compressed_data) < len(data):
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        data = compressed_data
+    else:
+        zinfo.compress_type = zipfile.ZIP_STORED  # compressed files (images, archives) are stored
+    zinfo.compress_size = len(data)
+    return (file_path, zinfo, data)
+
+
+def _write_zip_member(zipper, member, level):
+    """writes a compressed member (or a streamed write of a large file) to the _ZipArchiveWriter"""
+    file_path, zinfo, data = member
+    if data is None:
+        zipper.write_file(file_path, zinfo, level)
+    else:
+        zipper.write_compressed(zinfo, data)
+
+
+def _make_zip_info(file_path, file_stat):
+    """returns the ZipInfo for a file with the same fields as ZipFile.write"""
+    zinfo = zipfile.ZipInfo(file_path, time.localtime(file_stat.st_mtime)[0:6])
+    zinfo.external_attr = (file_stat.st_mode & 0xFFFF) << 16
+    zinfo.file_size = file_stat.st_size
+    return zinfo
+
+
+########################################
+#
+#  [incremental_pack_directory]
+#       public function
+#       - content addressed incremental pack
+#
+########################################
+
+def incremental_pack_directory(archive_name, root_dir, zip_archive=False, delta=False, level=None, processes=None, pack_store=None):
+    """writes the [root_dir] directory to a tar.gz (or zip) archive in the current working directory with the compressed files of the doxx pack
+    store, returns the archive file name.  Files with the size and modification time of the last pack of the directory are not read or
+    compressed, the stored raw deflate stream of the file is copied to the archive.  The archives are standard tar.gz and zip archives (the
+    files are compressed as independent deflate streams).  With [delta], the tar.gz archive contains the files that were added or changed
+    since the last pack and a PACK_DELTA_FILE_NAME file that lists the removed paths, doxx unpack applies it to an unpacked copy of the last pack"""
+    if zip_archive and delta:
+        raise ValueError("delta archives are tar.gz archives")
+    if pack_store is None:
+        from doxx.datatypes.cache import DoxxPackStore
+        pack_store = DoxxPackStore()
+    level = get_pack_level('gzip', level, zip_archive=zip_archive)
+    if processes is None or processes < 1:
+        processes = cpu_count()
+    current_dir = os.getcwd()
+    archive_file_name = archive_name + (".zip" if zip_archive else (".delta.tar.gz" if delta else ".tar.gz"))
+    archive_path = os.path.join(current_dir, archive_file_name)
+    previous_manifest = pack_store.get_manifest(root_dir)
+    if previous_manifest is None:
+        previous_manifest = {'id': None, 'files': {}, 'dirs': []}
+    previous_files = previous_manifest['files']
+    manifest = {'id': None, 'root': os.path.abspath(root_dir), 'files': {}, 'dirs': []}
+    out_file = None
+    object_queue = None
+    try:
+        os.chdir(root_dir)
+        entries = _get_pack_entries()
+        # files that were changed since the last pack are read and compressed by the pool threads, in the order of the archive entries
+        compress_paths = []
+        for entry_path, file_stat in entries:
+            if _is_stored_pack_file(file_stat) and not _is_unchanged_pack_file(previous_files.get(entry_path), file_stat):
+                compress_paths.append(entry_path)
+        object_queue = _PackObjectQueue(compress_paths, level, processes, pack_store)
+        if zip_archive:
+            out_file = _ZipArchiveWriter(open(archive_path, 'wb'))
+        else:
+            out_file = _SplicedGzipWriter(open(archive_path, 'wb'), level)
+            delta_entries = []
+        for entry_path, file_stat in entries:
+            pack_object = None
+            if _is_stored_pack_file(file_stat):
+                previous_entry = previous_files.get(entry_path)
+                if _is_unchanged_pack_file(previous_entry, file_stat):
+                    pack_object = _get_stored_pack_object(pack_store, entry_path, previous_entry, level)
+                else:
+                    pack_object = object_queue.next()
+                sha256, crc, compressed_bytes = pack_object
+                manifest['files'][entry_path] = [file_stat.st_size, file_stat.st_mtime, sha256, crc]
+            elif stat.S_ISREG(file_stat.st_mode):
+                manifest['files'][entry_path] = [file_stat.st_size, file_stat.st_mtime, None, None]   # large files are not stored and always packed in a delta
+            elif stat.S_ISDIR(file_stat.st_mode):
+                manifest['dirs'].append(entry_path)
+            if zip_archive:
+                _write_incremental_zip_member(out_file, entry_path, file_stat, pack_object, level)
+            elif delta:
+                if entry_path == "." or _is_delta_entry(previous_manifest, manifest, entry_path, file_stat):
+                    delta_entries.append((entry_path, file_stat, pack_object))
+            else:
+                _write_incremental_tar_member(out_file, entry_path, file_stat, pack_object)
+        manifest['id'] = _make_pack_manifest_id(manifest)
+        if delta:
+            delta_data = json.dumps({'base': previous_manifest['id'], 'target': manifest['id'],
+                                     'removed': _get_removed_pack_paths(previous_manifest, manifest)}, indent=1, sort_keys=True).encode('utf-8')
+            _write_incremental_tar_member(out_file, ".", entries[0][1], None)
+            _write_incremental_tar_data(out_file, "./" + PACK_DELTA_FILE_NAME, delta_data, entries[0][1].st_mtime)
+            for entry_path, file_stat, pack_object in delta_entries[1:]:
+                _write_incremental_tar_member(out_file, entry_path, file_stat, pack_object)
+        if not zip_archive:
+            out_file.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))  # end of archive marker and the padding to a full record (as TarFile.close)
+            out_file.write(tarfile.NUL * ((tarfile.RECORDSIZE - out_file.size % tarfile.RECORDSIZE) % tarfile.RECORDSIZE))
+        out_file.close()
+        out_file = None
+        object_queue.close()
+        os.chdir(current_dir)
+        pack_store.write_manifest(root_dir, manifest)
+        pack_store.prune()
+        return archive_file_name
+    except Exception as e:
+        os.chdir(current_dir)  # if exception was raised, make sure that user is back in their current working directory before raising system exit
+        if object_queue is not None:
+            object_queue.abort()
+        if out_file is not None:
+            out_file.abort()
+        stderr("[!] doxx: Unable to pack the directory '" + root_dir + "'. Error: " + str(e))
+
+
+def _get_pack_entries():
+    """returns the (archive path, lstat result) list for the working directory in the member order of TarFile.add('.'), the archive paths are
+    the tar member names ('.', './dir', './dir/file')"""
+    entries = []
+    pending_paths = ["."]
+    while len(pending_paths) > 0:
+        entry_path = pending_paths.pop()
+        file_stat = os.lstat(entry_path)
+        entries.append((entry_path, file_stat))
+        if stat.S_ISDIR(file_stat.st_mode):
+            pending_paths.extend(entry_path + "/" + file_name for file_name in sorted(os.listdir(entry_path), reverse=True))
+    return entries
+
+
+def _is_stored_pack_file(file_stat):
+    """regular files that are compressed in memory are stored in the pack store, larger files are compressed with a streamed write"""
+    return stat.S_ISREG(file_stat.st_mode) and file_stat.st_size <= PACK_ZIP_MEMORY_LIMIT
+
+
+def _is_unchanged_pack_file(previous_entry, file_stat):
+    return previous_entry is not None and previous_entry[2] is not None and previous_entry[0] == file_stat.st_size and previous_entry[1] == file_stat.st_mtime
+
+
+def _is_delta_entry(previous_manifest, manifest, entry_path, file_stat):
+    """True for the files that were added or changed since the previous pack, new directories, and links"""
+    if stat.S_ISDIR(file_stat.st_mode):
+        return entry_path not in previous_manifest['dirs']
+    if stat.S_ISREG(file_stat.st_mode):
+        previous_entry = previous_manifest['files'].get(entry_path)
+        return previous_entry is None or previous_entry[2] is None or previous_entry[2] != manifest['files'][entry_path][2]
+    return True
+
+
+def _get_removed_pack_paths(previous_manifest, manifest):
+    """files and directories of the previous pack that are not in the manifest, the files in a directory are listed before the directory"""
+    removed_paths = [file_path for file_path in previous_manifest['files'] if file_path not in manifest['files']]
+    dir_paths = set(manifest['dirs'])
+    removed_paths.extend(dir_path for dir_path in previous_manifest['dirs'] if dir_path not in dir_paths)
+    return sorted(removed_paths, reverse=True)
+
+
+def _make_pack_manifest_id(manifest):
+    hasher = hashlib.sha1()
+    for file_path in sorted(manifest['files']):
+        hasher.update((file_path + u"\0" + str(manifest['files'][file_path][2]) + u"\0").encode('utf-8'))
+    for dir_path in sorted(manifest['dirs']):
+        hasher.update((dir_path + u"\1").encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def _get_stored_pack_object(pack_store, file_path, previous_entry, level):
+    """returns the (sha256, crc, compressed bytes) tuple of an unchanged file from the pack store, the file is compressed again if the object
+    was removed from the store or was stored with another compression level"""
+    size, mtime, sha256, crc = previous_entry
+    if size == 0:
+        return (sha256, crc, b"")
+    compressed_bytes = pack_store.get_object(sha256, level)
+    if compressed_bytes is None:
+        sha256, crc, compressed_bytes, is_new = _make_pack_object(file_path, level, pack_store)
+        if is_new:
+            pack_store.add_object(sha256, level, compressed_bytes)
+    return (sha256, crc, compressed_bytes)
+
+
+def _make_pack_object(file_path, level, pack_store):
+    """returns a (sha256, crc, compressed bytes, is_new) tuple for a file.  The compressed bytes are a raw deflate stream that ends with a sync
+    flush (byte aligned, without the final block), the file is not compressed if the pack store has an object with the same bytes"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    crc = zlib.crc32(data) & 0xffffffff
+    if len(data) == 0:
+        return (sha256, crc, b"", False)
+    compressed_bytes = pack_store.get_object(sha256, level)  # renamed and copied files
+    if compressed_bytes is not None:
+        return (sha256, crc, compressed_bytes, False)
+    compressor = _make_raw_compressor(level)
+    return (sha256, crc, compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), True)
+
+
+class _PackObjectQueue(object):
+    """compresses the changed files of an incremental pack with a thread pool, next() returns the pack objects in the order of the file paths.
+    The pool runs at most four files per thread ahead of the archive writes, new objects are added to the pack store in the calling thread"""
+    def __init__(self, file_paths, level, processes, pack_store):
+        self.file_paths = deque(file_paths)
+        self.level = level
+        self.processes = processes
+        self.pack_store = pack_store
+        self.pool = None
+        self.pending_objects = deque()
+        if processes > 1 and len(file_paths) > 1:
+            self.pool = ThreadPool(processes=min(processes, len(file_paths)))
+
+    def next(self):
+        if self.pool is None:
+            pack_object = _make_pack_object(self.file_paths.popleft(), self.level, self.pack_store)
+        else:
+            while len(self.file_paths) > 0 and len(self.pending_objects) < self.processes * 4:
+                self.pending_objects.append(self.pool.apply_async(_make_pack_object, (self.file_paths.popleft(), self.level, self.pack_store)))
+            pack_object = self.pending_objects.popleft().get()
+        sha256, crc, compressed_bytes, is_new = pack_object
+        if is_new:
+            self.pack_store.add_object(sha256, self.level, compressed_bytes)
+        return (sha256, crc, compressed_bytes)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def abort(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+def _make_pack_tarinfo(entry_path, file_stat):
+    """returns the TarInfo for a file system entry with the fields of TarFile.gettarinfo, or None for entry types that are not packed"""
+    tarinfo = tarfile.TarInfo(entry_path)
+    tarinfo.mode = stat.S_IMODE(file_stat.st_mode)
+    tarinfo.uid = file_stat.st_uid
+    tarinfo.gid = file_stat.st_gid
+    tarinfo.mtime = file_stat.st_mtime
+    if stat.S_ISREG(file_stat.st_mode):
+        tarinfo.type = tarfile.REGTYPE
+        tarinfo.size = file_stat.st_size
+    elif stat.S_ISDIR(file_stat.st_mode):
+        tarinfo.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(file_stat.st_mode):
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = os.readlink(entry_path)
+    else:
+        return None  # devices, fifos, and sockets (TarFile.add skips sockets)
+    try:
+        import pwd
+        tarinfo.uname = pwd.getpwuid(tarinfo.uid)[0]
+    except (ImportError, KeyError):
+        pass
+    try:
+        import grp
+        tarinfo.gname = grp.getgrgid(tarinfo.gid)[0]
+    except (ImportError, KeyError):
+        pass
+    return tarinfo
+
+
+def _get_tar_header(tarinfo):
+    return tarinfo.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "strict" if is_py2() else "surrogateescape")
+
+
+def _write_incremental_tar_member(out_file, entry_path, file_stat, pack_object):
+    tarinfo = _make_pack_tarinfo(entry_path, file_stat)
+    if tarinfo is None:
+        return
+    out_file.write(_get_tar_header(tarinfo))
+    if tarinfo.type != tarfile.REGTYPE or tarinfo.size == 0:
+        return
+    if pack_object is not None:
+        sha256, crc, compressed_bytes = pack_object
+        out_file.write_deflated(compressed_bytes, crc, tarinfo.size)
+    else:
+        with open(entry_path, 'rb') as f:   # large files are compressed with a streamed write
+            for chunk in iter(lambda: f.read(PACK_BLOCK_SIZE), b""):
+                out_file.write(chunk)
+    out_file.write(tarfile.NUL * ((tarfile.BLOCKSIZE - tarinfo.size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE))
+
+
+def _write_incremental_tar_data(out_file, member_name, data, mtime):
+    tarinfo = tarfile.TarInfo(member_name)
+    tarinfo.size = len(data)
+    tarinfo.mtime = mtime
+    out_file.write(_get_tar_header(tarinfo))
+    out_file.write(data)
+    out_file.write(tarfile.NUL * ((tarfile.BLOCKSIZE - tarinfo.size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE))
+
+
+def _write_incremental_zip_member(zipper, entry_path, file_stat, pack_object, level):
+    """writes a file to the _ZipArchiveWriter, stored files are written with the compressed bytes of the pack store"""
+    if not stat.S_ISREG(file_stat.st_mode) and not (stat.S_ISLNK(file_stat.st_mode) and os.path.isfile(entry_path)):
+        return  # the directories and files of an os.walk (as zip_package_directory)
+    zip_path = entry_path[2:]
+    if stat.S_ISLNK(file_stat.st_mode):
+        file_stat = os.stat(zip_path)  # the zip member is the link target file (as ZipFile.write)
+    zinfo = _make_zip_info(zip_path, file_stat)
+    if pack_object is None:
+        zipper.write_file(zip_path, zinfo, level)
+        return
+    sha256, crc, compressed_bytes = pack_object
+    zinfo.CRC = crc
+    if file_stat.st_size == 0:
+        data = b""
+        zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+        data = compressed_bytes + _make_raw_compressor(level).flush(zlib.Z_FINISH)  # ends the deflate stream with an empty final block
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.compress_size = len(data)
+    zipper.write_compressed(zinfo, data)
+
+
+class _ZipArchiveWriter(object):
+    """write only zip archive file.  Members are written from compressed data (write_compressed) or with a streamed deflate of a file
+    (write_file), the central directory is written by close.  The local file headers, the central directory, and the zip64 extra fields and
+    end of central directory records for sizes and offsets over PACK_ZIP64_LIMIT are written from the zip format specification (APPNOTE.TXT),
+    ZipFile does not accept compressed member data"""
+    def __init__(self, fileobj):
+        self.fileobj = fileobj     # seekable file, the local header of a streamed member is written again with the CRC and sizes
+        self.members = []          # ZipInfo of the written members in archive order
+
+    def write_compressed(self, zinfo, data):
+        """writes a member with the compressed data, the ZipInfo defines the compress_type, CRC, file_size, and compress_size"""
+        zinfo.header_offset = self.fileobj.tell()
+        self._write_local_header(zinfo, zinfo.file_size > PACK_ZIP64_LIMIT or zinfo.compress_size > PACK_ZIP64_LIMIT)
+        self.fileobj.write(data)
+        self.members.append(zinfo)
+
+    def write_file(self, file_path, zinfo, level):
+        """writes a deflate member with the data of the file at file_path, the file is read and compressed in PACK_BLOCK_SIZE blocks"""
+        zip64 = zinfo.file_size * 1.05 > PACK_ZIP64_LIMIT  # the size estimate of ZipFile, the local header size is defined before the write
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.CRC = 0
+        zinfo.compress_size = 0
+        zinfo.header_offset = self.fileobj.tell()
+        self._write_local_header(zinfo, zip64)
+        compressor = _make_raw_compressor(level)
+        crc = zlib.crc32(b"")
+        file_size = 0
+        compress_size = 0
+        with open(file_path, 'rb') as f:
+            while True:
+                block = f.read(PACK_BLOCK_SIZE)
+                if len(block) == 0:
+                    break
+                crc = zlib.crc32(block, crc)
+                file_size += len(block)
+                compressed_data = compressor.compress(block)
+                compress_size += len(compressed_data)
+                self.fileobj.write(compressed_data)
+        compressed_data = compressor.flush(zlib.Z_FINISH)
+        compress_size += len(compressed_data)
+        self.fileobj.write(compressed_data)
+        if not zip64 and (file_size > PACK_ZIP64_LIMIT or compress_size > PACK_ZIP64_LIMIT):
+            raise RuntimeError("the file '" + file_path + "' was larger than the zip64 size limit of the local file header")
+        zinfo.CRC = crc & 0xffffffff
+        zinfo.file_size = file_size
+        zinfo.compress_size = compress_size
+        end_offset = self.fileobj.tell()
+        self.fileobj.seek(zinfo.header_offset)
+        self._write_local_header(zinfo, zip64)
+        self.fileobj.seek(end_offset)
+        self.members.append(zinfo)
+
+    def close(self):
+        if self.fileobj is None:
+            return
+        directory_offset = self.fileobj.tell()
+        for zinfo in self.members:
+            file_size, compress_size, header_offset = zinfo.file_size, zinfo.compress_size, zinfo.header_offset
+            zip64_fields = []   # the zip64 extra field includes the values that do not fit the central directory header, in this order
+            if file_size > PACK_ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+                file_size = 0xffffffff
+            if compress_size > PACK_ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+                compress_size = 0xffffffff
+            if header_offset > PACK_ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = 0xffffffff
+            extra = b""
+            if len(zip64_fields) > 0:
+                extra = struct.pack("<HH" + "Q" * len(zip64_fields), 1, 8 * len(zip64_fields), *zip64_fields)
+                zinfo.extract_version = max(zinfo.extract_version, 45)
+                zinfo.create_version = max(zinfo.create_version, 45)
+            file_name, flag_bits = _encode_zip_name(zinfo.filename)
+            dos_time, dos_date = _get_dos_time(zinfo.date_time)
+            self.fileobj.write(struct.pack("<4s4B4HL2L5H2L", b"PK\x01\x02", zinfo.create_version, zinfo.create_system, zinfo.extract_version, 0,
+                                           flag_bits, zinfo.compress_type, dos_time, dos_date, zinfo.CRC, compress_size, file_size,
+                                           len(file_name), len(extra), 0, 0, 0, zinfo.external_attr, header_offset))
+            self.fileobj.write(file_name)
+            self.fileobj.write(extra)
+        directory_size = self.fileobj.tell() - directory_offset
+        member_count = len(self.members)
+        if member_count >= 0xffff or directory_size > PACK_ZIP64_LIMIT or directory_offset > PACK_ZIP64_LIMIT:
+            zip64_end_offset = self.fileobj.tell()
+            self.fileobj.write(struct.pack("<4sQ2H2L4Q", b"PK\x06\x06", 44, 45, 45, 0, 0, member_count, member_count, directory_size, directory_offset))
+            self.fileobj.write(struct.pack("<4sLQL", b"PK\x06\x07", 0, zip64_end_offset, 1))
+        self.fileobj.write(struct.pack("<4s4H2LH", b"PK\x05\x06", 0, 0, min(member_count, 0xffff), min(member_count, 0xffff),
+                                       min(directory_size, 0xffffffff), min(directory_offset, 0xffffffff), 0))
+        self.fileobj.close()
+        self.fileobj = None
+
+    def abort(self):
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
+
+    def _write_local_header(self, zinfo, zip64):
+        file_size, compress_size = zinfo.file_size, zinfo.compress_size
+        extra = b""
+        if zip64:
+            extra = struct.pack("<HHQQ", 1, 16, file_size, compress_size)
+            file_size = compress_size = 0xffffffff
+            zinfo.extract_version = max(zinfo.extract_version, 45)
+            zinfo.create_version = max(zinfo.create_version, 45)
+        file_name, flag_bits = _encode_zip_name(zinfo.filename)
+        dos_time, dos_date = _get_dos_time(zinfo.date_time)
+        self.fileobj.write(struct.pack("<4s2B4HL2L2H", b"PK\x03\x04", zinfo.extract_version, 0, flag_bits, zinfo.compress_type, dos_time,
+                                       dos_date, zinfo.CRC, compress_size, file_size, len(file_name), len(extra)))
+        self.fileobj.write(file_name)
+        self.fileobj.write(extra)
+
+
+def _encode_zip_name(file_name):
+    """returns the (encoded member name, general purpose flag bits) tuple, names that are not ASCII are UTF-8 encoded with flag bit 11"""
+    if isinstance(file_name, bytes):
+        return (file_name, 0)  # Python 2 str
+    try:
+        return (file_name.encode('ascii'), 0)
+    except UnicodeEncodeError:
+        return (file_name.encode('utf-8'), 0x800)
+
+
+def _get_dos_time(date_time):
+    """returns the (MS-DOS time, MS-DOS date) tuple of a ZipInfo date_time"""
+    year, month, day, hour, minute, second = date_time
+    return ((hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day)
+
+
+class _SplicedGzipWriter(object):
+    """write only file object that writes a single member gzip stream from compressed data and stored raw deflate streams.  The write method
+    compresses the data (tar headers and padding), write_deflated copies a sync flushed raw deflate stream to the file.  The data before
+    each stored stream is ended with a full flush so that the data after it do not refer to the earlier data, the CRC of a stored stream is
+    combined with the CRC of the earlier data"""
+    def __init__(self, fileobj, level=PACK_COMPRESS_LEVEL):
+        self.fileobj = fileobj
+        self.compressor = _make_raw_compressor(level)
+        self.crc = zlib.crc32(b"") & 0xffffffff
+        self.size = 0
+        self.pending = False   # data were compressed since the last flush
+        xfl = b"\x02" if level == 9 else (b"\x04" if level == 1 else b"\x00")
+        self.fileobj.write(b"\x1f\x8b\x08\x00" + struct.pack("<I", int(time.time()) & 0xffffffff) + xfl + b"\xff")
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffff
+        self.size += len(data)
+        self.fileobj.write(self.compressor.compress(data))
+        self.pending = True
+
+    def write_deflated(self, compressed_bytes, crc, size):
+        if self.pending:
+            self.fileobj.write(self.compressor.flush(zlib.Z_FULL_FLUSH))
+            self.pending = False
+        self.fileobj.write(compressed_bytes)
+        self.crc = _crc32_combine(self.crc, crc, size)
+        self.size += size
+
+    def close(self):
+        if self.fileobj is None:
+            return
+        self.fileobj.write(self.compressor.flush(zlib.Z_FINISH))
+        self.fileobj.write(struct.pack("<II", self.crc, self.size & 0xffffffff))
+        self.fileobj.close()
+        self.fileobj = None
+
+    def abort(self):
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
+
+
+_crc_zero_block = b"\x00" * PACK_BLOCK_SIZE
+
+
+def _crc32_combine(crc1, crc2, length2):
+    """returns the CRC-32 of the concatenated data from the CRC-32 values of the two parts.  The CRC is affine in the data:
+    crc(A + B) = crc(A + zeros) ^ crc(zeros) ^ crc(B) where zeros is a run of len(B) zero bytes"""
+    crc_a = crc1
+    crc_zeros = 0
+    while length2 > 0:
+        zeros = _crc_zero_block if length2 >= len(_crc_zero_block) else _crc_zero_block[:length2]
+        crc_a = zlib.crc32(zeros, crc_a)
+        crc_zeros = zlib.crc32(zeros, crc_zeros)
+        length2 -= len(zeros)
+    return (crc_a ^ crc_zeros ^ crc2) & 0xffffffff
+
+
+########################################
+#
+#  [write_package_manifest]
+#       public function
+#       - package manifest for delta pulls
+#
+########################################
+
+def write_package_manifest(archive_name, root_dir):
+    """writes the package manifest [archive_name].manifest.json and the [archive_name]-objects directory of the [root_dir] files in the current
+    working directory, returns the manifest file name.  The manifest lists the size, SHA-256 hash, and permissions of every file (POSIX paths
+    relative to root_dir) and the object directory contains each file once by its hash.  Publish both next to the package archive, doxx pull
+    of the package then downloads only the files that changed since the last pull"""
+    manifest_file_name = archive_name + ".manifest.json"
+    objects_dir_name = os.path.basename(archive_name) + "-objects"
+    objects_dir_path = os.path.join(os.path.dirname(archive_name), objects_dir_name)
+    manifest = {'format': 1, 'objects': objects_dir_name, 'files': {}, 'dirs': []}
+    if not os.path.isdir(objects_dir_path):
+        os.makedirs(objects_dir_path)
+    for root, dirs, files in os.walk(root_dir):
+        dirs.sort()
+        relative_dir = os.path.relpath(root, root_dir).replace(os.sep, "/")
+        if relative_dir != ".":
+            manifest['dirs'].append(relative_dir)
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            if not os.path.isfile(file_path):
+                continue  # broken links
+            hasher = hashlib.sha256()
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(PACK_BLOCK_SIZE), b""):
+                    hasher.update(chunk)
+            sha256 = hasher.hexdigest()
+            object_path = os.path.join(objects_dir_path, sha256)
+            if not os.path.isfile(object_path):
+                shutil.copyfile(file_path, object_path)
+            member_path = file_name if relative_dir == "." else relative_dir + "/" + file_name
+            manifest['files'][member_path] = [os.path.getsize(file_path), sha256, stat.S_IMODE(os.stat(file_path).st_mode)]
+    with open(manifest_file_name, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest_file_name
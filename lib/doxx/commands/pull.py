@@ -1,16 +1,28 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import os
 import gzip
+import json
 import shutil
-import requests
+import hashlib
+import tarfile
+import posixpath
 from os import remove, rename, makedirs
-from os.path import join, dirname, basename
-from Naked.toolshed.network import HTTP
+from os.path import join
 from Naked.toolshed.file import FileWriter
 from Naked.toolshed.system import stderr, stdout, file_exists, dir_exists
 from Naked.toolshed.python import is_py3
-from doxx.commands.unpack import unpack_run
+from doxx.commands.unpack import unpack_run, unpack_targz_stream, unpack_targz_stream_members
+from doxx.datatypes.manifest import DoxxPullManifest, hash_file
+from doxx.utilities.fetcher import fetch_all, fetch_binary_file, fetch_text, open_stream, FetchError
+from doxx.utilities.filesystem import _create_dirs, _replace_file
+from doxx.utilities.profiler import timed_function
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
 
 
 def run_pull(url):
@@ -23,19 +35,14 @@ def run_pull(url):
         # begin file pull
         stdout("[*] doxx: Pulling file...")
             
-        if is_tar_gz_archive(file_name):
+        if is_tar_archive(file_name):
             root_dir = None
             try:
-                pull_binary_file(url, file_name)      # pull remote file
-            except Exception as e:
-                stderr("[!] doxx: Unable to pull the tar.gz project. Error: " + str(e), exit=1)
-            stdout("[*] doxx: Unpacking...")
-            try:
-                root_dir = unpack_archive(file_name)             # unpack archive and define the root directory
+                root_dir = pull_targz_archive(url)    # the archive is unpacked as it is downloaded, returns the root directory
+            except FetchError as e:
+                stderr("[!] doxx: Unable to pull the tar project. Error: " + str(e), exit=1)
             except Exception as e:
                 stderr("[!] doxx: Unable to unpack the compressed project file. Error: " + str(e), exit=1)
-            if file_exists(file_name):
-                remove_file(file_name)                # remove the archive file
             if file_exists('pkey.yaml'):
                 if not file_exists('key.yaml'):
                     rename('pkey.yaml', 'key.yaml')   # change name of pkey.yaml to key.yaml if there is not already a key.yaml file
@@ -104,7 +111,6 @@ def run_pull(url):
                         repo_parts = short_code_parts[1].split(':')
                         repo = repo_parts[0]
                         branch = repo_parts[1]
-                        targz_filename = repo + "-" + branch + ".tar.gz"
                         url = "https://github.com/{{user}}/{{repository}}/archive/{{branch}}.tar.gz"
                         url = url.replace("{{user}}", user)
                         url = url.replace("{{repository}}", repo)
@@ -117,7 +123,6 @@ def run_pull(url):
                             stderr("[!] doxx: the short code for Github repositories does not have the proper format")
                             stderr("[!] doxx: the syntax is `user/repository[:branch][+cherrypick_path]`", exit=1)                        
                         repo = short_code_parts[1]
-                        targz_filename = repo + "-master.tar.gz"
                         url = "https://github.com/{{user}}/{{repository}}/archive/master.tar.gz"
                         url = url.replace("{{user}}", user)
                         url = url.replace("{{repository}}", repo)
@@ -126,82 +131,30 @@ def run_pull(url):
                     # notify user of the pull   
                     stdout(user_message)
                         
-                    try:
-                        pull_binary_file(url, targz_filename)  # pull the archive file
-                    except Exception as e:
-                        stderr("[!] doxx: Unable to pull the Github repository.  Error: " + str(e), exit=1)
-                        
-                    if file_exists(targz_filename):
+                    # Did user request keep of a specific file or directory path?
+                    if keep_a_file_or_dir is True:
+                        # only the archive members under the cherry pick path are extracted as the archive is downloaded
+                        cherry_pick = None
                         try:
-                            # Unpack and remove the archive file
-                            targz_basename = unpack_archive(targz_filename)  # unpack the archive locally
-                            remove(targz_filename)                           # remove the archive file
+                            cherry_pick = pull_github_cherry_pick(url, keep_path)
+                        except FetchError as e:
+                            stderr("[!] doxx: Unable to pull the Github repository.  Error: " + str(e), exit=1)
+                        except ValueError as e:
+                            stderr("[!] doxx: " + str(e), exit=1)
                         except Exception as e:
-                            stderr("[!] doxx: Unable to unpack the pulled Github repository. Error: " + str(e), exit=1)                        
-                            
+                            stderr("[!] doxx: Unable to process the requested keep file or directory path. Error: " + str(e), exit=1)
+                        if cherry_pick.local_path is None:  # could not find the file or dir in the pulled repo
+                            stderr("[!] doxx: '" + keep_path + "' does not appear to be a file or directory in the pulled repository.", exit=1)
+                    else:
+                        targz_basename = None
                         try:
-                            # Did user request keep of a specific file or directory path?
-                            if keep_a_file_or_dir is True:
-                                # is this a multilevel path request?
-                                # if so, make OS dependent file path from the user argument (keep path argument syntax uses POSIX path style on all platforms)
-                                if "/" in keep_path:
-                                    keep_path_parts = keep_path.split('/')
-                                    keep_path_depth = len(keep_path_parts)
-                                    if keep_path_depth > 3:
-                                        stderr("[!] doxx: doxx supports up to 3 levels of depth in the cherry pick shortcode path. Your request exceeded that level and the requested file or directory was not cherry picked from the repository.", exit=1)
-                                    
-                                    # make the OS dependent paths
-                                    if keep_path_depth == 2:
-                                        path_part_one = keep_path_parts[0]
-                                        path_part_two = keep_path_parts[1]
-                                        keep_path = join(path_part_one, path_part_two)
-                                    elif keep_path_depth == 3:
-                                        path_part_one = keep_path_parts[0]
-                                        path_part_two = keep_path_parts[1]
-                                        path_part_three = keep_path_parts[2]
-                                        keep_path = join(path_part_one, path_part_two, path_part_three)
-                                else:
-                                    keep_path_depth = 1  # need to have a definition of depth of file/dir keep for mkdirs code below
-                                    
-                                joined_keep_path = join(targz_basename, keep_path)  # the path to the local version of the file or directory following pull
-                                
-                                if dir_exists(joined_keep_path):
-                                    stdout("[*] doxx: Cherry picking the directory '" + keep_path + "'")
-                                    if dir_exists(keep_path):
-                                        new_dir_path = keep_path + "-new"
-                                        if dir_exists(new_dir_path):
-                                            shutil.rmtree(new_dir_path)
-                                        stdout("[*] doxx: The requested directory already exists locally. Writing to '" + new_dir_path + "' instead.")
-                                        shutil.copytree(joined_keep_path, new_dir_path)  # write to `dir-new` instead of existing `dir`
-                                        shutil.rmtree(targz_basename)                    # remove the pulled repository file
-                                    else:
-                                        shutil.copytree(joined_keep_path, keep_path)     # write to the requested dir path
-                                        shutil.rmtree(targz_basename)                    # remove the pulled repository file
-                                elif file_exists(joined_keep_path):
-                                    stdout("[*] doxx: Cherry picking the file '" + keep_path + "'")
-                                    local_filepath = basename(keep_path)  # outfile write path (filename to root directory where user pulled)
-                                    ## NEW
-                                    # handle file path if the file already exists to avoid overwrite
-                                    if file_exists(local_filepath):       # the file already exists in the local directory
-                                        if '.' in local_filepath:
-                                            file_name_parts = local_filepath.split('.')
-                                            file_name_parts[0] = file_name_parts[0] + "-new"  # add '-new' to the basename of the file, not extension
-                                            local_filepath = '.'.join(file_name_parts)
-                                        else:
-                                            local_filepath = local_filepath + "-new"         # add '-new' to the filename (that does not have an extension)
-                                        stdout("[*] doxx: The requested file already exists in the working directory.  Writing the new file to '" + local_filepath + "' instead.")
-                                        
-                                    # write the file
-                                    shutil.copy2(joined_keep_path, local_filepath)
-                                    # remove the tar.gz archive file
-                                    shutil.rmtree(targz_basename)
-                                else:  # could not find the file or dir in the pulled repo
-                                    stderr("[!] doxx: '" + joined_keep_path + "' does not appear to be a file or directory in the pulled repository.  The entire pulled repository was left in the working directory for review.", exit=1)
+                            targz_basename = pull_targz_archive(url)  # the archive is unpacked as it is downloaded, returns the root directory
+                        except FetchError as e:
+                            stderr("[!] doxx: Unable to pull the Github repository.  Error: " + str(e), exit=1)
                         except Exception as e:
-                            stderr("[!] doxx: Unable to process the requested keep file or directory path. Error" + str(e), exit=1)
-                    
-                    else:  # archive file not found locally
-                        stderr("[!] doxx: The Github repository pull did not complete successfully.  Please try again.")
+                            stderr("[!] doxx: Unable to unpack the pulled Github repository. Error: " + str(e), exit=1)
+                        if targz_basename is None:  # empty archive
+                            stderr("[!] doxx: The Github repository pull did not complete successfully.  Please try again.")
                 else:  # length of short_code_parts > 2
                     stderr("[!] doxx: Short code syntax for Github repository pulls:", exit=0)
                     stderr("    $ doxx pull user/repository")
@@ -216,23 +169,16 @@ def run_pull(url):
             package_name = url
             package = OfficialPackage()
             package_url = package.get_package_targz_url(package_name)
-            package_archive_name = package_name + ".tar.gz"
             root_dir = None
             # pull the package archive file
             stdout("[*] doxx: Pulling package '" + package_name + "'...")
             try:
-                pull_binary_file(package_url, package_archive_name)
-            except Exception as e:
+                # only the files that changed since the last pull of the package are written (and downloaded if the package has a manifest)
+                root_dir = pull_package_delta(package_name, package_url, package.get_package_manifest_url(package_name))
+            except FetchError as e:
                 stderr("[!] doxx: Unable to pull the doxx repository package.  Error: " + str(e), exit=1)
-            # unpack the archive file
-            stdout("[*] doxx: Unpacking...")
-            try:
-                root_dir = unpack_archive(package_archive_name)             # unpack archive and define the root directory
             except Exception as e:
-                stderr("[!] doxx: Unable to unpack the project package. Error: " + str(e), exit=1)            
-            # remove the archive file
-            if file_exists(package_archive_name):
-                remove_file(package_archive_name)                # remove the archive file
+                stderr("[!] doxx: Unable to unpack the project package. Error: " + str(e), exit=1)
             if file_exists('pkey.yaml'):
                 if not file_exists('key.yaml'):
                     rename('pkey.yaml', 'key.yaml')              # change name of pkey.yaml to key.yaml if there is not already a key.yaml file            
@@ -255,6 +201,15 @@ def is_tar_gz_archive(file_name):
         return False
 
 
+def is_tar_archive(file_name):
+    """test for tar archive file extensions (uncompressed, gzip, bzip2, xz), the compression is identified from the archive data"""
+    lower_file_name = file_name.lower()
+    for extension in ('.tar', '.tar.gz', '.tar.gzip', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz'):
+        if lower_file_name.endswith(extension):
+            return True
+    return False
+
+
 def is_zip_archive(file_name):
     """test for zip file archive extension"""
     if file_name.lower().endswith('.zip'):
@@ -280,62 +235,268 @@ def get_file_name(url):
 
 def pull_binary_file(url, binary_file_name):
     """pulls a remote binary file and writes to disk"""
-    # solution from http://stackoverflow.com/questions/16694907/how-to-download-large-file-in-python-with-requests-py
-    # note: keep the stream=True to write to disk in chunks
+    # the file is streamed to disk in chunks by the fetcher
     try:
-        r = requests.get(url, stream=True)
-        if r.status_code == requests.codes.ok:
-            with open(binary_file_name, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=10240):   # pull in 10kb chunks & write out
-                    if chunk: # filter out keep-alive new chunks
-                        f.write(chunk)
-                        f.flush()
-        elif r.status_code == 404:
-            stderr("[!] doxx: Unable to pull '" + url + "' because it cannot be found. (HTTP status code: 404)", exit=1)
-        else:
-            stderr("[!] doxx: Unable to pull '" + url + "'. HTTP status code: " + str(r.status_code), exit=1)
+        fetch_binary_file(url, binary_file_name)
+    except FetchError as e:
+        stderr(str(e), exit=1)
     except Exception as e:
         stderr("[!] doxx: Unable to pull '" + url + "'. Error: " + str(e), exit=1)
         
         
 def pull_archive_file(url, archive_filename):
     """pulls a remote binary archive file and writes to disk"""
-    # solution from http://stackoverflow.com/questions/16694907/how-to-download-large-file-in-python-with-requests-py
-    # note: keep the stream=True to write to disk in chunks
-    try:
-        r = requests.get(url, stream=True)
-        if r.status_code == requests.codes.ok:
-            with open(archive_filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=10240):   # pull in 10kb chunks & write out
-                    if chunk: # filter out keep-alive new chunks
-                        f.write(chunk)
-                        f.flush()
-        elif r.status_code == 404:
-            stderr("[!] doxx: Unable to pull '" + url + "' because it cannot be found. (HTTP status code: 404)", exit=1)
-        else:
-            stderr("[!] doxx: Unable to pull '" + url + "'. HTTP status code: " + str(r.status_code), exit=1)
-    except Exception as e:
-        stderr("[!] doxx: Unable to pull '" + url + "'. Error: " + str(e), exit=1)
+    pull_binary_file(url, archive_filename)
 
 
 def pull_text_file(url, text_file_name):
     """pulls a remote text file and writes to disk"""
-    # pull the binary file data
-    http = HTTP(url)
     try:
-        if http.get_status_ok():
-            text_data = http.res.text
-            # write text data to disk
-            try:
-                fw = FileWriter(text_file_name)
-                fw.write(text_data)
-            except Exception as e:
-                stderr("[!] doxx: File write failed for '" + text_file_name + "'.  Error: " + str(e), exit=1)
+        text_data = fetch_text(url)
+    except FetchError as e:
+        if e.status_code is not None:
+            stderr("[!] doxx: Unable to pull '" + url + "' (HTTP status code " + str(e.status_code) + ")", exit=1)
         else:
-            fail_status_code = http.res.status_code
-            stderr("[!] doxx: Unable to pull '" + url + "' (HTTP status code " + str(fail_status_code) + ")", exit=1)
+            stderr(str(e), exit=1)
+    # write text data to disk
+    try:
+        fw = FileWriter(text_file_name)
+        fw.write(text_data)
     except Exception as e:
-        stderr("[!] doxx: Unable to pull '" + url + "'. Error: " + str(e), exit=1)
+        stderr("[!] doxx: File write failed for '" + text_file_name + "'.  Error: " + str(e), exit=1)
+
+
+@timed_function("fetch")  # the download and the unpack overlap, timed as a fetch
+def pull_targz_archive(url):
+    """pulls a remote tar archive (gzip, bzip2, xz, or uncompressed) and unpacks it in the working directory as the data arrives, returns the
+    root directory of the archive"""
+    # the archive is not written to disk, the HTTP response stream is read by tarfile in stream mode
+    stream = open_stream(url)
+    try:
+        return unpack_targz_stream(stream)
+    finally:
+        stream.close()
+
+
+########################################
+#
+#  [pull_package_delta]
+#       public function
+#       - delta update of a package pull
+#
+########################################
+
+@timed_function("fetch")
+def pull_package_delta(package_name, archive_url, manifest_url=None):
+    """pulls a package to the working directory and writes only the files that differ from the local files, unchanged files are not touched.
+    The hashes of the written files are recorded in the DoxxPullManifest of the package.  If the package was pulled to the directory before
+    and the server publishes a package manifest at [manifest_url] (doxx pack --manifest), only the changed files are downloaded.  Otherwise
+    the archive at [archive_url] is read as it is downloaded and the unchanged members are skipped.  Files of the last pull that were removed
+    from the package are reported and kept.  Returns the root directory of the archive ('.' for manifest pulls)"""
+    pull_manifest = DoxxPullManifest(package_name)
+    package_manifest = None
+    if manifest_url is not None and pull_manifest.exists:
+        try:
+            package_manifest = json.loads(fetch_text(manifest_url))
+        except (FetchError, ValueError):
+            package_manifest = None  # the server does not publish package manifests, pull the archive
+    if package_manifest is not None:
+        root_dir, written_paths = _pull_package_manifest_files(package_manifest, manifest_url, pull_manifest)
+    else:
+        root_dir, written_paths = _pull_package_archive_files(archive_url, pull_manifest)
+    stale_paths = pull_manifest.get_stale_files()
+    if pull_manifest.exists:
+        stdout("[*] doxx: Package update: " + str(len(written_paths)) + " files written, " + str(len(pull_manifest.pulled) - len(written_paths)) +
+               " unchanged")
+    if len(stale_paths) > 0:
+        stdout("[*] doxx: These files of the last pull are no longer in the package and were not removed:")
+        for file_path in stale_paths:
+            stdout("    " + file_path)
+    pull_manifest.write()
+    return root_dir
+
+
+def _get_package_local_path(member_path):
+    """returns the local path for a POSIX package member path, None for the package root directory and paths outside of it"""
+    member_path = posixpath.normpath(member_path.replace("\\", "/"))
+    if member_path in ("", ".") or posixpath.isabs(member_path) or ".." in member_path.split("/"):
+        return None
+    return join(*member_path.split("/"))
+
+
+def _is_package_link_target(linkname):
+    """returns True for link targets that are relative paths without parent directory references (the member path rules)"""
+    linkname = linkname.replace("\\", "/")
+    return linkname != "" and not posixpath.isabs(linkname) and ".." not in linkname.split("/")
+
+
+def _pull_package_manifest_files(package_manifest, manifest_url, pull_manifest):
+    """downloads the files of a package manifest that differ from the local files from the object directory of the manifest"""
+    objects_url = urljoin(manifest_url, package_manifest.get('objects', 'objects') + "/")
+    for dir_path in package_manifest['dirs']:
+        local_path = _get_package_local_path(dir_path)
+        if local_path is not None and not dir_exists(local_path):
+            makedirs(local_path)
+    pending_files = {}  # temporary file path : (local path, sha256, mode)
+    url_dict = {}
+    for member_path, (size, sha256, mode) in package_manifest['files'].items():
+        local_path = _get_package_local_path(member_path)
+        if local_path is None:
+            continue
+        if pull_manifest.is_current(local_path, sha256):
+            pull_manifest.update_entry(local_path, sha256)
+            continue
+        temp_path = local_path + ".doxx-delta"   # the downloads are checked before they replace the local files
+        pending_files[temp_path] = (local_path, sha256, mode)
+        url_dict[temp_path] = objects_url + sha256
+    written_paths = []
+    errors = []
+    try:
+        for temp_path, url, result, error in fetch_all(fetch_binary_file, url_dict):
+            if error is not None:
+                errors.append(error)
+                continue
+            local_path, sha256, mode = pending_files[temp_path]
+            if hash_file(temp_path, "sha256") != sha256:
+                errors.append("[!] doxx: The download of '" + local_path + "' from '" + url + "' does not match the package manifest.")
+                continue
+            os.chmod(temp_path, mode)
+            _replace_file(temp_path, local_path)
+            pull_manifest.update_entry(local_path, sha256)
+            written_paths.append(local_path)
+    finally:
+        for temp_path in pending_files:
+            if file_exists(temp_path):
+                remove(temp_path)
+    if len(errors) > 0:
+        pull_manifest.write()  # the files that were written are not downloaded again
+        raise FetchError(manifest_url, errors[0])
+    return (".", written_paths)
+
+
+def _pull_package_archive_files(archive_url, pull_manifest):
+    """reads a package archive as it is downloaded and writes the file members that differ from the local files"""
+    root_dir = None
+    written_paths = []
+    stream = open_stream(archive_url)
+    try:
+        tar = tarfile.open(fileobj=stream, mode="r|*")
+        try:
+            for tarinfo in tar:
+                if root_dir is None:
+                    root_dir = tarinfo.name
+                local_path = _get_package_local_path(tarinfo.name)
+                if local_path is None:
+                    continue
+                if tarinfo.isdir():
+                    if not dir_exists(local_path):
+                        makedirs(local_path)
+                elif tarinfo.isfile():
+                    data = tar.extractfile(tarinfo).read()
+                    sha256 = hashlib.sha256(data).hexdigest()
+                    if not pull_manifest.is_current(local_path, sha256):
+                        _write_package_file(local_path, data, tarinfo.mode, tarinfo.mtime)
+                        written_paths.append(local_path)
+                    pull_manifest.update_entry(local_path, sha256)
+                elif tarinfo.issym() or tarinfo.islnk():
+                    # a link outside of the package would redirect the writes of the later members under the link path
+                    if not _is_package_link_target(tarinfo.linkname):
+                        stderr("[!] doxx: The package link '" + tarinfo.name + "' to '" + tarinfo.linkname + "' is outside of the package and was not written.", exit=0)
+                        continue
+                    tarinfo.name = local_path
+                    tar.extract(tarinfo)
+                # other member types (devices, FIFOs) are not package files
+        finally:
+            tar.close()
+    finally:
+        stream.close()
+    return (root_dir, written_paths)
+
+
+def _write_package_file(local_path, data, mode, mtime):
+    """writes the member data through a temporary file with the permissions and modification time of the member (as TarFile.extract)"""
+    _create_dirs(local_path)
+    temp_path = local_path + ".doxx-delta"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.chmod(temp_path, mode)
+        os.utime(temp_path, (mtime, mtime))
+        _replace_file(temp_path, local_path)
+    finally:
+        if file_exists(temp_path):
+            remove(temp_path)
+
+
+def pull_github_cherry_pick(url, keep_path):
+    """pulls the file or directory at keep_path (POSIX style path relative to the repository root directory) from a Github repository
+    tar.gz archive.  Only the archive members under keep_path are written to disk.  Returns the GithubCherryPick (local_path is None if
+    keep_path was not found in the repository)"""
+    cherry_pick = GithubCherryPick(keep_path)
+    stream = open_stream(url)
+    try:
+        unpack_targz_stream_members(stream, cherry_pick.get_local_path)
+    finally:
+        stream.close()
+    return cherry_pick
+
+
+class GithubCherryPick(object):
+    """Maps the members of a Github repository archive to local paths for a cherry picked file or directory path"""
+    def __init__(self, keep_path):
+        self.keep_path = posixpath.normpath(keep_path.strip('/'))
+        if self.keep_path in ('', '.') or self.keep_path == '..' or self.keep_path.startswith('../'):
+            raise ValueError("'" + keep_path + "' is not a valid cherry pick path in the repository.")
+        self.local_path = None   # local file or directory path for the cherry picked path, assigned when the path is found in the archive
+        self.is_dir = False
+
+    def get_local_path(self, tarinfo):
+        """returns the local path for the archive member or None if the member is not in the cherry picked path"""
+        member_path = tarinfo.name.split('/', 1)
+        if len(member_path) < 2:
+            return None  # the repository root directory
+        member_path = member_path[1]  # path relative to the repository root directory
+        if member_path == self.keep_path:
+            if tarinfo.isdir():
+                self._set_local_dir_path()
+                return self.local_path
+            elif tarinfo.isfile():
+                self._set_local_file_path()
+                return self.local_path
+        elif member_path.startswith(self.keep_path + '/'):
+            if self.local_path is None:
+                self._set_local_dir_path()  # archives do not require entries for directories
+            if self.is_dir:
+                member_sub_path = member_path[len(self.keep_path) + 1:].split('/')
+                if '..' not in member_sub_path:
+                    return join(self.local_path, *member_sub_path)
+        return None
+
+    def _set_local_dir_path(self):
+        local_dir_path = join(*self.keep_path.split('/'))  # OS dependent path from the POSIX style user argument
+        stdout("[*] doxx: Cherry picking the directory '" + local_dir_path + "'")
+        if dir_exists(local_dir_path):
+            new_dir_path = local_dir_path + "-new"
+            if dir_exists(new_dir_path):
+                shutil.rmtree(new_dir_path)
+            stdout("[*] doxx: The requested directory already exists locally. Writing to '" + new_dir_path + "' instead.")
+            local_dir_path = new_dir_path  # write to `dir-new` instead of existing `dir`
+        self.local_path = local_dir_path
+        self.is_dir = True
+
+    def _set_local_file_path(self):
+        stdout("[*] doxx: Cherry picking the file '" + self.keep_path + "'")
+        local_filepath = posixpath.basename(self.keep_path)  # outfile write path (filename to root directory where user pulled)
+        # handle file path if the file already exists to avoid overwrite
+        if file_exists(local_filepath):       # the file already exists in the local directory
+            if '.' in local_filepath:
+                file_name_parts = local_filepath.split('.')
+                file_name_parts[0] = file_name_parts[0] + "-new"  # add '-new' to the basename of the file, not extension
+                local_filepath = '.'.join(file_name_parts)
+            else:
+                local_filepath = local_filepath + "-new"         # add '-new' to the filename (that does not have an extension)
+            stdout("[*] doxx: The requested file already exists in the working directory.  Writing the new file to '" + local_filepath + "' instead.")
+        self.local_path = local_filepath
 
 
 def unpack_archive(archive_file_name):
@@ -358,14 +519,14 @@ def decompress_gzip(gz_filename):
     # get the base file name for the decompressed file write
     filename_split = gz_filename.split('.')
     if len(filename_split) == 2:
-        basename = filename_split[0]
+        out_filename = filename_split[0]
     elif len(filename_split) > 2:
-        basename = filename_split[0] + '.' + filename_split[1]  # concatenate first two parts of file name (e.g. example + '.' + 'tar' )
+        out_filename = filename_split[0] + '.' + filename_split[1]  # concatenate first two parts of file name (e.g. example + '.' + 'tar' )
     else:
-        basename = gz_filename
+        out_filename = gz_filename
         
     # write the file locally
-    fw = FileWriter(basename)
+    fw = FileWriter(out_filename)
     fw.write(file_content)
 
 
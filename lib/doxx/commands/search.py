@@ -5,6 +5,7 @@ import heapq
 
 from doxx.datatypes.package import OfficialPackage
 from doxx.utilities.fuzzysearch import FuzzySearcher
+from doxx.utilities.searchindex import BigramIndex, hash_package_list
 from doxx.datatypes.cache import DoxxCache
 from Naked.toolshed.system import stdout, stderr
 from Naked.toolshed.network import HTTP
@@ -15,10 +16,40 @@ def run_search(search_string):
     stdout("[*] doxx: Searching remote doxx repositories...")
     master_text = _get_master_text()
     master_list = _get_master_list(master_text)
-    search_word_count = len(search_string.split(" "))
+    candidate_list = _get_candidate_list(search_string, master_text, master_list)
     
     # fuzzy search for user search string
     fuzzy = FuzzySearcher(search_string)
+    best_results, possible_results = _rank_repositories(fuzzy, search_string, candidate_list)
+    
+    # the possible results are reported when there are no best results, names without a common bigram can still reach the possible
+    # results ratio (0.6), search the entire list
+    if len(best_results) == 0 and candidate_list is not master_list:
+        best_results, possible_results = _rank_repositories(fuzzy, search_string, master_list)
+    
+    # report results of the fuzzy search for the user's search term
+    final_best_results = _get_maxheap_results_list(best_results)
+    final_possible_results = _get_maxheap_results_list(possible_results)
+    
+    if len(final_best_results) > 0:
+        stdout(" ")
+        for result in final_best_results:
+            stdout(result)
+    elif len(final_possible_results) > 0:
+        stdout("[*] doxx: There were no good matches for your search term.")
+        stdout("[*] doxx: Do any of these work? :")
+        stdout(" ")
+        for result in final_possible_results:
+            stdout(result)
+        pass  # handle with possible results
+    else:
+        stdout("[*] doxx: No matches found in the Package Repository.")
+        stdout("[*] doxx: Get in touch so that we can build it...")   ## TODO: add mechanism for user package submit
+        
+    
+def _rank_repositories(fuzzy, search_string, repository_list):
+    """returns the (best results, possible results) maxheaps of the FuzzySearcher ratios for the repository names"""
+    search_word_count = len(search_string.split(" "))
     
     # maxheaps for best results and possible results
     best_results = []
@@ -29,7 +60,7 @@ def run_search(search_string):
     possible_index = 0
     
     # iterate through the repository names
-    for repository in master_list:
+    for repository in repository_list:
         best_ratio = 0
         continue_match_attempts = True
         
@@ -100,27 +131,10 @@ def run_search(search_string):
             elif best_ratio > 0.6 and best_ratio <= 0.8:
                 heapq.heappush(possible_results, (-best_ratio, possible_index, repository))
                 possible_index += 1
-                
-    # report results of the fuzzy search for the user's search term
-    final_best_results = _get_maxheap_results_list(best_results)
-    final_possible_results = _get_maxheap_results_list(possible_results)
-    
-    if len(final_best_results) > 0:
-        stdout(" ")
-        for result in final_best_results:
-            stdout(result)
-    elif len(final_possible_results) > 0:
-        stdout("[*] doxx: There were no good matches for your search term.")
-        stdout("[*] doxx: Do any of these work? :")
-        stdout(" ")
-        for result in final_possible_results:
-            stdout(result)
-        pass  # handle with possible results
-    else:
-        stdout("[*] doxx: No matches found in the Package Repository.")
-        stdout("[*] doxx: Get in touch so that we can build it...")   ## TODO: add mechanism for user package submit
-        
     
+    return (best_results, possible_results)
+
+
 def _get_master_text():
     ## check the cache for a cached version of the file with appropriate cache duration
     cache = DoxxCache()
@@ -157,6 +171,31 @@ def _get_master_list(master_text):
     return master_text.split('\n')
 
 
+def _get_candidate_list(search_string, master_text, master_list):
+    """returns the repository names that share a bigram with the search string (in the master list order), or the entire
+    master list if the search string is too short for the bigram bound"""
+    # names without a common bigram cannot reach the 0.8 ratio for a best result (see BigramIndex)
+    search_index = _get_search_index(master_text, master_list)
+    candidate_indices = search_index.get_candidate_indices(search_string)
+    if candidate_indices is None:
+        return master_list
+    return [master_list[index] for index in candidate_indices]
+
+
+def _get_search_index(master_text, master_list):
+    """returns the bigram index for the master list from the cache, the index is rebuilt and cached when the master list changes"""
+    cache = DoxxCache()
+    list_hash = hash_package_list(master_text)
+    index_bytes = cache.get_cached_packagerepo_index()
+    if index_bytes is not None:
+        search_index = BigramIndex.loads(index_bytes)
+        if search_index is not None and search_index.list_hash == list_hash:
+            return search_index
+    search_index = BigramIndex.build(master_list, list_hash)
+    cache.cache_packagerepo_index(search_index.dumps())
+    return search_index
+
+
 def _get_maxheap_results_list(maxheap_object):
     results_list = []
     for x in range(len(maxheap_object)):
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import sys
+import json
+import socket
+
+# the build client is imported on every `doxx build`, server modules (Builder, caches) are imported in run_serve
+SERVE_SOCKET_ENVIRONMENT_VARIABLE = "DOXX_SOCKET"   # override the default Unix domain socket path
+SERVE_MESSAGE_MAX_BYTES = 65536                     # maximum request / response message size
+OFFLINE_ENVIRONMENT_VARIABLE = "DOXX_OFFLINE"       # fetcher.OFFLINE_ENVIRONMENT_VARIABLE
+
+
+########################################
+#
+#  [get_socket_path]
+#       public function
+#       - default doxx serve socket path
+#
+########################################
+
+def get_socket_path():
+    """returns the Unix domain socket path for the doxx serve daemon of the current user"""
+    socket_path = os.environ.get(SERVE_SOCKET_ENVIRONMENT_VARIABLE, "")
+    if socket_path != "":
+        return socket_path
+    return os.path.join(os.environ.get("TMPDIR", "/tmp"), "doxx-" + str(os.getuid()) + ".sock")
+
+
+def is_serve_supported():
+    """returns True if the platform supports Unix domain sockets with file descriptor passing (Python 3.3+ on Unix)"""
+    return hasattr(socket, "AF_UNIX") and hasattr(socket.socket, "sendmsg")
+
+
+########################################
+#
+#  [forward_build]
+#       public function
+#       - thin client for doxx build
+#
+########################################
+
+def forward_build(key_path, incremental=False, processes=None, offline=False):
+    """sends a build request to the doxx serve daemon.  The daemon writes the build output to the stdout and stderr of this process.
+    Returns the build exit code or None if the daemon is not running (the caller builds locally)"""
+    if not is_serve_supported():
+        return None
+    connection = _connect(get_socket_path())
+    if connection is None:
+        return None
+    request = _get_build_request(key_path, incremental, processes, offline)
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        _send_message(connection, request, [sys.stdout.fileno(), sys.stderr.fileno()])
+        response = _receive_message(connection)[0]
+    except (socket.error, ValueError):
+        response = None
+    finally:
+        connection.close()
+    if response is None:
+        sys.stderr.write("[!] doxx: The doxx serve daemon closed the connection before the build completed.\n")
+        return 1
+    return response.get('exit', 1)
+
+
+def _get_build_request(key_path, incremental, processes, offline):
+    """returns the build request message.  The offline state of the client (--offline option or the DOXX_OFFLINE environment
+    variable of the client shell) is sent with the request, the daemon environment is not used for the build"""
+    return {
+        'command': 'build',
+        'cwd': os.getcwd(),
+        'key_path': key_path,
+        'incremental': incremental,
+        'processes': processes,
+        'offline': offline or os.environ.get(OFFLINE_ENVIRONMENT_VARIABLE, "") not in ("", "0"),  # fetcher.is_offline_mode (not imported in the client)
+    }
+
+
+def stop_serve(socket_path=None):
+    """asks a running doxx serve daemon to stop, returns True if a daemon was running"""
+    connection = _connect(socket_path or get_socket_path())
+    if connection is None:
+        return False
+    try:
+        _send_message(connection, {'command': 'stop'})
+        _receive_message(connection)
+    finally:
+        connection.close()
+    return True
+
+
+########################################
+#
+#  [run_serve]
+#       public function
+#       - doxx serve daemon
+#
+########################################
+
+def run_serve(socket_path=None):
+    """runs the build daemon until a stop request, SIGTERM, or Ctrl-C.  Builds run one at a time in this process with the
+    working directory and the stdout / stderr file descriptors of the client, parsed keys and compiled templates stay in memory"""
+    import signal
+    import importlib
+    from Naked.toolshed.system import stderr, stdout
+    from doxx.datatypes.cache import enable_compiled_template_memory
+    from doxx.datatypes.key import enable_key_memory
+
+    if not is_serve_supported():
+        stderr("[!] doxx: The serve command requires Unix domain sockets and Python 3.3 or later.", exit=1)
+    if socket_path is None:
+        socket_path = get_socket_path()
+
+    # a socket file without a daemon is left by a daemon that was killed, replace it
+    existing_connection = _connect(socket_path)
+    if existing_connection is not None:
+        existing_connection.close()
+        stderr("[!] doxx: A doxx serve daemon is already running on '" + socket_path + "'.", exit=1)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)  # only the current user can connect, clients send their stdout / stderr to the daemon
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+
+    enable_key_memory()
+    enable_compiled_template_memory()
+    importlib.import_module("doxx.commands.build")  # import the build modules before the first request
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    stdout("[*] doxx: Serving builds on '" + socket_path + "' for `doxx build --serve` (or DOXX_SOCKET). Press Ctrl-C to stop.")
+    try:
+        running = True
+        while running:
+            connection = server.accept()[0]
+            try:
+                running = _handle_connection(connection)
+            except Exception as e:
+                stderr("[!] doxx: Unable to handle the request. Error: " + str(e), exit=0)
+            finally:
+                connection.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    stdout("[*] doxx: Serve stopped.")
+
+
+def _raise_keyboard_interrupt(signal_number, frame):
+    raise KeyboardInterrupt()
+
+
+def _handle_connection(connection):
+    """runs one request, returns False for a stop request"""
+    fds = []
+    try:
+        request, fds = _receive_message(connection)
+        if request is None:
+            return True
+        if request.get('command') == 'stop':
+            _send_message(connection, {'exit': 0})
+            return False
+        if request.get('command') == 'build' and len(fds) == 2:
+            exit_code = _run_build_request(request, fds[0], fds[1])
+            _send_message(connection, {'exit': exit_code})
+            if exit_code == 0:
+                _remember_key_templates(request)  # after the response, the client does not wait
+        else:
+            _send_message(connection, {'exit': 1})
+        return True
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def _run_build_request(request, stdout_fd, stderr_fd):
+    """runs a build in the client working directory with the client stdout / stderr, returns the exit code"""
+    from doxx.commands.build import Builder
+
+    saved_cwd = os.getcwd()
+    saved_offline = os.environ.get(OFFLINE_ENVIRONMENT_VARIABLE)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # replace the daemon stdout / stderr file descriptors for the build, build worker processes inherit them
+    saved_stdout_fd = os.dup(1)
+    saved_stderr_fd = os.dup(2)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    try:
+        os.chdir(request['cwd'])
+        os.environ[OFFLINE_ENVIRONMENT_VARIABLE] = "1" if request.get('offline') else "0"  # the client offline state, not the daemon environment
+        Builder(request['key_path'], incremental=request.get('incremental', False), processes=request.get('processes')).run()
+        exit_code = 0
+    except SystemExit as se:
+        exit_code = se.code if isinstance(se.code, int) else (0 if se.code is None else 1)
+    except Exception as e:
+        sys.stderr.write("[!] doxx: Error: " + str(e) + "\n")
+        exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except (IOError, OSError):
+            pass  # the client exited
+        os.dup2(saved_stdout_fd, 1)
+        os.dup2(saved_stderr_fd, 2)
+        os.close(saved_stdout_fd)
+        os.close(saved_stderr_fd)
+        os.chdir(saved_cwd)
+        if saved_offline is None:
+            os.environ.pop(OFFLINE_ENVIRONMENT_VARIABLE, None)
+        else:
+            os.environ[OFFLINE_ENVIRONMENT_VARIABLE] = saved_offline
+    return exit_code
+
+
+def _remember_key_templates(request):
+    """compiles the local templates of a multi-template key in the daemon process.  The build worker processes are forked from
+    the daemon for each build, the templates that they compile are not kept in the daemon memory"""
+    from doxx.datatypes.key import load_key
+    from doxx.datatypes.template import DoxxTemplate, STREAM_TEMPLATE_MIN_BYTES
+    saved_cwd = os.getcwd()
+    try:
+        os.chdir(request['cwd'])
+        key = load_key(request['key_path'])
+        if key.multi_template_key is True:
+            for template_path in key.meta_data['templates']:
+                if os.path.isfile(template_path) and os.path.getsize(template_path) < STREAM_TEMPLATE_MIN_BYTES:  # streamed templates are not compiled
+                    template = DoxxTemplate(template_path)
+                    template.load_data()
+                    template.split_data()  # compiled template memory hit, or compile and remember
+    except (Exception, SystemExit):
+        pass  # the next build reports the errors
+    finally:
+        os.chdir(saved_cwd)
+
+
+########################################
+#
+#  Socket protocol: one JSON message per
+#   line, file descriptors are passed
+#   with SCM_RIGHTS ancillary data
+#
+########################################
+
+def _connect(socket_path):
+    """returns a connected socket or None if there is no daemon listening on socket_path"""
+    if not is_serve_supported():
+        return None
+    try:
+        socket_stat = os.stat(socket_path)
+    except OSError:
+        return None
+    if socket_stat.st_uid != os.getuid():
+        return None  # never send stdout / stderr to a socket that another user created
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except socket.error:
+        connection.close()
+        return None
+    return connection
+
+
+def _send_message(connection, message, fds=None):
+    import array
+    data = (json.dumps(message) + "\n").encode('utf-8')
+    if fds:
+        connection.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+    else:
+        connection.sendall(data)
+
+
+def _receive_message(connection):
+    """returns a (message, file descriptor list) tuple, message is None if the connection closed before a complete message"""
+    import array
+    fds = array.array("i")
+    chunks = []
+    received_bytes = 0
+    while True:
+        data, ancillary_data, flags, address = connection.recvmsg(4096, socket.CMSG_SPACE(2 * fds.itemsize))
+        for level, message_type, fd_data in ancillary_data:
+            if level == socket.SOL_SOCKET and message_type == socket.SCM_RIGHTS:
+                fds.frombytes(fd_data[:len(fd_data) - (len(fd_data) % fds.itemsize)])
+        if not data:
+            return (None, list(fds))
+        chunks.append(data)
+        received_bytes += len(data)
+        if data.endswith(b"\n") or received_bytes > SERVE_MESSAGE_MAX_BYTES:
+            break
+    return (json.loads(b"".join(chunks).decode('utf-8')), list(fds))
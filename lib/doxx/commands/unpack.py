@@ -1,70 +1,523 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import os
+import sys
+import json
+import shutil
 import tarfile
+import tempfile
 import zipfile
+import threading
 from os import remove
+from collections import deque
+from multiprocessing.pool import ThreadPool
 from Naked.toolshed.system import stderr, file_exists
+from Naked.toolshed.python import is_py2
+from doxx.utilities.profiler import timed_function
+from doxx.datatypes.manifest import PACK_DELTA_FILE_NAME
 
+UNPACK_PARALLEL_MIN_MEMBERS = 64         # zip archives with fewer file members are extracted in this process
+UNPACK_MEMBER_COST = 4096                # zip archives: per file overhead in bytes of compressed data when the members are split across the worker processes
+UNPACK_WRITE_THREADS = 4                 # tar archives: file write threads, the archive is decompressed in the main thread
+UNPACK_WRITE_MAX_BYTES = 16777216        # tar archives: larger members are written with a streamed extract in the main thread
+UNPACK_PENDING_BYTES = 67108864          # tar archives: maximum size of the member data that are waiting for a write thread
 
-def unpack_run(file_path):
-    if tarfile.is_tarfile(file_path):
-        return unpack_targz_archive_file(file_path)  # returns the root directory from the unpack function below
-    elif zipfile.is_zipfile(file_path):
-        return unpack_zip_archive_file(file_path)    # returns the root directory from the unpack function below
+
+@timed_function("unpack")
+def unpack_run(file_path, processes=None, delta=False):
+    archive = DoxxArchive(file_path)
+    try:
+        if archive.open() is False:
+            stderr("[!] doxx: '" + file_path + "' does not appear to be a supported project archive type.  Please review the project archive documentation and try again.", exit=1)
+        root_dir = archive.extract(processes=processes)  # returns the root directory of the archive
+        # the removed files of a delta archive are only deleted on request (doxx unpack --delta), other archives can include the file name
+        if delta is True:
+            if apply_pack_delta(root_dir) is None:
+                stderr("[!] doxx: '" + file_path + "' is not a delta archive (doxx pack --delta), no files were removed.", exit=0)
+        elif root_dir is not None and os.path.isfile(os.path.join(root_dir, PACK_DELTA_FILE_NAME)):
+            stderr("[!] doxx: '" + file_path + "' includes a list of removed files.  Use doxx unpack --delta to remove them from an unpacked copy of the base pack.", exit=0)
+        return root_dir
+    except Exception as e:
+        stderr("[!] doxx: Unable to unpack the file '" + file_path + "'. Error: " + str(e))
+    finally:
+        archive.close()
+
+
+def apply_pack_delta(root_dir):
+    """completes the unpack of a delta archive (doxx pack --delta) over an unpacked copy of its base pack: removes the files and directories
+    that are listed in the PACK_DELTA_FILE_NAME file of the archive and the file.  Returns the list of removed paths, None for other archives"""
+    if root_dir is None:
+        return None
+    delta_file_path = os.path.join(root_dir, PACK_DELTA_FILE_NAME)
+    if not os.path.isfile(delta_file_path):
+        return None
+    with open(delta_file_path, 'rb') as f:
+        delta = json.loads(f.read().decode('utf-8'))
+    removed_paths = []
+    real_root_dir = os.path.realpath(root_dir)
+    for removed_path in delta['removed']:  # files are listed before their directories
+        if not _is_plain_member_path(removed_path):
+            continue
+        local_path = os.path.join(root_dir, removed_path)
+        if not _is_inside_directory(os.path.realpath(os.path.dirname(local_path)), real_root_dir):
+            continue  # a symbolic link directory in the unpacked copy points outside of the root directory
+        if os.path.isdir(local_path) and not os.path.islink(local_path):
+            if len(os.listdir(local_path)) == 0:
+                os.rmdir(local_path)   # directories with files that were added after the base pack are kept
+                removed_paths.append(removed_path)
+        elif os.path.lexists(local_path):
+            os.remove(local_path)
+            removed_paths.append(removed_path)
+    os.remove(delta_file_path)
+    return removed_paths
+
+
+def unpack_targz_stream(fileobj):
+    """unpacks a tar archive from a file object that is read sequentially (e.g. a HTTP response stream) and returns the root directory"""
+    # stream mode reads every member once as the data arrives, the archive is not written to disk
+    archive = DoxxArchive(fileobj=fileobj)
+    if archive.open() is False:
+        raise ValueError("the file is not a supported project archive type")
+    return archive.extract()
+
+
+def unpack_targz_stream_members(fileobj, get_local_path):
+    """unpacks the file and directory members of a sequential tar.gz stream to the local path that is returned by get_local_path(tarinfo),
+    members are skipped when the function returns None"""
+    tar = tarfile.open(fileobj=fileobj, mode="r|gz")
+    try:
+        extract_tar_members(tar, get_local_path)  # the data of skipped members is read from the stream and discarded
+    finally:
+        tar.close()
+
+
+########################################
+#
+#  [DoxxArchive]
+#       public class
+#       - single open archive handle
+#
+########################################
+
+ARCHIVE_HEADER_SIZE = 512   # bytes that are read to identify the archive format (the ustar tar magic is at offset 257)
+
+
+def get_archive_format(header):
+    """returns the (archive type, compression) tuple for the first bytes of an archive file: ('zip', None), ('tar', 'gz'), ('tar', 'bz2'),
+    ('tar', 'xz'), ('tar', '') for uncompressed tar archives, or None if the magic bytes are not recognized"""
+    if header[0:4] in (b"PK\x03\x04", b"PK\x05\x06"):
+        return ("zip", None)
+    elif header[0:2] == b"\x1f\x8b":
+        return ("tar", "gz")
+    elif header[0:3] == b"BZh":
+        return ("tar", "bz2")
+    elif header[0:6] == b"\xfd7zXZ\x00":
+        return ("tar", "xz")
+    elif header[257:262] == b"ustar":
+        return ("tar", "")
     else:
-        stderr("[!] doxx: '" + file_path + "' does not appear to be a supported project archive type.  Please review the project archive documentation and try again.", exit=1)
+        return None
+
+
+class DoxxArchive(object):
+    """The DoxxArchive class unpacks a tar (gzip, bzip2, xz, uncompressed) or zip project archive from a file path or an open file object.
+    The format is identified from the magic bytes at the start of the file, the archive is opened once and read once during the extraction.
+    Sequential file objects (e.g. HTTP response streams) are read with the tarfile stream mode, zip archives require a seekable file and are
+    spooled to a temporary file"""
+    def __init__(self, file_path=None, fileobj=None):
+        self.file_path = file_path
+        self.fileobj = fileobj
+        self.archive_type = None   # 'tar' or 'zip', defined in open
+        self.compression = None    # tar archives: 'gz', 'bz2', 'xz', or '' for uncompressed archives
+        self.seekable = False
+        self.root_dir = None       # defined in extract
+        self._opened_file = None   # file object that is closed by the close method
 
+    def open(self):
+        """reads the magic bytes of the archive, returns False if the archive format is not supported"""
+        if self.fileobj is None:
+            self.fileobj = self._opened_file = open(self.file_path, 'rb')
+        self.seekable = _is_seekable(self.fileobj)
+        if self.seekable:
+            start_position = self.fileobj.tell()
+            header = self.fileobj.read(ARCHIVE_HEADER_SIZE)
+            self.fileobj.seek(start_position)
+        else:
+            header = _read_bytes(self.fileobj, ARCHIVE_HEADER_SIZE)
+            self.fileobj = _PrefixedStream(header, self.fileobj)  # the header bytes are read again by the archive reader
+        archive_format = get_archive_format(header)
+        if archive_format is None and self.seekable:
+            archive_format = self._get_unmarked_format()
+        if archive_format is None:
+            return False
+        self.archive_type, self.compression = archive_format
+        if self.archive_type == "zip" and not self.seekable:
+            self._spool()
+        return True
 
-def unpack_targz_archive_file(targz_file_path):
+    def extract(self, processes=None):
+        """extracts the archive in the working directory and returns the root directory of the archive.  The root directory is the name of
+        the first tar member, or the first zip member ("." if the first zip member is a file)"""
+        if self.archive_type == "tar":
+            tar = tarfile.open(fileobj=self.fileobj, mode=("r:" if self.seekable else "r|") + self.compression)
+            try:
+                self.root_dir = extract_tar_members(tar, processes=processes)
+            finally:
+                tar.close()
+        else:
+            zip_archive = zipfile.ZipFile(self.fileobj, 'r')
+            try:
+                infolist = zip_archive.infolist()  # read from the central directory when the archive is opened
+                if self.file_path is not None and _use_zip_worker_processes(zip_archive, processes):
+                    extract_zip_members(zip_archive, self.file_path, processes)
+                else:
+                    zip_archive.extractall()
+            finally:
+                zip_archive.close()
+            # if root_dir is actually a file name, then assume root dir is the CWD
+            if len(infolist) == 0 or '.' in infolist[0].filename:
+                self.root_dir = "."
+            else:
+                self.root_dir = infolist[0].filename
+        return self.root_dir
+
+    def close(self):
+        if self._opened_file is not None:
+            self._opened_file.close()
+            self._opened_file = None
+
+    def _get_unmarked_format(self):
+        """zip archives with leading data (e.g. self-extracting archives) and pre-POSIX tar archives do not start with a magic number"""
+        start_position = self.fileobj.tell()
+        try:
+            if zipfile.is_zipfile(self.fileobj):
+                return ("zip", None)
+            self.fileobj.seek(start_position)
+            try:
+                tarfile.open(fileobj=self.fileobj, mode="r:").close()
+                return ("tar", "")
+            except tarfile.TarError:
+                return None
+        finally:
+            self.fileobj.seek(start_position)
+
+    def _spool(self):
+        spool_file = tempfile.TemporaryFile()
+        shutil.copyfileobj(self.fileobj, spool_file)
+        spool_file.seek(0)
+        self.close()
+        self.fileobj = self._opened_file = spool_file
+        self.seekable = True
+
+
+class _PrefixedStream(object):
+    """read only file object that returns the [prefix] bytes, then the bytes of [fileobj]"""
+    def __init__(self, prefix, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        if len(self.prefix) == 0:
+            return self.fileobj.read(size)
+        if size < 0:
+            data = self.prefix + self.fileobj.read()
+            self.prefix = b""
+            return data
+        data = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        return data
+
+
+def _is_seekable(fileobj):
+    seekable = getattr(fileobj, 'seekable', None)
+    if seekable is not None:
+        return seekable()
+    try:
+        fileobj.tell()  # Python 2 file objects
+        return hasattr(fileobj, 'seek')
+    except Exception:
+        return False
+
+
+def _read_bytes(fileobj, size):
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = fileobj.read(remaining)
+        if len(data) == 0:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+
+########################################
+#
+#  [extract_tar_members]
+#       public function
+#       - tar extraction with the file
+#           writes in a thread pool
+#
+########################################
+
+def extract_tar_members(tar, get_local_path=None, processes=None):
+    """extracts the members of an open TarFile (file or stream mode) in the working directory and returns the name of the first member.
+    The archive is read and decompressed in this thread and the member files are written by a pool of write threads, the writes overlap
+    the decompression of the next members.  If get_local_path is defined, only file and directory members are extracted to the local path
+    that get_local_path(tarinfo) returns (the member is skipped if it returns None).  The file, directory, and link attributes are the
+    attributes of TarFile.extractall.  [processes] limits the number of write threads (default = CPU count, at most UNPACK_WRITE_THREADS)"""
+    processes = _get_unpack_processes(processes)
+    if is_py2() or processes < 2:
+        return _extract_tar_members_serial(tar, get_local_path)  # one CPU: the write threads compete with the decompression for the GIL
+    root_dir = None
+    directories = []
+    real_unpack_dir = os.path.realpath(os.getcwd())
+    checked_dirs = set()   # parent directories of the written files that resolve to a path inside of the working directory
+    link_members = False   # True after a link member is extracted, links can replace a checked directory or a file path
+    writer = _TarMemberWriter(tar, min(processes, UNPACK_WRITE_THREADS))
     try:
-        tar = tarfile.open(targz_file_path, "r:*")
-        # define root directory in the tar archive to return to calling function
-        x = 0
-        root_dir = None
         for tarinfo in tar:
-            if x == 0:
+            if root_dir is None:
                 root_dir = tarinfo.name
-                x += 1
+            if get_local_path is not None:
+                if not (tarinfo.isfile() or tarinfo.isdir()):
+                    continue
+                local_path = get_local_path(tarinfo)
+                if local_path is None:
+                    continue
+                tarinfo.name = local_path
+            if tarinfo.isdir():
+                tar.extract(tarinfo, set_attrs=False)  # the directory attributes are set after the files are written (as TarFile.extractall)
+                directories.append(tarinfo)
+            elif tarinfo.isreg() and tarinfo.size <= UNPACK_WRITE_MAX_BYTES and _is_plain_member_path(tarinfo.name):
+                # the write threads open the member path without the TarFile checks, a symbolic link member that was extracted earlier
+                # must not redirect the write outside of the working directory
+                upper_dir = os.path.dirname(tarinfo.name)
+                if upper_dir not in checked_dirs:
+                    if not _is_inside_directory(os.path.realpath(upper_dir or os.curdir), real_unpack_dir):
+                        raise ValueError("the archive member '" + tarinfo.name + "' is outside of the unpack directory")
+                    checked_dirs.add(upper_dir)
+                if link_members and os.path.islink(tarinfo.name):
+                    writer.wait(tarinfo.name, all_pending=True)
+                    os.remove(tarinfo.name)  # replace the link with the file, do not write to the link target
+                writer.write(tarinfo, tar.extractfile(tarinfo).read())
             else:
-                break
-        # unpack the archive
+                writer.wait(tarinfo.name, all_pending=not tarinfo.isreg())  # links to earlier members, large files that replace pending files
+                tar.extract(tarinfo)
+                if not tarinfo.isreg():
+                    link_members = True
+                    checked_dirs.clear()
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    directories.sort(key=lambda a: a.name, reverse=True)
+    for tarinfo in directories:
+        try:
+            _chown_tar_member(tar, tarinfo, tarinfo.name)
+            tar.utime(tarinfo, tarinfo.name)
+            tar.chmod(tarinfo, tarinfo.name)
+        except tarfile.ExtractError:
+            pass  # non-fatal errors are not raised by TarFile.extractall with the default errorlevel
+    return root_dir
+
+
+def _extract_tar_members_serial(tar, get_local_path):
+    if get_local_path is None:
         tar.extractall()
-        tar.close()
-        # return the root directory to calling function
-        return root_dir
-    except Exception as e:
-        stderr("[!] doxx: Unable to unpack the file '" + targz_file_path + "'. Error: " + str(e))
+        members = tar.getmembers()  # the members that were read during the extraction
+        if len(members) > 0:
+            return members[0].name
+        else:
+            return None
+    for tarinfo in tar:
+        if tarinfo.isfile() or tarinfo.isdir():
+            local_path = get_local_path(tarinfo)
+            if local_path is not None:
+                tarinfo.name = local_path
+                tar.extract(tarinfo)
+    return None
+
+
+def _is_plain_member_path(member_name):
+    """True for relative member paths without parent directory references, other paths are extracted by the TarFile"""
+    return not os.path.isabs(member_name) and ".." not in member_name.replace("\\", "/").split("/")
+
+
+def _is_inside_directory(real_path, real_dir_path):
+    """True if the resolved path (os.path.realpath) is the directory or a path inside of the directory"""
+    return real_path == real_dir_path or real_path.startswith(os.path.join(real_dir_path, ""))
+
+
+class _TarMemberWriter(object):
+    """writes the file members of a TarFile with a thread pool.  The parent directories are created in the calling thread, a member path
+    that is waiting for a write is written again only after the earlier write completes (archives can contain a path more than once)"""
+    def __init__(self, tar, threads):
+        self.tar = tar
+        self.threads = threads
+        self.pool = None                 # started with the first file member
+        self.pending_writes = deque()    # (normalized member path, data size, async result) in member order
+        self.pending_names = {}          # normalized member path : number of pending writes
+        self.pending_bytes = 0
+
+    def write(self, tarinfo, data):
+        self.wait(tarinfo.name)
+        upper_dir = os.path.dirname(tarinfo.name)
+        if upper_dir and not os.path.isdir(upper_dir):
+            os.makedirs(upper_dir)
+        if self.pool is None:
+            self.pool = ThreadPool(processes=self.threads)
+        member_path = os.path.normpath(tarinfo.name)
+        self.pending_writes.append((member_path, len(data), self.pool.apply_async(_write_tar_member, (self.tar, tarinfo, data))))
+        self.pending_names[member_path] = self.pending_names.get(member_path, 0) + 1
+        self.pending_bytes += len(data)
+        while self.pending_bytes > UNPACK_PENDING_BYTES or len(self.pending_writes) > self.threads * 64:
+            self._complete_write()
+
+    def wait(self, member_name, all_pending=False):
+        """waits for the pending writes of a member path (or all of the pending writes)"""
+        while len(self.pending_writes) > 0 and (all_pending or os.path.normpath(member_name) in self.pending_names):
+            self._complete_write()
+
+    def close(self):
+        self.wait("", all_pending=True)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def abort(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def _complete_write(self):
+        member_path, data_size, result = self.pending_writes.popleft()
+        self.pending_bytes -= data_size
+        if self.pending_names[member_path] == 1:
+            del self.pending_names[member_path]
+        else:
+            self.pending_names[member_path] -= 1
+        result.get()  # raises the write error in the calling thread
+
+
+def _write_tar_member(tar, tarinfo, data):
+    with open(tarinfo.name, 'wb') as f:
+        f.write(data)
+    _chown_tar_member(tar, tarinfo, tarinfo.name)
+    tar.chmod(tarinfo, tarinfo.name)
+    tar.utime(tarinfo, tarinfo.name)
+
+
+def _chown_tar_member(tar, tarinfo, target_path):
+    if sys.version_info >= (3, 5):
+        tar.chown(tarinfo, target_path, False)  # numeric_owner argument (Python 3.5+)
+    else:
+        tar.chown(tarinfo, target_path)
+
+
+########################################
+#
+#  [extract_zip_members]
+#       public function
+#       - zip extraction with a pool
+#           of worker processes
+#
+########################################
 
-  
-def unpack_zip_archive_file(zip_file_path):
+def _get_unpack_processes(processes):
+    if processes is None or processes < 1:
+        from multiprocessing import cpu_count
+        return cpu_count()
+    return processes
+
+
+def _use_zip_worker_processes(zip_archive, processes):
+    if _get_unpack_processes(processes) < 2:
+        return False
+    if len(zip_archive.infolist()) < UNPACK_PARALLEL_MIN_MEMBERS:
+        return False
+    # archives that are unpacked by the remote file fetch threads are extracted in the thread, do not fork a process that runs threads
+    return threading.current_thread().name == "MainThread"
+
+
+def extract_zip_members(zip_archive, zip_file_path, processes=None):
+    """extracts the members of an open ZipFile in the working directory with a pool of worker processes.  The directories are created in
+    this process, the file members are split into groups with about the same amount of compressed data and each worker process opens
+    the archive file and extracts a group of members"""
+    from multiprocessing import Pool  # imported on use, small archives do not start worker processes
+    processes = _get_unpack_processes(processes)
+    file_indices = []
+    for index, zipinfo in enumerate(zip_archive.infolist()):
+        member_path = _get_zip_member_path(zipinfo)
+        if zipinfo.filename[-1] == '/':
+            member_dir = member_path
+        else:
+            member_dir = os.path.dirname(member_path)
+            file_indices.append(index)
+        if member_dir and not os.path.isdir(member_dir):
+            os.makedirs(member_dir)
+    member_groups = _split_zip_members(zip_archive.infolist(), file_indices, processes * 4)
+    pool = Pool(min(processes, len(member_groups)), initializer=_init_unpack_worker, initargs=(zip_file_path,))
     try:
-        zip_archive = zipfile.ZipFile(zip_file_path, 'r')
-        # define root directory in the tar archive to return to calling function
-        x = 0
-        root_dir = None
-        for zipinfo in zip_archive.infolist():
-            if x == 0:
-                root_dir = zipinfo.filename
-                x += 1
-            else:
-                break
-        # extract the zip archive
-        zip_archive.extractall()
-        zip_archive.close()
-        
-        # if root_dir is actually a file name, then assume root dir is the CWD
-        if '.' in root_dir:
-            root_dir = "."
-        # return the root directory in the zip archive
-        return root_dir
-    except Exception as e:
-        stderr("[!] doxx: Unable to unpack the file '" + zip_file_path + "'. Error: " + str(e))
+        for member_count in pool.imap_unordered(_unpack_worker_runner, member_groups):
+            pass
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _get_zip_member_path(zipinfo):
+    """returns the local path of a zip member (the path that ZipFile.extract writes, without the Windows file name character replacements)"""
+    member_path = zipinfo.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        member_path = member_path.replace(os.path.altsep, os.path.sep)
+    member_path = os.path.splitdrive(member_path)[1]
+    return os.path.sep.join(x for x in member_path.split(os.path.sep) if x not in ('', os.path.curdir, os.path.pardir))
+
+
+def _split_zip_members(infolist, file_indices, group_count):
+    """returns a list of lists of member indices in archive order, each group has about the same compressed size + per file overhead"""
+    total_cost = sum(infolist[index].compress_size + UNPACK_MEMBER_COST for index in file_indices)
+    group_cost = max(1, total_cost // max(1, group_count))
+    member_groups = []
+    group = []
+    cost = 0
+    for index in file_indices:
+        group.append(index)
+        cost += infolist[index].compress_size + UNPACK_MEMBER_COST
+        if cost >= group_cost:
+            member_groups.append(group)
+            group = []
+            cost = 0
+    if len(group) > 0:
+        member_groups.append(group)
+    return member_groups
+
+
+# ZipFile instance for the worker processes in the extract_zip_members pool, defined in _init_unpack_worker
+_worker_zip_archive = None
+
+
+def _init_unpack_worker(zip_file_path):
+    global _worker_zip_archive
+    _worker_zip_archive = zipfile.ZipFile(zip_file_path, 'r')  # each worker process reads the archive with its own file handle
+
+
+def _unpack_worker_runner(member_indices):
+    infolist = _worker_zip_archive.infolist()
+    for index in member_indices:
+        _worker_zip_archive.extract(infolist[index])
+    return len(member_indices)
+
 
-        
 def remove_compressed_archive_file(targz_file_path):
     if file_exists(targz_file_path):
         remove(targz_file_path)
     else:
         pass  # could not find the compressed archive file, raise no error message and abort attempt
-    
\ No newline at end of file
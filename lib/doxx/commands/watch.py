@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import time
+
+from Naked.toolshed.system import stderr, stdout
+
+from doxx.commands.build import Builder
+from doxx.datatypes.cache import enable_compiled_template_memory
+from doxx.datatypes.key import DoxxKey
+from doxx.datatypes.template import make_local_template
+
+WATCH_POLL_INTERVAL = 0.5   # seconds between file stat polls
+WATCH_SETTLE_TIME = 0.1     # wait after a change is detected so that editor saves (write, rename) complete before the rebuild
+
+
+class DoxxWatcher(object):
+    """The DoxxWatcher class builds a key, then polls the key file and the local template files for changes.  A changed template
+    is rendered again, a changed key renders the templates that use a changed variable (the variable : templates dependency map)"""
+    def __init__(self, key_path, incremental=False, processes=None, interval=WATCH_POLL_INTERVAL):
+        self.key_path = key_path
+        self.incremental = incremental  # incremental option for the first build
+        self.processes = processes      # worker processes for the first build of a multi-template key
+        self.interval = interval
+        self.key = None
+        self.template_paths = []        # templates in the key, in key order
+        self.template_variables = {}    # template path : set of the variable names that the template renders (empty set for verbatim templates, None = unknown)
+        self.variable_templates = {}    # variable name : set of the template paths that render it
+        self.file_stats = {}            # watched file path : stat validator from the last poll
+
+    def run(self):
+        """builds the key then rebuilds on changes until Ctrl-C"""
+        enable_compiled_template_memory()  # unchanged templates are compiled once for the life of the watch
+        self.build_all()
+        stdout("[*] doxx: Watching '" + self.key_path + "' and " + str(len(self.file_stats) - 1) + " local templates for changes. Press Ctrl-C to stop.")
+        try:
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.check_for_changes()
+                except (Exception, SystemExit) as e:
+                    stderr("[!] doxx: Unable to rebuild the changed files. Error: " + str(e), exit=0)  # keep watching, the next save rebuilds
+        except KeyboardInterrupt:
+            stdout("[*] doxx: Watch stopped.")
+
+    def build_all(self):
+        """full build of the key, defines the dependency map and the watched file stats"""
+        self.key = self._load_key()
+        if self.key is None:
+            stderr("[!] doxx: Unable to watch the key '" + self.key_path + "'. Fix the key and try again.", exit=1)  # no last good key to build
+        self._set_templates(self.key)
+        try:
+            Builder(self.key_path, incremental=self.incremental, processes=self.processes).run()
+        except SystemExit:
+            pass  # the build reported the failed templates, fix and save them to rebuild
+        self.file_stats = self._get_file_stats()
+
+    def check_for_changes(self):
+        """polls the watched files once and renders the affected templates, returns the list of rendered template paths"""
+        changed_paths = self._get_changed_paths()
+        if len(changed_paths) == 0:
+            return []
+        time.sleep(WATCH_SETTLE_TIME)
+        self.file_stats = self._get_file_stats()
+
+        rebuild_paths = set()
+        if self.key_path in changed_paths:
+            new_key = self._load_key()
+            if new_key is None:
+                return []  # the key error was reported, the last good key is kept and the key is parsed again on the next save
+            old_template_paths = set(self.template_paths)
+            changed_variables = get_changed_variables(self.key.key_data, new_key.key_data)
+            no_replacements_changed = new_key.no_replacements != self.key.no_replacements
+            self.key = new_key
+            self._set_templates(new_key)
+            self.file_stats = self._get_file_stats()  # the key can add or remove templates
+            for template_path in self.template_paths:
+                if template_path not in old_template_paths or no_replacements_changed:
+                    rebuild_paths.add(template_path)
+                elif self.template_variables.get(template_path) is None:
+                    if len(changed_variables) > 0:
+                        rebuild_paths.add(template_path)  # unknown variables (remote or unreadable template), render for every key value change
+            for variable_name in changed_variables:
+                rebuild_paths.update(self.variable_templates.get(variable_name, ()))
+        for template_path in self.template_paths:
+            if template_path in changed_paths:
+                self._update_template_dependencies(template_path)
+                rebuild_paths.add(template_path)
+
+        rebuilt_paths = [template_path for template_path in self.template_paths if template_path in rebuild_paths]  # key order
+        if len(rebuilt_paths) == 0:
+            stdout("[-] doxx: No templates use the changed key values.")
+        self._render(rebuilt_paths)
+        return rebuilt_paths
+
+    def _render(self, template_paths):
+        builder = Builder(self.key_path)
+        builder.set_key_data(self.key)
+        for template_path in template_paths:
+            try:
+                builder.single_template_run(template_path)
+            except SystemExit:
+                pass  # single_template_run reported the error, keep watching
+            except Exception as e:
+                stderr("[!] doxx: Unable to build the template '" + template_path + "'. Error: " + str(e), exit=0)
+
+    def _load_key(self):
+        """returns the parsed key, or None if the key can not be used for the watch (the error is reported to the user)"""
+        try:
+            key = DoxxKey(self.key_path)
+        except SystemExit:
+            return None  # DoxxKey reported the error
+        except Exception as e:
+            stderr("[!] doxx: Unable to parse the key '" + self.key_path + "'. Error: " + str(e), exit=0)  # e.g. invalid YAML during an edit
+            return None
+        if key.single_template_key is False and key.multi_template_key is False:
+            stderr("[!] doxx: The watch option requires a key with a template or templates field.", exit=0)
+            return None
+        return key
+
+    def _set_templates(self, key):
+        if key.multi_template_key is True:
+            self.template_paths = list(key.meta_data['templates'])
+        else:
+            self.template_paths = [key.meta_data['template']]
+        for template_path in list(self.template_variables):
+            if template_path not in self.template_paths:
+                self._set_template_variables(template_path, None)
+                del self.template_variables[template_path]
+        for template_path in self.template_paths:
+            if template_path not in self.template_variables:
+                self._update_template_dependencies(template_path)
+
+    def _update_template_dependencies(self, template_path):
+        """defines the variables of the template in the dependency map from the compiled Ink template segments"""
+        self._set_template_variables(template_path, get_template_variables(template_path))
+
+    def _set_template_variables(self, template_path, variables):
+        old_variables = self.template_variables.get(template_path)
+        if old_variables:
+            for variable_name in old_variables:
+                self.variable_templates[variable_name].discard(template_path)
+        self.template_variables[template_path] = variables
+        if variables:
+            for variable_name in variables:
+                self.variable_templates.setdefault(variable_name, set()).add(template_path)
+
+    def _get_file_stats(self):
+        file_stats = {self.key_path: _get_stat_validator(self.key_path)}
+        for template_path in self.template_paths:
+            if not _is_url(template_path):
+                file_stats[template_path] = _get_stat_validator(template_path)
+        return file_stats
+
+    def _get_changed_paths(self):
+        changed_paths = set()
+        for file_path in self.file_stats:
+            validator = _get_stat_validator(file_path)
+            if validator is None:
+                continue  # missing during an editor save, the change is detected when the file is replaced
+            if validator != self.file_stats[file_path]:
+                changed_paths.add(file_path)
+        return changed_paths
+
+
+def get_changed_variables(old_key_data, new_key_data):
+    """returns the set of variable names that were added, removed, or assigned a new value in the key data"""
+    changed_variables = set()
+    for variable_name in set(old_key_data) | set(new_key_data):
+        if old_key_data.get(variable_name) != new_key_data.get(variable_name):
+            changed_variables.add(variable_name)
+    return changed_variables
+
+
+def get_template_variables(template_path):
+    """returns the set of variable names that a local template renders (the Ink Template varlist), an empty set for verbatim
+    templates, or None if the variables are unknown (remote templates, streamed templates, unreadable templates)"""
+    if _is_url(template_path) or not os.path.isfile(template_path):
+        return None
+    try:
+        template = make_local_template(template_path)
+        if template.streamed is True:
+            return None  # the variables of a large template are found during the streamed render
+        template.load_data()
+        template.split_data()
+        if template.parse_template_for_errors()[0] == True:
+            return None
+        template.parse_template_text()
+    except Exception:
+        return None
+    if template.verbatim is True:
+        return set()
+    return set(template.segments[1::2])
+
+
+def _get_stat_validator(file_path):
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (getattr(file_stat, 'st_mtime_ns', file_stat.st_mtime), file_stat.st_size, file_stat.st_ino)
+
+
+def _is_url(file_path):
+    return len(file_path) > 6 and (file_path[0:7] == "http://" or file_path[0:8] == "https://")
@@ -2,8 +2,18 @@
 # encoding: utf-8
 
 import os
+import copy
+import json
+import sys
 import time
+import zlib
+import marshal
+import hashlib
 import platform
+import tempfile
+import threading
+
+from collections import OrderedDict
 
 from Naked.toolshed.file import FileReader, FileWriter
 
@@ -13,6 +23,7 @@ class DoxxCache(object):
         self.system = platform.system()
         self.package_repo_list_file = "list.txt"        # the list of packages in the package repository
         self.package_repo_json_file = "packages.json"   # the name:description JSON file of packages in the package repository
+        self.package_repo_index_file = "list.idx"       # the search index for the list of packages in the package repository
     
     #################################
     #
@@ -46,6 +57,15 @@ class DoxxCache(object):
         else:
             return False
     
+    def cache_packagerepo_index(self, index_bytes):
+        cache_dir_path = self._get_platform_specific_cache_dirpath()
+        if cache_dir_path is not None:
+            if not os.path.isdir(cache_dir_path):
+                os.mkdir(cache_dir_path)
+            return self._write_binary_file(os.path.join(cache_dir_path, self.package_repo_index_file), index_bytes)
+        else:
+            return False
+    
     #################################
     #
     #  Cache Reader Methods
@@ -66,6 +86,12 @@ class DoxxCache(object):
         cache_file_path = os.path.join(cache_file_dir, self.package_repo_json_file)
         return self._read_text_file(cache_file_path)        
     
+    def get_cached_packagerepo_index(self):
+        """returns the index bytes or None if the index is not cached"""
+        cache_file_dir = self._get_platform_specific_cache_dirpath()
+        cache_file_path = os.path.join(cache_file_dir, self.package_repo_index_file)
+        return self._read_binary_file(cache_file_path)
+    
     #################################
     #
     #  Utility Methods
@@ -127,6 +153,75 @@ class DoxxCache(object):
         except Exception:
             return ""  # return empty string if there is an exception during the read
         
+    def _write_binary_file(self, file_path, file_bytes):
+        """writes to a temporary file in the same directory and renames it into place so that concurrent readers never see a partial file"""
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(file_bytes)
+            if self.system == "Windows" and os.path.isfile(file_path):
+                os.remove(file_path)  # rename does not replace an existing file on Windows
+            os.rename(temp_path, file_path)
+            return True
+        except Exception:
+            if temp_path is not None and os.path.isfile(temp_path):
+                os.remove(temp_path)
+            return False
+
+    def _read_binary_file(self, file_path):
+        try:
+            with open(file_path, 'rb') as f:
+                return f.read()
+        except Exception:
+            return None  # return None if the file is missing or there is an exception during the read
+
+    def _get_directory_size(self, dir_path):
+        total_bytes = 0
+        for file_name in os.listdir(dir_path):
+            try:
+                total_bytes += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                pass  # removed by another process during the scan
+        return total_bytes
+
+    def _prune_directory(self, dir_path, max_bytes):
+        """removes the least recently used files (oldest modification time) from the directory until it is <= max_bytes, returns the remaining size"""
+        file_list = []
+        total_bytes = 0
+        temp_file_time = time.time() - CACHE_TEMP_FILE_MAX_AGE
+        for file_name in os.listdir(dir_path):
+            file_path = os.path.join(dir_path, file_name)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue  # removed by another process during the scan
+            if file_name.endswith(".tmp") and file_stat.st_mtime > temp_file_time:
+                continue  # a body or cache file that another thread or process is writing, abandoned temporary files are removed
+            file_list.append((file_stat.st_mtime, file_stat.st_size, file_path))
+            total_bytes += file_stat.st_size
+        file_list.sort()  # least recently used first
+        for mtime, size, file_path in file_list:
+            if total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(file_path)
+                total_bytes -= size
+            except OSError:
+                pass
+        return total_bytes
+
+    def _update_directory_bytes(self, dir_path, size, max_bytes=None):
+        """adds [size] bytes that were written to the running size of the cache directory (the directory is scanned on the first update in
+        the process) and prunes the directory to 3/4 of [max_bytes] when it is larger.  The fetch threads update the same directories"""
+        with _cache_directory_lock:
+            if dir_path not in _cache_directory_bytes:
+                _cache_directory_bytes[dir_path] = self._get_directory_size(dir_path)
+            else:
+                _cache_directory_bytes[dir_path] += size
+            if max_bytes is not None and _cache_directory_bytes[dir_path] > max_bytes:
+                _cache_directory_bytes[dir_path] = self._prune_directory(dir_path, (max_bytes * 3) // 4)
+
     def _get_platform_specific_cache_dirpath(self):
         # detect user system
         if self.system == "Darwin":
@@ -137,5 +232,403 @@ class DoxxCache(object):
             return self._get_windows_cachedir()
         else:
             return None
+
+
+# running size of the cache directories that were written by this process, assigned on the first write to a directory
+_cache_directory_bytes = {}
+_cache_directory_lock = threading.Lock()  # held while the size of a directory is updated or the directory is pruned, fetch threads share the directories
+
+# .tmp files that were modified within this many seconds are in progress writes and are not removed when a cache directory is pruned
+CACHE_TEMP_FILE_MAX_AGE = 3600
+
+# in memory compiled templates for long running processes (doxx serve), cache file name : (meta_data, text, segments), defined in enable_compiled_template_memory
+_compiled_template_memory = None
+_compiled_template_memory_max_entries = 0
+
+
+def enable_compiled_template_memory(max_entries=1024):
+    """keeps up to [max_entries] compiled templates in memory for the life of the process, least recently used templates are removed"""
+    global _compiled_template_memory, _compiled_template_memory_max_entries
+    if _compiled_template_memory is None:
+        _compiled_template_memory = OrderedDict()
+    _compiled_template_memory_max_entries = max_entries
+
+
+def _remember_compiled_template(cache_file_name, meta_data, text, segments):
+    if _compiled_template_memory is None:
+        return
+    _compiled_template_memory.pop(cache_file_name, None)
+    _compiled_template_memory[cache_file_name] = (copy.deepcopy(meta_data), text, segments)  # the caller modifies its meta_data during the build
+    while len(_compiled_template_memory) > _compiled_template_memory_max_entries:
+        _compiled_template_memory.popitem(last=False)
+
+
+def _recall_compiled_template(cache_file_name):
+    if _compiled_template_memory is None:
+        return None
+    memory_entry = _compiled_template_memory.pop(cache_file_name, None)
+    if memory_entry is None:
+        return None
+    _compiled_template_memory[cache_file_name] = memory_entry  # mark as recently used
+    meta_data, text, segments = memory_entry
+    return (copy.deepcopy(meta_data), text, segments)
+
+
+class DoxxTemplateCache(DoxxCache):
+    """Cache of compiled doxx templates (parsed meta data, text offset, Ink variable positions) keyed by a hash of the raw template text"""
+    def __init__(self, max_bytes=67108864, cache_dir=None):
+        DoxxCache.__init__(self)
+        self.max_bytes = max_bytes      # size limit for the compiled template directory (default = 64MB), least recently used files are removed
+        self.cache_dir = cache_dir      # override the default compiled template directory path (default = 'templates' in the doxx cache directory)
+        self.format_version = 1         # bump when the stored format changes
+    
+    #################################
+    #
+    #  Cache Writer Methods
+    #
+    #################################
+    def cache_compiled_template(self, raw_text, meta_data, text_offset, segments, open_delimiter="{{", close_delimiter="}}"):
+        """stores the compiled template. text_offset is the index of the template text in raw_text, segments is the Ink Template segment list"""
+        cache_file_name = self._make_cache_file_name(raw_text, open_delimiter, close_delimiter)
+        _remember_compiled_template(cache_file_name, meta_data, raw_text[text_offset:], segments)
+        template_dir_path = self._get_template_cache_dirpath()
+        if template_dir_path is None:
+            return False
+        try:
+            if not os.path.isdir(template_dir_path):
+                os.makedirs(template_dir_path)
+            spans = self._make_variable_spans(segments, open_delimiter, close_delimiter)
+            compiled_bytes = zlib.compress(marshal.dumps((self.format_version, meta_data, text_offset, spans)))
+        except Exception:
+            return False  # unable to store meta data types that marshal does not support (e.g. YAML dates), the template is compiled on every build
+        cache_file_path = os.path.join(template_dir_path, cache_file_name)
+        if not self._write_binary_file(cache_file_path, compiled_bytes):
+            return False
+        
+        self._update_directory_bytes(template_dir_path, len(compiled_bytes), self.max_bytes)  # keep the size of the directory bounded
+        return True
+    
+    #################################
+    #
+    #  Cache Reader Methods
+    #
+    #################################
+    def get_compiled_template(self, raw_text, open_delimiter="{{", close_delimiter="}}"):
+        """returns a (meta_data, text, segments) tuple for the raw template text or None if it is not cached"""
+        cache_file_name = self._make_cache_file_name(raw_text, open_delimiter, close_delimiter)
+        compiled_template = _recall_compiled_template(cache_file_name)  # compiled templates in memory skip the file read
+        if compiled_template is not None:
+            return compiled_template
+        template_dir_path = self._get_template_cache_dirpath()
+        if template_dir_path is None:
+            return None
+        cache_file_path = os.path.join(template_dir_path, cache_file_name)
+        compiled_bytes = self._read_binary_file(cache_file_path)
+        if compiled_bytes is None:
+            return None
+        try:
+            format_version, meta_data, text_offset, spans = marshal.loads(zlib.decompress(compiled_bytes))
+            if format_version != self.format_version:
+                return None
+            os.utime(cache_file_path, None)  # mark as recently used
+        except Exception:
+            return None  # treat damaged files as a cache miss, the file is replaced on the next write
+        text = raw_text[text_offset:]
+        segments = self._make_segments(text, spans, open_delimiter, close_delimiter)
+        _remember_compiled_template(cache_file_name, meta_data, text, segments)
+        return (meta_data, text, segments)
+    
+    #################################
+    # PRIVATE
+    #################################
+    
+    def _get_template_cache_dirpath(self):
+        if self.cache_dir is not None:
+            return self.cache_dir
+        cache_dir_path = self._get_platform_specific_cache_dirpath()
+        if cache_dir_path is None:
+            return None
+        return os.path.join(cache_dir_path, "templates")
+    
+    def _make_cache_file_name(self, raw_text, open_delimiter, close_delimiter):
+        # marshal format is specific to the Python version, include it in the key
+        hasher = hashlib.sha1(raw_text.encode('utf-8'))
+        hasher.update((u"\0" + open_delimiter + u"\0" + close_delimiter + u"\0" + str(sys.version_info[0]) + u"." + str(sys.version_info[1])).encode('utf-8'))
+        return hasher.hexdigest() + ".doxc"
+    
+    def _make_variable_spans(self, segments, open_delimiter, close_delimiter):
+        """flat list of [start, end, start, end, ...] indices of the variable names in the template text"""
+        spans = []
+        position = 0
+        odel_length = len(open_delimiter)
+        cdel_length = len(close_delimiter)
+        for i in range(0, len(segments) - 1, 2):
+            start = position + len(segments[i]) + odel_length
+            end = start + len(segments[i + 1])
+            spans.append(start)
+            spans.append(end)
+            position = end + cdel_length
+        return spans
+    
+    def _make_segments(self, text, spans, open_delimiter, close_delimiter):
+        """rebuilds the Ink Template segment list from the template text and the variable name spans"""
+        segments = []
+        position = 0
+        odel_length = len(open_delimiter)
+        cdel_length = len(close_delimiter)
+        for i in range(0, len(spans), 2):
+            start = spans[i]
+            end = spans[i + 1]
+            segments.append(text[position:start - odel_length])
+            segments.append(text[start:end])
+            position = end + cdel_length
+        segments.append(text[position:])
+        return segments
+
+
+class DoxxHTTPCache(DoxxCache):
+    """Cache of HTTP response bodies.  Bodies are stored by the SHA-256 hash of their bytes and an index file for each URL records the
+    validators (ETag, Last-Modified) that are used to revalidate the cached body with a conditional GET request"""
+    def __init__(self, max_bytes=268435456, cache_dir=None):
+        DoxxCache.__init__(self)
+        self.max_bytes = max_bytes      # size limit for the response body directory (default = 256MB), least recently used bodies are removed
+        self.cache_dir = cache_dir      # override the default HTTP cache directory path (default = 'http' in the doxx cache directory)
+    
+    #################################
+    #
+    #  Cache Writer Methods
+    #
+    #################################
+    def open_body_writer(self, url, etag=None, last_modified=None, encoding=None):
+        """returns a DoxxHTTPCacheWriter for the response body of url or None if the cache directory is not available"""
+        http_dir_path = self._get_http_cache_dirpath()
+        if http_dir_path is None:
+            return None
+        try:
+            for dir_path in (os.path.join(http_dir_path, "objects"), os.path.join(http_dir_path, "index")):
+                if not os.path.isdir(dir_path):
+                    try:
+                        os.makedirs(dir_path)
+                    except OSError:
+                        if not os.path.isdir(dir_path):  # created by another thread or process
+                            raise
+            index_data = {'url': url, 'etag': etag, 'last_modified': last_modified, 'encoding': encoding}
+            return DoxxHTTPCacheWriter(self, url, index_data)
+        except Exception:
+            return None
+    
+    def touch_entry(self, entry):
+        """marks the cached body as recently used"""
+        try:
+            os.utime(entry['body_path'], None)
+        except OSError:
+            pass
+    
+    #################################
+    #
+    #  Cache Reader Methods
+    #
+    #################################
+    def get_entry(self, url):
+        """returns the index data dictionary for url with the cached body file path in the 'body_path' field, or None if url is not cached"""
+        http_dir_path = self._get_http_cache_dirpath()
+        if http_dir_path is None:
+            return None
+        index_bytes = self._read_binary_file(self._get_index_file_path(url))
+        if index_bytes is None:
+            return None
+        try:
+            entry = json.loads(index_bytes.decode('utf-8'))
+            if entry['url'] != url:
+                return None
+            entry['body_path'] = os.path.join(http_dir_path, "objects", entry['sha256'])
+        except Exception:
+            return None  # treat damaged index files as a cache miss, the file is replaced on the next write
+        if not os.path.isfile(entry['body_path']):
+            return None  # the body was removed from the cache when the directory was pruned
+        return entry
+    
+    def get_validator_headers(self, entry):
+        """returns the conditional GET request headers for a cache entry"""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    #################################
+    # PRIVATE
+    #################################
+    
+    def _get_http_cache_dirpath(self):
+        if self.cache_dir is not None:
+            return self.cache_dir
+        cache_dir_path = self._get_platform_specific_cache_dirpath()
+        if cache_dir_path is None:
+            return None
+        return os.path.join(cache_dir_path, "http")
+    
+    def _get_index_file_path(self, url):
+        return os.path.join(self._get_http_cache_dirpath(), "index", hashlib.sha256(url.encode('utf-8')).hexdigest() + ".json")
+    
+    def _commit_body(self, url, index_data, temp_path, sha256, size):
+        """moves a completely written body into the object store and writes the index file for url"""
+        http_dir_path = self._get_http_cache_dirpath()
+        objects_dir_path = os.path.join(http_dir_path, "objects")
+        body_path = os.path.join(objects_dir_path, sha256)
+        if os.path.isfile(body_path):
+            os.remove(temp_path)      # identical body is already stored (e.g. the same file at another URL)
+            os.utime(body_path, None)
+            stored_size = 0
+        else:
+            os.rename(temp_path, body_path)
+            stored_size = size
+        index_data['sha256'] = sha256
+        index_data['size'] = size
+        if not self._write_binary_file(self._get_index_file_path(url), json.dumps(index_data).encode('utf-8')):
+            return False
+        self._update_directory_bytes(objects_dir_path, stored_size, self.max_bytes)  # keep the size of the object store bounded
+        return True
+
+
+class DoxxHTTPCacheWriter(object):
+    """Writes a response body to the HTTP cache as it is downloaded.  commit() stores the body and index after the last chunk, discard() removes it"""
+    def __init__(self, http_cache, url, index_data):
+        self.http_cache = http_cache
+        self.url = url
+        self.index_data = index_data
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        fd, self.temp_path = tempfile.mkstemp(dir=os.path.join(http_cache._get_http_cache_dirpath(), "objects"), prefix=".", suffix=".tmp")
+        self.file = os.fdopen(fd, 'wb')
+    
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+    
+    def commit(self):
+        """returns True if the body was stored"""
+        try:
+            self.file.close()
+            return self.http_cache._commit_body(self.url, self.index_data, self.temp_path, self.hasher.hexdigest(), self.size)
+        except Exception:
+            self.discard()
+            return False
+    
+    def discard(self):
+        try:
+            self.file.close()
+            if os.path.isfile(self.temp_path):
+                os.remove(self.temp_path)
+        except Exception:
+            pass
+
+
+class DoxxPackStore(DoxxCache):
+    """Content addressed store of compressed project files for incremental packs (doxx pack --incremental).  Each file is stored once as a
+    raw deflate stream by the SHA-256 hash of its bytes and the compression level, a manifest for each packed directory records the size,
+    modification time, and hash of the files in the last pack so that unchanged files are not read or compressed again"""
+    def __init__(self, max_bytes=536870912, cache_dir=None):
+        DoxxCache.__init__(self)
+        self.max_bytes = max_bytes      # size limit for the object directory (default = 512MB), least recently used objects are removed by prune
+        self.cache_dir = cache_dir      # override the default pack store directory path (default = 'pack' in the doxx cache directory)
+        self.format_version = 1         # bump when the stored format changes
+    
+    #################################
+    #
+    #  Cache Writer Methods
+    #
+    #################################
+    def add_object(self, sha256, level, compressed_bytes):
+        """stores the compressed bytes of a file, returns True if the object was stored"""
+        objects_dir_path = self._make_store_subdirpath("objects")
+        if objects_dir_path is None:
+            return False
+        if self._write_binary_file(self._get_object_file_path(sha256, level), compressed_bytes):
+            self._update_directory_bytes(objects_dir_path, len(compressed_bytes))  # pruned after the pack (prune)
+            return True
+        return False
+    
+    def write_manifest(self, root_dir, manifest):
+        """stores the manifest of the last pack of root_dir"""
+        manifests_dir_path = self._make_store_subdirpath("manifests")
+        if manifests_dir_path is None:
+            return False
+        manifest['format'] = self.format_version
+        return self._write_binary_file(self._get_manifest_file_path(root_dir), json.dumps(manifest, sort_keys=True).encode('utf-8'))
+    
+    def prune(self):
+        """keeps the size of the object directory bounded, called after a pack so that the objects of the pack are not removed while it is written"""
+        store_dir_path = self._get_pack_store_dirpath()
+        if store_dir_path is None:
+            return
+        objects_dir_path = os.path.join(store_dir_path, "objects")
+        if objects_dir_path in _cache_directory_bytes:  # objects were added by this process
+            self._update_directory_bytes(objects_dir_path, 0, self.max_bytes)
+    
+    #################################
+    #
+    #  Cache Reader Methods
+    #
+    #################################
+    def get_object(self, sha256, level):
+        """returns the compressed bytes of a file or None if the object is not stored"""
+        if self._get_pack_store_dirpath() is None:
+            return None
+        object_file_path = self._get_object_file_path(sha256, level)
+        compressed_bytes = self._read_binary_file(object_file_path)
+        if compressed_bytes is not None:
+            try:
+                os.utime(object_file_path, None)  # mark as recently used
+            except OSError:
+                pass
+        return compressed_bytes
+    
+    def get_manifest(self, root_dir):
+        """returns the manifest of the last pack of root_dir or None if the directory was not packed"""
+        if self._get_pack_store_dirpath() is None:
+            return None
+        manifest_bytes = self._read_binary_file(self._get_manifest_file_path(root_dir))
+        if manifest_bytes is None:
+            return None
+        try:
+            manifest = json.loads(manifest_bytes.decode('utf-8'))
+            if manifest.get('format') != self.format_version:
+                return None
+            return manifest
+        except Exception:
+            return None  # treat damaged manifests as a first pack, the file is replaced after the pack
+    
+    #################################
+    # PRIVATE
+    #################################
+    
+    def _get_pack_store_dirpath(self):
+        if self.cache_dir is not None:
+            return self.cache_dir
+        cache_dir_path = self._get_platform_specific_cache_dirpath()
+        if cache_dir_path is None:
+            return None
+        return os.path.join(cache_dir_path, "pack")
+    
+    def _make_store_subdirpath(self, dir_name):
+        store_dir_path = self._get_pack_store_dirpath()
+        if store_dir_path is None:
+            return None
+        dir_path = os.path.join(store_dir_path, dir_name)
+        if not os.path.isdir(dir_path):
+            try:
+                os.makedirs(dir_path)
+            except OSError:
+                if not os.path.isdir(dir_path):  # created by another process
+                    return None
+        return dir_path
+    
+    def _get_object_file_path(self, sha256, level):
+        return os.path.join(self._get_pack_store_dirpath(), "objects", sha256 + "-" + str(level) + ".deflate")
     
-    
\ No newline at end of file
+    def _get_manifest_file_path(self, root_dir):
+        root_path = os.path.abspath(root_dir)
+        return os.path.join(self._get_pack_store_dirpath(), "manifests", hashlib.sha1(root_path.encode('utf-8')).hexdigest() + ".json")
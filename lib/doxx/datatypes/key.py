@@ -3,6 +3,7 @@
 
 import os
 import unicodedata
+from collections import OrderedDict
 from Naked.toolshed.file import FileReader
 from Naked.toolshed.system import directory, make_path
 from Naked.toolshed.system import file_exists, stderr
@@ -14,6 +15,76 @@ except ImportError:
     from yaml import Loader
 
 
+# parsed keys for long running processes (doxx serve), (working directory, key path) : (file stat validator, DoxxKey), defined in enable_key_memory
+_key_memory = None
+_key_memory_max_entries = 0
+
+
+def enable_key_memory(max_entries=256):
+    """keeps up to [max_entries] parsed keys in memory for the life of the process, a key is parsed again when its file is modified"""
+    global _key_memory, _key_memory_max_entries
+    if _key_memory is None:
+        _key_memory = OrderedDict()
+    _key_memory_max_entries = max_entries
+
+
+def load_key(key_path):
+    """returns the DoxxKey for the key file at key_path, from memory if enable_key_memory was called and the file is unchanged"""
+    if _key_memory is None:
+        return DoxxKey(key_path)
+    try:
+        key_stat = os.stat(key_path)
+    except OSError:
+        return DoxxKey(key_path)  # DoxxKey reports the missing key file
+    # the template paths in the key are joined to the key path, relative key paths are specific to the working directory
+    memory_key = (os.getcwd(), key_path)
+    validator = (getattr(key_stat, 'st_mtime_ns', key_stat.st_mtime), key_stat.st_size, key_stat.st_ino)
+    memory_entry = _key_memory.pop(memory_key, None)
+    if memory_entry is not None and memory_entry[0] == validator:
+        _key_memory[memory_key] = memory_entry  # mark as recently used
+        return memory_entry[1]
+    key = DoxxKey(key_path)
+    _key_memory[memory_key] = (validator, key)
+    while len(_key_memory) > _key_memory_max_entries:
+        _key_memory.popitem(last=False)
+    return key
+
+
+def make_unicode_key_data(key_data):
+    """returns a new key data dictionary with NFKD normalized unicode keys and values (necessary for the Ink Renderer class), None values are replaced with empty strings"""
+    unicode_key_data_dict = {}  # new dictionary that will contain the UTF-8 encoded unicode keys and values from key_data
+    if key_data is None or len(key_data) == 0:
+        key_list = []
+    else:
+        key_list = key_data.keys()
+        
+    is_python_2 = is_py2()  # Loop Speedup: remove the Python 2 interpreter checks from the loop below
+    normalize = unicodedata.normalize  # Loop Speedup: remove unicodedata module lookups in the loop below
+        
+    for key in key_list:
+        unicode_key = normalize('NFKD', _create_python_dependent_unicode(key, is_python_2))                    # encode the key
+        if key_data[key] == None:
+            unicode_value = normalize('NFKD', _create_python_dependent_unicode("", is_python_2))              # if value == None (i.e. key present but no definition included), replace with empty string = empty string replacement
+        else:
+            unicode_value = normalize('NFKD', _create_python_dependent_unicode(key_data[key], is_python_2))  # otherwise normalize it
+        unicode_key_data_dict[unicode_key] = unicode_value       # assign the encoded values to the new dictionary
+    
+    return unicode_key_data_dict
+
+
+def _create_python_dependent_unicode(unknown_encoding_string, is_python_2):      
+    if is_python_2:  # python 2 only 
+        if isinstance(unknown_encoding_string, unicode):    # test for Python 2 unicode type
+            return unknown_encoding_string                  # it is already unicode, just return it
+        else:
+            return unicode(unknown_encoding_string)         # otherwise, cast to unicode
+    else:  # python 3 only
+        if isinstance(unknown_encoding_string, str):
+            return unknown_encoding_string                  # return unmodified string, py3 strings are unicode by default
+        else:
+            return str(unknown_encoding_string)             # convert to utf-8 encoded string   
+
+
 class DoxxKey(object):
     def __init__(self, inpath):
         # instance variables
@@ -63,37 +134,11 @@ class DoxxKey(object):
             stderr("[!] doxx: Unable to load the requested key " + inpath + ". Please check the path and try again.", exit=1)
             
     def _cast_values_to_unicode(self):
-        unicode_key_data_dict = {}  # new dictionary that will contain the UTF-8 encoded unicode keys and values from self.key_data
-        if self.key_data is None or len(self.key_data) == 0:
-            key_list = []
-        else:
-            key_list = self.key_data.keys()
-            
-        is_python_2 = is_py2()  # Loop Speedup: remove the Python 2 interpreter checks from the loop below
-        normalize = unicodedata.normalize  # Loop Speedup: remove unicodedata module lookups in the loop below
-            
-        for key in key_list:
-            unicode_key = normalize('NFKD', self._create_python_dependent_unicode(key, is_python_2))                    # encode the key
-            if self.key_data[key] == None:
-                unicode_value = normalize('NFKD', self._create_python_dependent_unicode("", is_python_2))              # if value == None (i.e. key present but no definition included), replace with empty string = empty string replacement
-            else:
-                unicode_value = normalize('NFKD', self._create_python_dependent_unicode(self.key_data[key], is_python_2))  # otherwise normalize it
-            unicode_key_data_dict[unicode_key] = unicode_value       # assign the encoded values to the new dictionary
-        
-        self.key_data = unicode_key_data_dict     # define the instance key_data with the new unicode encoded keys and values
+        self.key_data = make_unicode_key_data(self.key_data)  # define the instance key_data with the new unicode encoded keys and values
                 
     
     def _create_python_dependent_unicode(self, unknown_encoding_string, is_python_2):      
-        if is_python_2:  # python 2 only 
-            if isinstance(unknown_encoding_string, unicode):    # test for Python 2 unicode type
-                return unknown_encoding_string                  # it is already unicode, just return it
-            else:
-                return unicode(unknown_encoding_string)         # otherwise, cast to unicode
-        else:  # python 3 only
-            if isinstance(unknown_encoding_string, str):
-                return unknown_encoding_string                  # return unmodified string, py3 strings are unicode by default
-            else:
-                return str(unknown_encoding_string)             # convert to utf-8 encoded string   
+        return _create_python_dependent_unicode(unknown_encoding_string, is_python_2)
     
     
     def _parse_build_specifications(self, inpath):
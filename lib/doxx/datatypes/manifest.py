@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import json
+import hashlib
+
+from Naked.toolshed.system import make_path
+from doxx.utilities.filesystem import _write_file_atomic
+
+PACK_DELTA_FILE_NAME = ".doxxdelta"  # delta archives (doxx pack --delta): the first file member, lists the files that were removed since the base pack
+
+class DoxxBuildManifest(object):
+    """Build manifest for incremental builds.  Records the template, key value, and output file hashes for every template built with a key file"""
+    def __init__(self, key_path):
+        self.key_path = key_path
+        self.manifest_path = make_path(os.path.dirname(key_path), "." + os.path.basename(key_path) + ".doxxmanifest")  # stored next to the key file
+        self.entries = {}   # template path : {'template': hash, 'key': hash, 'outfile': path, 'output': hash}
+        self.updated = {}   # entries that were updated during this build (template path : entry)
+        self._read_manifest()
+
+    def is_current(self, template_path, template_hash, key_hash, outfile_path):
+        """returns True if the template, the key values that it uses, and the output file are unchanged since the last build"""
+        entry = self.entries.get(template_path)
+        if entry is None:
+            return False
+        if entry['template'] != template_hash or entry['key'] != key_hash or entry['outfile'] != outfile_path:
+            return False
+        if not os.path.isfile(outfile_path):
+            return False
+        return entry['output'] == hash_file(outfile_path)  # the output file was not modified or replaced after the last build
+
+    def update_entry(self, template_path, template_hash, key_hash, outfile_path):
+        entry = {'template': template_hash, 'key': key_hash, 'outfile': outfile_path, 'output': hash_file(outfile_path)}
+        self.entries[template_path] = entry
+        self.updated[template_path] = entry
+
+    def write(self, template_paths=None):
+        """writes the manifest file, entries for templates that are no longer in template_paths are removed"""
+        if template_paths is not None:
+            template_path_set = set(template_paths)
+            for template_path in list(self.entries):
+                if template_path not in template_path_set:
+                    del self.entries[template_path]
+        _write_file_atomic(self.manifest_path, json.dumps(self.entries, indent=1, sort_keys=True))  # an interrupted build keeps the last manifest
+
+    def _read_manifest(self):
+        if os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    self.entries = json.load(f)
+            except Exception:
+                self.entries = {}  # unreadable manifest, rebuild everything and write a new one
+
+
+class DoxxPullManifest(object):
+    """Pull manifest for delta package updates.  Records the size, modification time, and SHA-256 hash of every file that a package pull
+    wrote in the working directory so that the next pull of the package writes only the files that changed"""
+    def __init__(self, package_name, dir_path="."):
+        self.manifest_path = make_path(dir_path, "." + package_name + ".doxxpull")  # stored in the directory of the pulled package
+        self.entries = {}    # local file path : [size, modification time, sha256]
+        self.pulled = set()  # local file paths of the package files in this pull
+        self.exists = False  # True if the package was pulled to the directory before
+        self._read_manifest()
+
+    def is_current(self, file_path, sha256):
+        """returns True if the local file has the SHA-256 hash, files with the size and modification time of the last pull are not read"""
+        if not os.path.isfile(file_path):
+            return False
+        entry = self.entries.get(file_path)
+        file_stat = os.stat(file_path)
+        if entry is not None and entry[0] == file_stat.st_size and entry[1] == file_stat.st_mtime:
+            return entry[2] == sha256
+        return hash_file(file_path, "sha256") == sha256
+
+    def update_entry(self, file_path, sha256):
+        file_stat = os.stat(file_path)
+        self.entries[file_path] = [file_stat.st_size, file_stat.st_mtime, sha256]
+        self.pulled.add(file_path)
+
+    def get_stale_files(self):
+        """returns the sorted list of the local files of the last pull that are not in this pull.  The files are not removed, the entries of the
+        files that still exist are kept so that the files are reported again by the next pull"""
+        stale_paths = []
+        for file_path in sorted(self.entries):
+            if file_path in self.pulled:
+                continue
+            if os.path.isfile(file_path):
+                stale_paths.append(file_path)
+            else:
+                del self.entries[file_path]
+        return stale_paths
+
+    def write(self):
+        _write_file_atomic(self.manifest_path, json.dumps(self.entries, indent=1, sort_keys=True))  # an interrupted pull keeps the last manifest
+
+    def _read_manifest(self):
+        if os.path.isfile(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    self.entries = json.load(f)
+                self.exists = True
+            except Exception:
+                self.entries = {}  # unreadable manifest, compare the hashes of the local files
+
+
+def hash_text(text):
+    """returns the SHA-1 hex digest for a unicode string"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def hash_file(file_path, hash_name="sha1"):
+    """returns the hex digest for the bytes in a file (default = SHA-1)"""
+    hasher = hashlib.new(hash_name)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1048576), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_key_values(key_data, varlist, no_replacements):
+    """returns the SHA-1 hex digest for the key values that are used in a template (varlist)"""
+    if no_replacements:
+        return hash_text(u"\0verbatim")  # template text is written without replacements, key values are not used
+    hasher = hashlib.sha1()
+    for variable in sorted(varlist):
+        if variable in key_data:
+            hasher.update((variable + u"\0" + key_data[variable] + u"\0").encode('utf-8'))
+        else:
+            hasher.update((variable + u"\1").encode('utf-8'))  # undefined variables are written back verbatim, include them so that a new definition triggers a build
+    return hasher.hexdigest()
@@ -16,6 +16,7 @@ class OfficialPackage(object):
         # https://github.com/doxx-repo/{package-name}/releases/download/current/{package-name}.tar.gz
         # https://github.com/doxx-repo/{package-name}/releases/download/current/{package-name}.zip
         # https://github.com/doxx-repo/{package-name}/releases/download/current/pkey.yaml
+        # https://github.com/doxx-repo/{package-name}/releases/download/current/{package-name}.manifest.json (delta pulls, doxx pack --manifest)
     
     # Attribute getter methods
     
@@ -27,6 +28,10 @@ class OfficialPackage(object):
         normalized_package_name = package_name.lower().strip()
         return self.binary_package_url_prefix + normalized_package_name + self.binary_package_url_postfix + normalized_package_name + '.zip'     
     
+    def get_package_manifest_url(self, package_name):
+        normalized_package_name = package_name.lower().strip()
+        return self.binary_package_url_prefix + normalized_package_name + self.binary_package_url_postfix + normalized_package_name + '.manifest.json'
+    
     def get_package_key_url(self, package_name):
         normalized_package_name = package_name.lower().strip()
         return self.package_key_file_url_prefix + normalized_package_name + self.package_key_file_url_postfix
@@ -2,13 +2,12 @@
 # encoding: utf-8
 
 from os import remove
-import os.path
-from multiprocessing import Process, Lock
 
 from Naked.toolshed.system import stderr, stdout, file_exists
-from doxx.commands.pull import pull_binary_file, pull_text_file, pull_archive_file
+from doxx.commands.pull import is_tar_archive, pull_targz_archive
 from doxx.commands.unpack import unpack_run
-from doxx.utilities.filesystem import _create_dirs, _make_os_dependent_path
+from doxx.utilities.fetcher import fetch_all, fetch_binary_file, fetch_text_file
+from doxx.utilities.filesystem import _make_os_dependent_path
 
 
 ########################################
@@ -21,27 +20,9 @@ from doxx.utilities.filesystem import _create_dirs, _make_os_dependent_path
 
 
 def pull_textfile_runner(text_url_dict):
-    """pulls remote text files to local filesystem (public function)"""     
-    file_list = list(text_url_dict)       # the local outfile names in a list
-    number_of_files = len(file_list)      # the number of files included in the list
-    if number_of_files > 0:   
-        if number_of_files > 1:  # multiple text file pull, each in separate process
-            processes = []       # list of spawned processes
-            outputlock = Lock()  # stdout / stderr writes lock
-            iolock = Lock()      # input/output lock
-            
-            # iterate through requested files and execute pull in separate process for each one
-            for file_path in file_list:
-                p = Process(target=_pull_textfile_multiprocess, args=(file_path, text_url_dict[file_path], outputlock, iolock))
-                p.start()
-                processes.append(p)
-                
-            for process in processes:
-                process.join(timeout=60)
-                
-        else:  # single text file pull
-            file_path = file_list[0]
-            _pull_textfile(file_path, text_url_dict[file_path])  # file_path is local path for write, dictionary value is the URL
+    """pulls remote text files to local filesystem (public function)"""
+    if len(text_url_dict) > 0:
+        _pull_runner(fetch_text_file, text_url_dict)
     else:
         stderr("[!] doxx: Unable to find text files to pull in the key file", exit=0)
 
@@ -57,26 +38,8 @@ def pull_textfile_runner(text_url_dict):
 
 def pull_binaryfile_runner(binary_url_dict):
     """pulls remote binary files to local filesystem (public function)"""
-    file_list = list(binary_url_dict)     # the local outfile names in a list    
-    number_of_files = len(file_list)      # the number of files included in the list
-    if number_of_files > 0:   
-        if number_of_files > 1:  # multiple binary file pull, each in separate process
-            processes = []       # list of spawned processes
-            outputlock = Lock()  # stdout / stderr writes lock
-            iolock = Lock()      # input/output lock
-            
-            # iterate through requested files and execute pull in separate process for each one
-            for file_path in file_list:
-                p = Process(target=_pull_binaryfile_multiprocess, args=(file_path, binary_url_dict[file_path], outputlock, iolock))
-                p.start()
-                processes.append(p)
-                
-            for process in processes:
-                process.join(timeout=60)
-                
-        else:  # single text file pull
-            file_path = file_list[0]
-            _pull_binaryfile(file_path, binary_url_dict[file_path])  # file_path is local path for write, dictionary value is the URL
+    if len(binary_url_dict) > 0:
+        _pull_runner(fetch_binary_file, binary_url_dict)
     else:
         stderr("[!] doxx: Unable to find binary files to pull in the key file", exit=0)
 
@@ -93,8 +56,8 @@ def pull_binaryfile_runner(binary_url_dict):
 def pull_github_repo_runner(repo_url_dict):
     """pulls remote Github repository archives to the local filesystem and unpacks (public function)"""
     pull_archive_runner(repo_url_dict)  # execute through the pull_archive_runner function
-        
-        
+
+
 ###########################################
 #
 #  [pull_archive_runner]
@@ -104,222 +67,68 @@ def pull_github_repo_runner(repo_url_dict):
 ###########################################
 
 def pull_archive_runner(archive_url_dict):
-    file_list = list(archive_url_dict)       # the local outfile names in a list    
-    number_of_files = len(file_list)      # the number of files included in the list
-    if number_of_files > 0:   
-        if number_of_files > 1:  # multiple binary file pull, each in separate process
+    """pulls remote archive files to the local filesystem and unpacks (public function)"""
+    number_of_files = len(archive_url_dict)
+    if number_of_files > 0:
+        if number_of_files > 1:
             stdout("[*] doxx: Hang in there. Pulling " + str(number_of_files) + " entire file archives. This may take a bit of time...")
-            processes = []       # list of spawned processes
-            outputlock = Lock()  # stdout / stderr writes lock
-            iolock = Lock()      # input/output lock
-            
-            # iterate through requested files and execute pull in separate process for each one
-            for file_path in file_list:
-                p = Process(target=_pull_archive_multiprocess, args=(file_path, archive_url_dict[file_path], outputlock, iolock))
-                p.start()
-                processes.append(p)
-                
-            for process in processes:
-                process.join(timeout=120)
-                
-        else:  # single text file pull
+        else:
             stdout("[*] doxx: Hang in there. Pulling the entire file archive. This may take a bit of time...")
-            file_path = file_list[0]
-            _pull_archive(file_path, archive_url_dict[file_path])  # file_path is local path for write, dictionary value is the URL
+        _pull_runner(_fetch_archive, archive_url_dict)
     else:
-        stderr("[!] doxx: Unable to find archive files to pull in the key file", exit=0)    
+        stderr("[!] doxx: Unable to find archive files to pull in the key file", exit=0)
 
 
 ###############################################
 #
-#  [_pull_textfile]
+#  [_pull_runner]
 #       private function
-#       - execute single process text file pulls
+#       - execute concurrent pulls with the
+#           doxx.utilities.fetcher engine
 #
 ###############################################
 
 
-def _pull_textfile(file_path, url):
-    """executes single process text file pulls (private function)"""
-    # create OS dependent file path (if necessary)
-    file_path = _make_os_dependent_path(file_path)
-    # make directory structure if necessary for the file path
-    if os.path.dirname(file_path) is not "":
-        _create_dirs(file_path)
-    # pull the file and write to local filesystem
-    try:
-        pull_text_file(url, file_path)
-    except Exception as e:
-        stderr("[!] doxx: Unable to pull '" + file_path + "' from '" + url + "'. Error: " + str(e), exit=1)
-        
-    if file_exists(file_path):
-        stdout("[+] doxx: '" + file_path + "' ...check!")
-    else:
-        stderr("[!] doxx: There was an error pulling '" + file_path + "'. Error: Unable to locate local file.", exit=1)    
-    
-    
-########################################
-#
-#  [_pull_textfile_multiprocess]
-#       private function
-#       - execute multi-file, multiprocess
-#           text file pulls
-#
-########################################
-
-
-def _pull_textfile_multiprocess(file_path, url, outputlock, iolock):
-    """executes multiprocess, multi-file text file pulls (private function)"""
-    # create OS dependent file path (if necessary)
-    file_path = _make_os_dependent_path(file_path)
-    # make directory structure if necessary for the file path
-    if os.path.dirname(file_path) is not "":
-        iolock.acquire()
-        _create_dirs(file_path)
-        iolock.release()
-    # pull the file and write to local filesystem
-    try:
-        pull_text_file(url, file_path)
-    except Exception as e:
-        outputlock.acquire()
-        stderr("[!] doxx: Unable to pull '" + file_path + "' from '" + url + "'. Error: " + str(e), exit=0)
-        outputlock.release()
-    if file_exists(file_path):
-        outputlock.acquire()
-        stdout("[+] doxx: '" + file_path + "' ...check!")
-        outputlock.release()
-    else:
-        outputlock.acquire()
-        stderr("[!] doxx: There was an error pulling '" + file_path + "'. Error: Unable to locate local file", exit=0)
-        outputlock.release()
-
-
-########################################
-#
-#  [_pull_binaryfile]
-#       private function
-#       - execute single process binary
-#            file pulls
-#
-########################################
-
-
-def _pull_binaryfile(file_path, url):
-    """executes single process binary file pulls (private function)"""
-    # create OS dependent file path (if necessary)
-    file_path = _make_os_dependent_path(file_path)
-    # make directory structure if necessary for the file path
-    if os.path.dirname(file_path) is not "":
-        _create_dirs(file_path)
-    # pull the file and write to local filesystem    
-    try:
-        pull_binary_file(url, file_path)
-    except Exception as e:
-        stderr("[!] doxx: Unable to pull '" + file_path + "' from '" + url + "'. Error: " + str(e), exit=0)
-    if file_exists(file_path):
-        stdout("[+] doxx: '" + file_path + "' ...check!")
-    else:
-        stderr("[!] doxx: There was an error pulling '" + file_path + "'. Error: Unable to locate local file.", exit=1) 
-    
-    
-########################################
-#
-#  [_pull_binaryfile_multiprocess]
-#       private function
-#       - execute multiprocess multi-file 
-#             binary file pulls
-#
-########################################
-
+def _pull_runner(fetch_function, url_dict):
+    """pulls every local file path : URL item in url_dict with fetch_function and reports the result of each pull (private function)"""
+    # create OS dependent file paths (if necessary)
+    os_url_dict = {}
+    for file_path in url_dict:
+        os_url_dict[_make_os_dependent_path(file_path)] = url_dict[file_path]
 
-def _pull_binaryfile_multiprocess(file_path, url, outputlock, iolock):
-    # create OS dependent file path (if necessary)
-    file_path = _make_os_dependent_path(file_path)
-    # make directory structure if necessary for the file path
-    if os.path.dirname(file_path) is not "":
-        iolock.acquire()
-        _create_dirs(file_path)
-        iolock.release()
-    # pull the file and write to local filesystem
-    try:
-        pull_binary_file(url, file_path)
-    except Exception as e:
-        outputlock.acquire()
-        stderr("[!] doxx: Unable to pull '" + file_path + "' from '" + url + "'. Error: " + str(e), exit=0)
-        outputlock.release()
-    if file_exists(file_path):
-        outputlock.acquire()
-        stdout("[+] doxx: '" + file_path + "' ...check!")
-        outputlock.release()
-    else:
-        outputlock.acquire()
-        stderr("[!] doxx: There was an error pulling '" + file_path + "'. Error: Unable to locate local file", exit=0)
-        outputlock.release()
+    # downloads run in threads of this process, all stdout / stderr writes take place here so no output lock is needed
+    failed_pulls = 0
+    for file_path, url, local_path, error in fetch_all(fetch_function, os_url_dict):
+        if error is None:
+            stdout("[+] doxx: '" + local_path + "' ...check!")
+        else:
+            failed_pulls += 1
+            stderr(error, exit=0)
 
+    # a single file pull is a fatal error, multi-file pulls report the failed files and continue the build
+    if failed_pulls > 0 and len(os_url_dict) == 1:
+        raise SystemExit(1)
 
-########################################
-#
-#  [_pull_archive]
-#       private function
-#       - execute single process Github
-#             repository archive pulls
-#
-########################################
-
-
-def _pull_archive(file_path, url):
-    """executes single process archive file pulls (private function)"""
-    # create OS dependent file path (if necessary)
-    file_path = _make_os_dependent_path(file_path)
-    # make directory structure if necessary for the file path
-    if os.path.dirname(file_path) is not "":
-        _create_dirs(file_path)
-    # pull the file and write to local filesystem    
-    try:
-        pull_archive_file(url, file_path)
-    except Exception as e:
-        stderr("[!] doxx: Unable to pull the archive file from the URL '" + url + "'. Error: " + str(e), exit=1)
-    if file_exists(file_path):
-        root_dir = unpack_run(file_path)
-        remove(file_path)
-        stdout("[+] doxx: '" + root_dir + "' ...check!")
-    else:
-        stderr("[!] doxx: There was an error pulling the repository file. Error: Unable to locate local archive file.", exit=1)
 
-
-########################################
+###############################################
 #
-#  [_pull_archive_multiprocess]
+#  [_fetch_archive]
 #       private function
-#       - execute multiprocess multi-file 
-#             archive file pulls
+#       - pull and unpack an archive file
 #
-########################################
+###############################################
 
 
-def _pull_archive_multiprocess(file_path, url, outputlock, iolock):
-    """executes multi-process archive file pulls with I/O and stdout/stderr locks (private function)"""
-    # create OS dependent file path (if necessary)
-    file_path = _make_os_dependent_path(file_path)
-    # make directory structure if necessary for the file path
-    if os.path.dirname(file_path) is not "":
-        iolock.acquire()
-        _create_dirs(file_path)
-        iolock.release()
-    # pull the file and write to local filesystem    
-    try:
-        pull_archive_file(url, file_path)
-    except Exception as e:
-        outputlock.acquire()
-        stderr("[!] doxx: Unable to pull the archive file from the URL '" + url + "'. Error: " + str(e), exit=1)
-        outputlock.release()
+def _fetch_archive(url, file_path):
+    """pulls an archive file, unpacks it in the working directory, removes the archive file, and returns the root directory of the archive (private function)"""
+    if is_tar_archive(file_path):
+        return pull_targz_archive(url)  # unpacked from the response stream, the archive file is not written
+    fetch_binary_file(url, file_path)
     if file_exists(file_path):
-        root_dir = unpack_run(file_path)
-        remove(file_path)
-        outputlock.acquire()
-        stdout("[+] doxx: '" + root_dir + "' ...check!")
-        outputlock.release()
+        try:
+            root_dir = unpack_run(file_path)
+        finally:
+            remove(file_path)
+        return root_dir
     else:
-        outputlock.acquire()
-        stderr("[!] doxx: There was an error pulling the repository file. Error: Unable to locate local archive file.", exit=1)
-        outputlock.release()
+        raise Exception("Unable to locate local archive file.")
@@ -1,22 +1,51 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-from os.path import basename, splitext, normpath
-from Naked.toolshed.file import FileReader
-from Naked.toolshed.network import HTTP
+import os
+import re
+import mmap
+import codecs
+import unicodedata
+from os.path import basename, splitext, normpath, getsize
 from Naked.toolshed.system import make_path
+from Naked.toolshed.python import is_py2
+from doxx.datatypes.cache import DoxxTemplateCache
+
+# need a different template for Python 2 & 3
+if is_py2():
+    from doxx.renderer.inkpy2 import Template as InkTemplate
+else:
+    from doxx.renderer.inkpy3 import Template as InkTemplate
 
 from yaml import load
 try:
     from yaml import CLoader as Loader
 except ImportError:
     from yaml import Loader
+
+STREAM_TEMPLATE_MIN_BYTES = 67108864    # local templates of this size or larger are rendered from a stream of text chunks (default = 64MB)
+STREAM_CHUNK_SIZE = 1048576             # streamed template read size in bytes
+TEMPLATE_DELIMITER = "---doxx---"       # delimiter for the meta data header section of the template file
+
+_non_ascii_regex = re.compile(b'[\x80-\xff]')
+
+
+def make_local_template(template_path, no_replacements=False):
+    """returns a DoxxStreamTemplate for local template files of STREAM_TEMPLATE_MIN_BYTES or more, otherwise a DoxxTemplate.
+    no_replacements = True if the template text is written without replacements (key without replacement values)"""
+    try:
+        if getsize(template_path) >= STREAM_TEMPLATE_MIN_BYTES:
+            return DoxxStreamTemplate(template_path, no_replacements=no_replacements)
+    except OSError:
+        pass  # load_data reports the file read error
+    return DoxxTemplate(template_path, no_replacements=no_replacements)
     
 
 class DoxxTemplate(object):
     """A doxx template class that maintains state of user designed templates during the rendering process"""
-    def __init__(self, inpath):
+    def __init__(self, inpath, no_replacements=False):
         self.inpath = inpath
+        self.no_replacements = no_replacements  # the template text is written without replacements, load_data can skip the text decode
         self.raw_text = ""
         self.text = ""
         self.meta_data = {}     # holds meta data from the header of the file
@@ -24,17 +53,43 @@ class DoxxTemplate(object):
         self.extension = ""     # stored in the format '.txt'
         self.basename = ""      # base filename for the out write file path
         self.outfile = ""       # write file path for use by calling code
+        self.segments = None    # compiled Ink template segments for self.text, defined in split_data
+        self.streamed = False   # True for templates that are rendered from a stream of text chunks (DoxxStreamTemplate), self.text and self.segments are not defined
+        self.copy_range = None  # (byte offset, byte count) of template text that is written with a byte copy of the file, self.text and self.segments are not defined
+        self.header_meta_data = None  # meta data from the header scan of a template with a copy_range
     
     def load_data(self):
-        fr = FileReader(self.inpath)
-        self.raw_text = fr.read()
+        with open(self.inpath, 'rb') as f:
+            file_map = _map_file(f)
+        try:
+            # verbatim template text is copied from the file without a decode when the bytes are the same as the decoded, normalized text
+            self.header_meta_data, self.copy_range = _find_copy_range(file_map, self.no_replacements)
+            if self.copy_range is None:
+                self.raw_text = unicodedata.normalize('NFKD', file_map[:].decode('utf-8'))  # same text as the Naked FileReader read
+        finally:
+            if isinstance(file_map, mmap.mmap):
+                file_map.close()
 
     def split_data(self):
+        if self.copy_range is not None:
+            self.meta_data = self.header_meta_data
+            self.text = None
+            return
+        
+        # unchanged templates are read from the compiled template cache, skips the YAML and Ink template parse
+        cache = DoxxTemplateCache()
+        cached_template = cache.get_compiled_template(self.raw_text)
+        if cached_template is not None:
+            self.meta_data, self.text, self.segments = cached_template
+            return
+        
         parsed_text = self.raw_text.split("---doxx---")
 
         if len(parsed_text) == 3:  # should split into three sections (0 = before first ---doxx---, 1 = meta data, 2 = template text data after second ---doxx---)
             self.meta_data = load(parsed_text[1], Loader=Loader)
             self.text = parsed_text[2][1:]  # define self.text with the template data from the file, the [1:] slice removes /n at end of the delimiter        
+            self.segments = InkTemplate(self.text).segments
+            cache.cache_compiled_template(self.raw_text, self.meta_data, len(self.raw_text) - len(self.text), self.segments)
         else:
             self.meta_data = {}
             self.text = u""
@@ -99,7 +154,10 @@ class DoxxTemplate(object):
             error_message = u"[!] doxx: The template file '" + self.inpath + "' is not properly formatted.  Please include the required build specification block between '---doxx---' delimiters at the top of your file."
             return (True, error_message)
         # confirm that there is template text
-        elif self.text is None or len(self.text) < 5:  # if self.text not defined or length of the string < 5 chars (because {{x}} == 5 so must not include any replacement tags)
+        elif self.copy_range is not None and self.copy_range[1] < 5:  # copied template text is ASCII, one byte per character
+            error_message = u"[!] doxx: Unable to parse template text from the template file '" + self.inpath + "'. Please include a template in order to render this file."
+            return (True, error_message)
+        elif self.copy_range is None and (self.text is None or len(self.text) < 5):  # if self.text not defined or length of the string < 5 chars (because {{x}} == 5 so must not include any replacement tags)
             error_message = u"[!] doxx: Unable to parse template text from the template file '" + self.inpath + "'. Please include a template in order to render this file."
             return (True, error_message)
         else:
@@ -112,23 +170,135 @@ class DoxxTemplate(object):
 
 
 
+def _map_file(file_object):
+    """returns a read only memory map of a file, or empty bytes for an empty file (which cannot be mapped)"""
+    if os.fstat(file_object.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _find_copy_range(file_map, no_replacements):
+    """scans the mapped template file bytes for the header delimiters.  Returns a (meta data, (byte offset, byte count)) tuple for
+    template text that is written without replacements and that can be copied from the file byte for byte, otherwise (None, None).
+    The bytes are copied if the text is ASCII (the NFKD normalized text is the same) with no text mode newline translation"""
+    if os.linesep != "\n":
+        return (None, None)
+    delimiter = TEMPLATE_DELIMITER.encode('ascii')
+    first_index = file_map.find(delimiter)
+    second_index = file_map.find(delimiter, first_index + len(delimiter)) if first_index >= 0 else -1
+    if second_index < 0:
+        return (None, None)
+    text_offset = second_index + len(delimiter)
+    try:
+        # the header is decoded and normalized to confirm that it splits at the same delimiters as the normalized file text
+        header_sections = unicodedata.normalize('NFKD', file_map[:text_offset].decode('utf-8')).split(TEMPLATE_DELIMITER)
+        if len(header_sections) != 3 or len(header_sections[2]) > 0:
+            return (None, None)
+        meta_data = load(header_sections[1], Loader=Loader)
+    except Exception:
+        return (None, None)  # split_data reports the header errors
+    if not isinstance(meta_data, dict) or not (no_replacements is True or meta_data.get('verbatim') == True):
+        return (None, None)
+    text_bytes = len(file_map) - text_offset
+    if text_bytes == 0 or file_map.find(delimiter, text_offset) >= 0 or _non_ascii_regex.search(file_map, text_offset) is not None:
+        return (None, None)
+    return (meta_data, (text_offset + 1, text_bytes - 1))  # the +1 skips the newline at the end of the delimiter
+
+
 class RemoteDoxxTemplate(DoxxTemplate):
     def __init__(self, inpath):
         DoxxTemplate.__init__(self, inpath)
 
     def load_data(self):
         """overloaded load_data method that retrieves data from a remote file using HTTP or HTTPS protocol instead of a local file"""
-        http = HTTP(self.inpath)
-        
-        if http.get_status_ok():
-            import unicodedata
-            norm_text = unicodedata.normalize('NFKD', http.res.text)  # normalize unicode data to NFKD (like local file reads)
-            self.raw_text = norm_text
-            return (True, "no message")
-        else:
-            fail_status_code = http.res.status_code
-            error_message = "[!] doxx: Unable to load the remote template file '" + self.inpath + "' (HTTP status code " + str(fail_status_code) + ")"
+        from doxx.utilities.fetcher import fetch_text, FetchError
+        try:
+            text = fetch_text(self.inpath)  # reuses the keep-alive connection of earlier requests to the same host from this thread
+        except FetchError as e:
+            if e.status_code is None:
+                raise e  # connection and URL errors are raised to the calling code
+            error_message = "[!] doxx: Unable to load the remote template file '" + self.inpath + "' (HTTP status code " + str(e.status_code) + ")"
             return (False, error_message)
-            
         
-        
\ No newline at end of file
+        import unicodedata
+        norm_text = unicodedata.normalize('NFKD', text)  # normalize unicode data to NFKD (like local file reads)
+        self.raw_text = norm_text
+        return (True, "no message")
+
+
+class DoxxStreamTemplate(DoxxTemplate):
+    """A local doxx template that is rendered from a stream of text chunks instead of a string in memory (templates that are larger than memory).
+    load_data reads the meta data header, the template text is read with iter_text_chunks during the render"""
+    def __init__(self, inpath, chunk_size=None, no_replacements=False):
+        DoxxTemplate.__init__(self, inpath, no_replacements=no_replacements)
+        self.streamed = True
+        self.chunk_size = chunk_size or STREAM_CHUNK_SIZE
+        self.header_text = u""  # meta data section of the header, between the first two delimiters
+        self.text_offset = 0    # byte offset of the template text in the file
+        self.text_bytes = 0     # size of the template text in bytes
+
+    def load_data(self):
+        delimiter = TEMPLATE_DELIMITER.encode('ascii')
+        with open(self.inpath, 'rb') as f:
+            file_map = _map_file(f)
+        try:
+            first_index = file_map.find(delimiter)
+            second_index = file_map.find(delimiter, first_index + len(delimiter)) if first_index >= 0 else -1
+            if second_index >= 0:
+                self.header_text = unicodedata.normalize('NFKD', file_map[first_index + len(delimiter):second_index].decode('utf-8'))
+                self.text_offset = second_index + len(delimiter)
+                self.text_bytes = len(file_map) - self.text_offset
+                self.header_meta_data, self.copy_range = _find_copy_range(file_map, self.no_replacements)
+        finally:
+            if isinstance(file_map, mmap.mmap):
+                file_map.close()
+
+    def split_data(self):
+        if self.text_offset > 0:
+            self.meta_data = load(self.header_text, Loader=Loader)
+        else:
+            self.meta_data = {}
+
+    def parse_template_for_errors(self):
+        if self.meta_data is None or len(self.meta_data) == 0:
+            error_message = u"[!] doxx: The template file '" + self.inpath + "' is not properly formatted.  Please include the required build specification block between '---doxx---' delimiters at the top of your file."
+            return (True, error_message)
+        elif self.text_bytes < 6:  # the newline after the delimiter and the shortest variable ({{x}})
+            error_message = u"[!] doxx: Unable to parse template text from the template file '" + self.inpath + "'. Please include a template in order to render this file."
+            return (True, error_message)
+        else:
+            return(False, "no message")
+
+    def iter_text_chunks(self):
+        """generator that yields the template text in NFKD normalized unicode chunks (the same text as DoxxTemplate.text in pieces)"""
+        if self.text_offset == 0:
+            return  # no meta data header, the template text is not defined
+        decoder = codecs.getincrementaldecoder('utf_8')()
+        normalize = unicodedata.normalize
+        combining = unicodedata.combining
+        delimiter_tail = u""   # end of the last chunk, detects a delimiter that is split between two chunks
+        pending = u""          # text after the last character that does not combine with the next chunk, normalized with the next chunk
+        first_chunk = True
+        with open(self.inpath, 'rb') as f:
+            f.seek(self.text_offset)
+            while True:
+                chunk_bytes = f.read(self.chunk_size)
+                text = pending + decoder.decode(chunk_bytes, final=not chunk_bytes)
+                if first_chunk and len(text) > 0:
+                    text = text[1:]  # remove the newline after the delimiter
+                    first_chunk = False
+                if chunk_bytes:
+                    # combining characters at the start of the next chunk are normalized with the last base character of this chunk
+                    split_index = len(text) - 1
+                    while split_index > 0 and combining(text[split_index]) != 0:
+                        split_index -= 1
+                    pending = text[split_index:]
+                    text = text[:split_index]
+                normalized_text = normalize('NFKD', text)
+                if TEMPLATE_DELIMITER in delimiter_tail + normalized_text:
+                    raise Exception("The template file '" + self.inpath + "' includes more than two '" + TEMPLATE_DELIMITER + "' delimiters.")
+                delimiter_tail = (delimiter_tail + normalized_text)[-(len(TEMPLATE_DELIMITER) - 1):]
+                if len(normalized_text) > 0:
+                    yield normalized_text
+                if not chunk_bytes:
+                    break
@@ -16,33 +16,50 @@ import re
 #    odel = opening delimiter
 #    cdel = closing delimiter
 #    varlist = inclusive list of all variables in the template text (parsed in constructor)
+#    segments = compiled template, list of alternating literal text and variable name strings (parsed in constructor)
+#                segments[0::2] are literal text, segments[1::2] are variable names
 #  Delimiters:
 #    default = {{variable}}
 #    assign new opening and closing delimiters as parameters when you make a new Template instance
 #    `escape_regex` boolean is a speedup, avoids Python escape of special regex chars if you do not need it
+#    `segments` accepts a previously compiled segment list for the same text and delimiters (e.g. from a cache), skips the parse
 #------------------------------------------------------------------------------
 class Template(unicode):
-    def __new__(cls, template_text, open_delimiter="{{", close_delimiter="}}", escape_regex=False):
+    def __new__(cls, template_text, open_delimiter="{{", close_delimiter="}}", escape_regex=False, segments=None):
         obj = unicode.__new__(cls, template_text)
         obj.odel = open_delimiter
         obj.cdel = close_delimiter
-        obj.varlist = obj._make_var_list(template_text, escape_regex) #contains all unique parsed variables from the template in a list
+        if segments is None:
+            obj.segments = obj._make_segment_list(template_text, escape_regex) #tokenize the template text once into literal and variable segments
+        else:
+            obj.segments = segments
+        obj.varlist = obj._make_var_list(obj.segments) #contains all unique parsed variables from the template in a list
         return obj
 
     #------------------------------------------------------------------------------
-    # [ _make_var_list method ] (list of strings)
-    #   Private method that parses the template string for all variables that match the delimiter pattern
-    #   Returns a list of the variable names as strings
+    # [ _make_segment_list method ] (list of strings)
+    #   Private method that splits the template string on every variable that matches the delimiter pattern
+    #   Returns a list of strings that alternates between literal text (even indices) and variable names (odd indices)
     #------------------------------------------------------------------------------
-    def _make_var_list(self, template_text, escape_regex=False):
+    def _make_segment_list(self, template_text, escape_regex=False):
         if escape_regex:
             open_match_pat = self._escape_regex_special_chars(self.odel)
             close_match_pat = self._escape_regex_special_chars(self.cdel)
-            match_pat = open_match_pat + r'(.*?)' + close_match_pat # capture group contains the variable name used between the opening and closing delimiters
         else:
-            match_pat = self.odel + r'(.*?)' + self.cdel
-        var_list = re.findall(match_pat, template_text) #generate a list that contains the capture group from the matches (i.e. the variables in the template)
-        return set(var_list) # remove duplicate entries by converting to set (and lookup speed improvement from hashing)
+            open_match_pat = self.odel
+            close_match_pat = self.cdel
+        # capture group contains the variable name used between the opening and closing delimiters
+        # the name cannot span lines or include the first character of the opening delimiter (the match begins at the innermost opening delimiter)
+        match_pat = open_match_pat + r'([^' + re.escape(self.odel[0]) + r'\n]*?)' + close_match_pat
+        return re.split(match_pat, template_text) # the capture group places the variable names at the odd indices of the returned list
+
+    #------------------------------------------------------------------------------
+    # [ _make_var_list method ] (set of strings)
+    #   Private method that collects the variable names from the compiled segment list
+    #   Returns a set of the variable names as strings
+    #------------------------------------------------------------------------------
+    def _make_var_list(self, segments):
+        return set(segments[1::2]) # remove duplicate entries by converting to set (and lookup speed improvement from hashing)
 
     #------------------------------------------------------------------------------
     # [ _escape_regex_special_chars method ] (string)
@@ -74,26 +91,122 @@ class Renderer:
     #------------------------------------------------------------------------------
     # [ render method ] (string)
     #   renders the variable replacements in the Ink template
+    #   single pass over the compiled template segments, variables that are not defined in the key are written back verbatim
+    #   replacement values are written verbatim: a {{variable}} in a key value is not replaced (the earlier sequential str.replace
+    #   replaced it only when the variable came later in the key iteration order), and {{{name}}} renders as {value} (the earlier
+    #   parser read the variable name as "{name" and left the text unchanged)
     #   returns the rendered template as a string
     #------------------------------------------------------------------------------
     def render(self):
         # make local variables for the loop below (faster)
         local_dict = self.key_dict
-        local_template = self.template
-        local_varlist = self.template.varlist
         local_odel = self.odel
         local_cdel = self.cdel
-        local_htmlent = self.html_entities
-        if local_htmlent:
+        rendered = list(self.template.segments)  # copy of the compiled segments, variable positions are replaced in place
+        if self.html_entities:
+            from xml.sax.saxutils import escape #from Python std lib
+            replacements = {}  # escape each key value once, not once per use in the template
+            for key in self.template.varlist:
+                if key in local_dict:
+                    replacements[key] = escape(local_dict[key]) #xml.sax.saxutils function
+        else:
+            replacements = local_dict
+        for i in range(1, len(rendered), 2):
+            key = rendered[i]
+            if key in replacements:
+                rendered[i] = replacements[key]
+            else:
+                rendered[i] = local_odel + key + local_cdel  # no key definition, keep the variable tag in the rendered text
+        return u"".join(rendered)
+
+#------------------------------------------------------------------------------
+# StreamRenderer class
+#  Render the variable replacements in template text that is read in chunks (e.g. template files that are larger than memory)
+#  Uses the variable syntax of the Template class.  A variable that is split between two chunks is held until the next chunk,
+#  the memory use is bounded by the chunk size and the length of the variable tags
+#  Parameters to constructor:
+#    - key = a dictionary mapped key = variable name : value = variable replacement data
+#    - open_delimiter, close_delimiter = variable delimiters (matched as literal text)
+#    - html_entities = encode html entities with HTML escaped characters (default = False = do not encode)
+#  Run the renderer with the render_chunks generator method (e.g. for text in r.render_chunks(chunks): out.write(text))
+#------------------------------------------------------------------------------
+
+class StreamRenderer:
+    def __init__(self, key, open_delimiter="{{", close_delimiter="}}", html_entities=False):
+        self.odel = open_delimiter
+        self.cdel = close_delimiter
+        self.html_entities = html_entities
+        self.key_dict = key
+        self.varlist = set()  # variables in the rendered text, defined during render_chunks
+        # same variable name rules as the Template class: a name cannot span lines or include the first character of the opening delimiter
+        self.match_regex = re.compile(re.escape(open_delimiter) + r'([^' + re.escape(open_delimiter[0]) + r'\n]*?)' + re.escape(close_delimiter))
+        if html_entities:
             from xml.sax.saxutils import escape #from Python std lib
-        for key in local_dict:            
-            if key in local_varlist:
-                value = local_dict[key]              
-                replace_string = local_odel + key + local_cdel
-                if local_htmlent:
-                    value = escape(value) #xml.sax.saxutils function
-                local_template = local_template.replace(replace_string, value)
-        return local_template
+            self.replacements = {}  # escape each key value once
+            for variable_name in key:
+                self.replacements[variable_name] = escape(key[variable_name]) #xml.sax.saxutils function
+        else:
+            self.replacements = key
+
+    #------------------------------------------------------------------------------
+    # [ render_chunks method ] (generator of strings)
+    #   renders the variable replacements in an iterable of template text chunks
+    #   yields the rendered text in pieces, the pieces joined together are equal to the Renderer output for the joined chunks
+    #------------------------------------------------------------------------------
+    def render_chunks(self, chunks):
+        pending = u""
+        for chunk in chunks:
+            pending += chunk
+            complete_length = self._get_complete_length(pending)
+            if complete_length > 0:
+                yield self._render_text(pending[:complete_length])
+                pending = pending[complete_length:]
+        if len(pending) > 0:
+            yield self._render_text(pending)
+
+    #------------------------------------------------------------------------------
+    # [ _render_text method ] (string)
+    #   Private method that renders text that does not include a partial variable tag
+    #------------------------------------------------------------------------------
+    def _render_text(self, text):
+        local_odel = self.odel
+        local_cdel = self.cdel
+        replacements = self.replacements
+        rendered = self.match_regex.split(text)
+        for i in range(1, len(rendered), 2):
+            key = rendered[i]
+            self.varlist.add(key)
+            if key in replacements:
+                rendered[i] = replacements[key]
+            else:
+                rendered[i] = local_odel + key + local_cdel  # no key definition, keep the variable tag in the rendered text
+        return u"".join(rendered)
+
+    #------------------------------------------------------------------------------
+    # [ _get_complete_length method ] (integer)
+    #   Private method that returns the length of the text that can be rendered before the next chunk is read
+    #   The remaining text starts with the opening delimiter (or part of it) of a variable tag that may be completed by the next chunk
+    #------------------------------------------------------------------------------
+    def _get_complete_length(self, text):
+        last_match_end = 0
+        for match in self.match_regex.finditer(text):
+            last_match_end = match.end()
+        last_open = text.rfind(self.odel[0])
+        if last_open < last_match_end:
+            return len(text)  # a variable tag cannot start after the last complete tag
+        # a variable name cannot include the first character of the opening delimiter, an incomplete tag starts within the opening delimiter length of its last occurrence
+        for start in range(max(last_match_end, last_open - len(self.odel) + 1), last_open + 1):
+            if self._is_partial_tag(text[start:]):
+                return start
+        return len(text)
+
+    def _is_partial_tag(self, text):
+        if len(text) <= len(self.odel):
+            return self.odel.startswith(text)
+        if not text.startswith(self.odel):
+            return False
+        name = text[len(self.odel):]
+        return self.odel[0] not in name and u"\n" not in name
 
 
 if __name__ == '__main__':
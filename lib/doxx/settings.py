@@ -44,20 +44,55 @@ USAGE
   doxx <option> [command] <argument>
   
 GENERAL COMMANDS
+  batch    build the templates for a directory, glob, or JSONL/CSV file of keys
   browse   browse to doxx source code, docs, and associated project files
   build    render string replacements in template files and build project
   clean    remove doxx project files from a project directory
   make     generate key, template, or project file stubs
-  pack     create a tar.gz or zip archive file for project distribution
+  pack     create a tar.gz, tar.xz, tar.bz2, or zip archive file for project distribution
   pull     pull remote files, archives, & Github repos (with shortcodes)
-  unpack   unpack a tar.gz or zip project archive
+  serve    run a build daemon that keeps keys and templates in memory
+  unpack   unpack a tar (gz, xz, bz2) or zip project archive
 
 PACKAGE REPOSITORY COMMANDS
-  pull     pull a project package from the doxx Package Repository
+  pull     pull a project package from the doxx Package Repository (a new pull writes only the changed files)
   pullkey  pull the key file from a doxx Package Repository project
   search   search the doxx Package Repository by keyword or project name
   whatis   get descriptions of Package Repository packages by project name
 
+BUILD OPTIONS
+  --incremental    skip templates with unchanged template text, key values, and output files
+  --jobs <n>       number of worker processes for multi-template builds (default: CPU count)
+  --serve          forward the build to a running doxx serve daemon (also on when DOXX_SOCKET is set)
+  --no-serve       build in this process when DOXX_SOCKET is set
+  --profile        print the build time of each phase (key, fetch, load, parse, render, mkdir, write, unpack)
+  --profile-json <path>  write the build phase times of each template and URL to a JSON file
+  --trace <path>   write a Chrome / Perfetto trace event JSON timeline of the build processes and fetch threads
+  --watch          rebuild the templates affected by changes to the key or template files
+
+BATCH OPTIONS
+  --key <path>     key file with the templates for JSONL/CSV key records (default: key.yaml)
+  --out <dir>      write each key to <dir>/<key name> (default: current directory)
+  --jobs <n>       number of worker processes (default: CPU count)
+
+PACK & UNPACK OPTIONS
+  --codec <name>   pack codec: gzip (default, tar.gz / deflate zip), xz (tar.xz), bz2 (tar.bz2), stored (tar / uncompressed zip)
+  --level <n>      pack compression level of the codec (gzip, bz2: 1-9, xz: 0-9)
+  --fast           pack with the fastest level of the codec (e.g. CI build artifacts)
+  --jobs <n>       number of compression threads / zip extraction processes (default: CPU count)
+  --incremental    pack with the compressed files of the last pack of the directory (tar.gz and zip, stored in the doxx cache)
+  --delta          pack: incremental pack of the files that changed since the last pack to a <name>.delta.tar.gz archive
+                   unpack: update an unpacked copy of the last pack with a delta archive (removes the files that it lists)
+  --manifest       also write <name>.manifest.json and the <name>-objects directory, publish them next to the package
+                   archive so that doxx pull of the package downloads only the changed files
+
+SERVE OPTIONS
+  --socket <path>  Unix domain socket path (default: $DOXX_SOCKET or $TMPDIR/doxx-<uid>.sock)
+  --stop           stop the running doxx serve daemon
+
+BUILD & PULL OPTIONS
+  --offline        use cached copies of remote files without revalidation (or set DOXX_OFFLINE=1)
+
 OPTIONS
   -h | --help      view application help
        --usage     view application usage
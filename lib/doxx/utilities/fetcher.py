@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+import requests
+try:
+    from requests.compat import chardet  # chardet or charset_normalizer, None on requests releases without a detector installed
+except ImportError:
+    chardet = None
+from Naked.toolshed.python import is_py2
+
+from doxx.datatypes.cache import DoxxHTTPCache
+from doxx.utilities.filesystem import _create_dirs, _replace_file, _write_file_atomic
+from doxx.utilities.profiler import timed_function
+
+if is_py2():
+    from Queue import Queue, Full
+else:
+    from queue import Queue, Full
+
+FETCH_CONCURRENCY = 8         # maximum number of simultaneous downloads
+FETCH_TIMEOUT = (15, 120)     # (connect, read) timeouts in seconds, the read timeout applies to each read from the socket and not the entire download
+FETCH_CHUNK_SIZE = 65536      # streamed write chunk size in bytes
+FETCH_PREFETCH_CHUNKS = 32    # number of chunks that open_stream downloads ahead of the reader (bounds memory use to ~2MB)
+
+HTTP_CACHE_DIR = None         # override the HTTP response cache directory path (default = 'http' in the doxx cache directory)
+OFFLINE_ENVIRONMENT_VARIABLE = "DOXX_OFFLINE"  # set to 1 (or the --offline option) to use cached responses without revalidation
+
+_thread_data = threading.local()  # one HTTP session per download thread (requests sessions are not thread safe)
+
+
+class FetchError(Exception):
+    """Raised for HTTP error status codes and connection failures.  The message is formatted for doxx stderr output"""
+    def __init__(self, url, message, status_code=None):
+        Exception.__init__(self, message)
+        self.url = url
+        self.status_code = status_code
+
+
+########################################
+#
+#  [fetch_text]
+#       public function
+#       - return remote text data
+#
+########################################
+@timed_function("fetch")
+def fetch_text(url):
+    """returns the text from a remote file as a unicode string, raises FetchError for unsuccessful requests"""
+    response, entry = _open_url(url)
+    if response is None:
+        with open(entry['body_path'], 'rb') as f:
+            return _decode_text(f.read(), entry['encoding'])
+    try:
+        body = b"".join(_iter_response_body(url, response))
+    except requests.exceptions.RequestException as e:
+        raise FetchError(url, "[!] doxx: Unable to pull '" + url + "'. Error: " + str(e))
+    finally:
+        response.close()
+    return _decode_text(body, response.encoding)
+
+
+########################################
+#
+#  [fetch_text_file]
+#       public function
+#       - pull remote text file to disk
+#
+########################################
+def fetch_text_file(url, file_path):
+    """pulls a remote text file, writes it to [file_path] with the doxx text file write encoding, and returns [file_path].  Raises FetchError for unsuccessful requests"""
+    # text files are decoded and written with the FileWriter encoding rules so they are held in memory rather than streamed
+    text = fetch_text(url)
+    _create_dirs(file_path)
+    _write_file_atomic(file_path, text)
+    return file_path
+
+
+########################################
+#
+#  [fetch_binary_file]
+#       public function
+#       - stream remote file to disk
+#
+########################################
+@timed_function("fetch")
+def fetch_binary_file(url, file_path):
+    """streams a remote file to [file_path] in FETCH_CHUNK_SIZE chunks and returns [file_path].  Raises FetchError for unsuccessful requests"""
+    response, entry = _open_url(url)
+    try:
+        _create_dirs(file_path)
+        dir_path = os.path.dirname(file_path)
+        if dir_path == "":
+            dir_path = "."
+        # write to a temporary file then rename so that a failed download does not leave a partial file at [file_path]
+        fd, temp_path = tempfile.mkstemp(dir=dir_path, prefix=".doxx-", suffix=".part")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if response is None:
+                    with open(entry['body_path'], 'rb') as cached_file:
+                        shutil.copyfileobj(cached_file, f, FETCH_CHUNK_SIZE)  # the cached copy is current
+                else:
+                    for chunk in _iter_response_body(url, response):
+                        f.write(chunk)
+            _replace_file(temp_path, file_path)
+        except Exception as e:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            if isinstance(e, (requests.exceptions.RequestException, IOError)):
+                raise FetchError(url, "[!] doxx: Unable to pull '" + url + "'. Error: " + str(e))
+            raise e
+    finally:
+        if response is not None:
+            response.close()
+    return file_path
+
+
+########################################
+#
+#  [open_stream]
+#       public function
+#       - read remote file data as it
+#           is downloaded
+#
+########################################
+def open_stream(url):
+    """returns a read-only file object for the bytes of a remote file.  The body is read from the network as the caller reads the
+    file object (or from the cache if the cached copy is current).  Raises FetchError for unsuccessful requests"""
+    response, entry = _open_url(url)
+    if response is None:
+        return open(entry['body_path'], 'rb')
+    return DoxxResponseStream(url, response)
+
+
+class DoxxResponseStream(object):
+    """File object for a streamed response body.  A download thread reads up to FETCH_PREFETCH_CHUNKS chunks ahead of the
+    reader so that network reads overlap the reader's processing (e.g. disk writes).  Raises FetchError on download errors"""
+    def __init__(self, url, response):
+        self.url = url
+        self.response = response
+        self.chunk = b""
+        self.offset = 0
+        self.eof = False
+        self.closed = False
+        self.queue = Queue(maxsize=FETCH_PREFETCH_CHUNKS)
+        self.thread = threading.Thread(target=self._download)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def read(self, size=-1):
+        parts = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self.offset >= len(self.chunk) and not self._next_chunk():
+                break
+            if size < 0:
+                part = self.chunk[self.offset:]
+            else:
+                part = self.chunk[self.offset:self.offset + remaining]
+                remaining -= len(part)
+            self.offset += len(part)
+            parts.append(part)
+        return b"".join(parts)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.response.close()  # interrupts a download thread that is waiting on the network
+            self.thread.join(5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _next_chunk(self):
+        if self.eof:
+            return False
+        item = self.queue.get()
+        if item is None:
+            self.eof = True
+            return False
+        if isinstance(item, Exception):
+            self.eof = True
+            raise FetchError(self.url, "[!] doxx: Unable to pull '" + self.url + "'. Error: " + str(item))
+        self.chunk = item
+        self.offset = 0
+        return True
+
+    def _download(self):
+        body = _iter_response_body(self.url, self.response)
+        try:
+            for chunk in body:
+                if not self._put(chunk):
+                    return  # the reader closed the stream
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+        finally:
+            body.close()  # the cached body is discarded if the download did not complete
+
+    def _put(self, item):
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+
+########################################
+#
+#  [fetch_all]
+#       public function
+#       - concurrent pulls with a bounded
+#           thread pool
+#
+########################################
+def fetch_all(fetch_function, url_dict, concurrency=FETCH_CONCURRENCY):
+    """generator that runs fetch_function(url, file_path) for every file_path : url item in url_dict with up to [concurrency] simultaneous
+    downloads.  Yields (file_path, url, return value, error) tuples in the order that the downloads complete, error is None for successful downloads"""
+    jobs = [(fetch_function, file_path, url_dict[file_path]) for file_path in url_dict]
+    if len(jobs) == 0:
+        return
+    if len(jobs) == 1 or concurrency < 2:
+        for job in jobs:
+            yield _fetch_job_runner(job)
+        return
+    # network requests release the GIL, threads are sufficient and share the keep-alive connections of their sessions across files
+    pool = ThreadPool(processes=min(concurrency, len(jobs)))
+    try:
+        for result in pool.imap_unordered(_fetch_job_runner, jobs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _fetch_job_runner(job):
+    fetch_function, file_path, url = job
+    try:
+        return (file_path, url, fetch_function(url, file_path), None)
+    except FetchError as e:
+        return (file_path, url, None, str(e))
+    except SystemExit:
+        # doxx functions that report their own errors with stderr(exit=1), do not let SystemExit end the pool worker thread
+        return (file_path, url, None, "[!] doxx: Unable to pull '" + file_path + "' from '" + url + "'.")
+    except Exception as e:
+        return (file_path, url, None, "[!] doxx: Unable to pull '" + file_path + "' from '" + url + "'. Error: " + str(e))
+
+
+def _get_session():
+    """returns the HTTP session for the current thread.  The session keeps connections to each host alive between requests"""
+    session = getattr(_thread_data, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _thread_data.session = session
+    return session
+
+
+def is_offline_mode():
+    """returns True if cached responses are used without revalidation"""
+    return os.environ.get(OFFLINE_ENVIRONMENT_VARIABLE, "") not in ("", "0")
+
+
+def _open_url(url):
+    """returns a (response, cache entry) tuple.  The response is None when the cached body for url is current (HTTP 304 or offline mode)"""
+    http_cache = DoxxHTTPCache(cache_dir=HTTP_CACHE_DIR)
+    entry = http_cache.get_entry(url)
+    if entry is None:
+        return (_get_response(url), None)
+    if is_offline_mode():
+        http_cache.touch_entry(entry)
+        return (None, entry)
+    # conditional GET with the validators of the cached body
+    response = _get_response(url, http_cache.get_validator_headers(entry))
+    if response.status_code == requests.codes.not_modified:
+        response.close()
+        http_cache.touch_entry(entry)
+        return (None, entry)
+    return (response, None)
+
+
+def _iter_response_body(url, response):
+    """yields the body chunks of a response and writes them to the HTTP cache, the cached body is stored after the last chunk"""
+    writer = None
+    if "no-store" not in response.headers.get('Cache-Control', "").lower():
+        writer = DoxxHTTPCache(cache_dir=HTTP_CACHE_DIR).open_body_writer(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), response.encoding)
+    complete = False
+    try:
+        for chunk in response.iter_content(chunk_size=FETCH_CHUNK_SIZE):
+            if chunk:  # filter out keep-alive new chunks
+                if writer is not None:
+                    writer.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        if writer is not None:
+            if complete:
+                writer.commit()
+            else:
+                writer.discard()  # failed or abandoned download
+
+
+def _decode_text(body, encoding):
+    """decodes response body bytes with the same rules as requests Response.text"""
+    if encoding is None:
+        if chardet is not None:
+            encoding = chardet.detect(body)['encoding'] or 'utf-8'
+        else:
+            encoding = 'utf-8'
+    try:
+        return body.decode(encoding, 'replace')
+    except LookupError:
+        return body.decode('utf-8', 'replace')
+
+
+def _get_response(url, headers=None):
+    try:
+        response = _get_session().get(url, headers=headers, stream=True, timeout=FETCH_TIMEOUT)
+    except Exception as e:
+        raise FetchError(url, "[!] doxx: Unable to pull '" + url + "'. Error: " + str(e))
+    if response.status_code == requests.codes.ok or (headers and response.status_code == requests.codes.not_modified):
+        return response
+    status_code = response.status_code
+    response.close()
+    if status_code == 404:
+        raise FetchError(url, "[!] doxx: Unable to pull '" + url + "' because it cannot be found. (HTTP status code: 404)", status_code)
+    else:
+        raise FetchError(url, "[!] doxx: Unable to pull '" + url + "'. HTTP status code: " + str(status_code), status_code)
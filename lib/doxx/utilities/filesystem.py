@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import io
 import os
+import errno
+import stat
+import binascii
+from Naked.toolshed.file import FileWriter
 from Naked.toolshed.system import dir_exists
 
 ########################################
@@ -31,7 +36,121 @@ def _make_os_dependent_path(file_path):
 def _create_dirs(file_path):
     """Creates a recursive directory path to the requested file name if it does not exist. [file_path] must have correct OS path separators as they are not checked in this function"""
     dir_path = os.path.dirname(file_path)
-    if dir_exists(dir_path):
+    if dir_path == "" or dir_exists(dir_path):
         pass
     else:
-        os.makedirs(dir_path)    
\ No newline at end of file
+        try:
+            os.makedirs(dir_path)
+        except OSError:
+            if not dir_exists(dir_path):  # another process may create the same directory path at the same time
+                raise
+
+
+########################################
+#
+# FILES
+#
+########################################
+def _write_file_atomic(file_path, text):
+    """Writes text to a temporary file in the destination directory and renames it to [file_path].  Readers and concurrent writers never see a partially written file"""
+    _write_atomic(file_path, lambda temp_path: FileWriter(temp_path).write(text))
+
+
+def _write_chunks_atomic(file_path, text_chunks):
+    """Writes an iterable of unicode text chunks (e.g. a streamed template render) to [file_path] through a temporary file, the chunks are written as they are produced"""
+    def write_chunks(temp_path):
+        with io.open(temp_path, 'w', encoding='utf-8') as f:
+            for text_chunk in text_chunks:
+                f.write(text_chunk)
+    _write_atomic(file_path, write_chunks)
+
+
+def _copy_file_atomic(file_path, source_path, offset, count):
+    """Copies [count] bytes at [offset] in [source_path] to [file_path] through a temporary file.  The bytes are copied in the kernel (copy_file_range, sendfile) where the platform supports it"""
+    def copy_bytes(temp_path):
+        with open(source_path, 'rb') as source_file:
+            with open(temp_path, 'wb') as temp_file:
+                _copy_bytes(source_file.fileno(), temp_file.fileno(), offset, count)
+    _write_atomic(file_path, copy_bytes)
+
+
+def _copy_bytes(source_fd, destination_fd, offset, count):
+    """Copies [count] bytes at [offset] in the source file to the destination file position.  Falls back to the next copy function if
+    the platform or file system does not support a kernel copy"""
+    end_offset = offset + count
+    for copy_function in _copy_functions:
+        try:
+            while offset < end_offset:
+                copied_bytes = copy_function(source_fd, destination_fd, offset, min(end_offset - offset, 1073741824))
+                if copied_bytes == 0:
+                    raise IOError("The source file ended before the requested byte range was copied.")
+                offset += copied_bytes
+            return
+        except OSError as e:
+            if e.errno not in _copy_fallback_errnos:
+                raise e
+
+
+def _copy_file_range(source_fd, destination_fd, offset, count):
+    return os.copy_file_range(source_fd, destination_fd, count, offset)
+
+
+def _sendfile(source_fd, destination_fd, offset, count):
+    return os.sendfile(destination_fd, source_fd, offset, count)
+
+
+def _read_write(source_fd, destination_fd, offset, count):
+    os.lseek(source_fd, offset, os.SEEK_SET)
+    data = os.read(source_fd, min(count, 1048576))
+    written_bytes = 0
+    while written_bytes < len(data):
+        written_bytes += os.write(destination_fd, data[written_bytes:])
+    return len(data)
+
+
+# kernel copies first, errors in this list move to the next copy function (unsupported file system, cross device copy, socket only sendfile)
+_copy_functions = [f for f, name in ((_copy_file_range, 'copy_file_range'), (_sendfile, 'sendfile')) if hasattr(os, name)] + [_read_write]
+_copy_fallback_errnos = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK, errno.EBADF)
+
+
+def _write_atomic(file_path, write_function):
+    """Calls write_function with the path of a temporary file in the destination directory, then renames the temporary file to [file_path]"""
+    dir_path = os.path.dirname(file_path)
+    if dir_path == "":
+        dir_path = "."
+    temp_path = _create_temp_file(dir_path)
+    try:
+        write_function(temp_path)
+        # new files have the default permissions (0666 and the umask), a replaced file keeps its permissions
+        if os.path.isfile(file_path):
+            os.chmod(temp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+        _replace_file(temp_path, file_path)
+    except Exception as e:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise e
+
+
+def _create_temp_file(dir_path):
+    """Creates an empty temporary file in [dir_path] and returns the path.  The file is created with 0666 permissions and the kernel applies
+    the process umask (tempfile.mkstemp creates 0600 files, reading the umask requires a process wide umask change)"""
+    while True:
+        temp_path = os.path.join(dir_path, ".doxx-" + binascii.hexlify(os.urandom(8)).decode('ascii') + ".tmp")
+        try:
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                continue
+            raise e
+        os.close(fd)
+        return temp_path
+
+
+def _replace_file(source_path, destination_path):
+    """Renames [source_path] to [destination_path], replaces an existing file"""
+    if hasattr(os, 'replace'):
+        os.replace(source_path, destination_path)  # atomic on POSIX and Windows (Python 3.3+)
+    else:
+        if os.name == 'nt' and os.path.isfile(destination_path):
+            os.remove(destination_path)  # Python 2 rename does not replace an existing file on Windows
+        os.rename(source_path, destination_path)    
\ No newline at end of file
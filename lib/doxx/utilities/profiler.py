@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import json
+import time
+import threading
+from functools import wraps
+
+# build phase timing for the doxx build --profile and --profile-json reports.  Spans are not recorded unless enable_profile is called
+PROFILE_REPORT_SUBJECTS = 10    # number of templates / URLs in the slowest subjects section of the report
+
+_profile_enabled = False
+_profile_start_time = None
+_profile_spans = []                # (phase, subject, start time, duration, process id, thread id) tuples
+_profile_lock = threading.Lock()   # remote file pulls record spans from the fetch threads
+
+
+########################################
+#
+#  [enable_profile]
+#       public function
+#       - start recording build spans
+#
+########################################
+
+def enable_profile():
+    """starts recording build phase spans in this process (the build worker processes call it in the pool initializer)"""
+    global _profile_enabled, _profile_start_time, _profile_spans
+    _profile_enabled = True
+    _profile_start_time = time.time()
+    _profile_spans = []  # a forked worker process does not report the spans of the parent process
+
+
+def disable_profile():
+    """stops recording build phase spans and clears the recorded spans"""
+    global _profile_enabled, _profile_spans
+    _profile_enabled = False
+    _profile_spans = []
+
+
+def is_profile_enabled():
+    return _profile_enabled
+
+
+########################################
+#
+#  [timed_phase]
+#       public function
+#       - time a with block as a span
+#
+########################################
+
+def timed_phase(phase, subject=""):
+    """returns a context manager that records the wall time of a with block as a [phase] span for [subject] (a template path or URL).
+    Phases: key, fetch, load, parse, render, mkdir, write, unpack"""
+    if _profile_enabled:
+        return _TimedPhase(phase, subject)
+    return _null_phase
+
+
+def timed_function(phase):
+    """decorator that records each call of a function as a [phase] span, the subject of the span is the first argument of the call (a URL or file path)"""
+    def decorator(function):
+        @wraps(function)
+        def timed_function_call(subject, *args, **kwargs):
+            if not _profile_enabled:
+                return function(subject, *args, **kwargs)
+            with _TimedPhase(phase, subject):
+                return function(subject, *args, **kwargs)
+        return timed_function_call
+    return decorator
+
+
+class _TimedPhase(object):
+    def __init__(self, phase, subject):
+        self.phase = phase
+        self.subject = subject
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record_span(self.phase, self.subject, self.start_time, time.time() - self.start_time)
+        return False  # failed phases are recorded, the exception is raised to the calling code
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_phase = _NullPhase()
+
+
+def record_span(phase, subject, start_time, duration):
+    with _profile_lock:
+        _profile_spans.append((phase, subject, start_time, duration, os.getpid(), threading.current_thread().ident))
+
+
+def pop_profile_spans():
+    """returns and clears the spans that were recorded in this process (build worker processes return them with each template result)"""
+    global _profile_spans
+    with _profile_lock:
+        spans = _profile_spans
+        _profile_spans = []
+    return spans
+
+
+def add_profile_spans(spans):
+    """adds the spans from a build worker process"""
+    with _profile_lock:
+        _profile_spans.extend(spans)
+
+
+def get_profile_spans():
+    with _profile_lock:
+        return list(_profile_spans)
+
+
+########################################
+#
+#  [format_profile_report]
+#       public function
+#       - --profile summary text
+#
+########################################
+
+def get_profile_summary(spans):
+    """returns a (phase totals, subject totals) tuple.  phase totals = {phase: {'seconds', 'count', 'max'}}, subject totals = {subject: {phase: seconds}}"""
+    phase_totals = {}
+    subject_totals = {}
+    for phase, subject, start_time, duration, pid, tid in spans:
+        phase_total = phase_totals.setdefault(phase, {'seconds': 0.0, 'count': 0, 'max': 0.0})
+        phase_total['seconds'] += duration
+        phase_total['count'] += 1
+        phase_total['max'] = max(phase_total['max'], duration)
+        if subject:
+            subject_phases = subject_totals.setdefault(subject, {})
+            subject_phases[phase] = subject_phases.get(phase, 0.0) + duration
+    return (phase_totals, subject_totals)
+
+
+def format_profile_report(spans=None, wall_time=None):
+    """returns the --profile report text: phase totals sorted by time, then the slowest templates and URLs with their phase times"""
+    if spans is None:
+        spans = get_profile_spans()
+    if wall_time is None:
+        wall_time = _get_wall_time()
+    phase_totals, subject_totals = get_profile_summary(spans)
+    process_count = len(set(span[4] for span in spans))
+    lines = ["[*] doxx: Build profile: " + _format_seconds(wall_time) + " wall time, " + str(process_count) + " process(es). Phase times are summed across processes and threads."]
+    lines.append("    %-8s %10s %8s %10s" % ("phase", "total", "count", "max"))
+    for phase in sorted(phase_totals, key=lambda p: (-phase_totals[p]['seconds'], p)):
+        phase_total = phase_totals[phase]
+        lines.append("    %-8s %10s %8d %10s" % (phase, _format_seconds(phase_total['seconds']), phase_total['count'], _format_seconds(phase_total['max'])))
+    if len(subject_totals) > 0:
+        lines.append("    slowest templates and URLs:")
+        sorted_subjects = sorted(subject_totals, key=lambda s: (-sum(subject_totals[s].values()), s))
+        for subject in sorted_subjects[:PROFILE_REPORT_SUBJECTS]:
+            subject_phases = subject_totals[subject]
+            phase_text = ", ".join(p + " " + _format_seconds(subject_phases[p]) for p in sorted(subject_phases, key=lambda p: -subject_phases[p]))
+            lines.append("    %10s  %s (%s)" % (_format_seconds(sum(subject_phases.values())), subject, phase_text))
+    return "\n".join(lines)
+
+
+########################################
+#
+#  [write_profile_json]
+#       public function
+#       - --profile-json output
+#
+########################################
+
+def write_profile_json(file_path, spans=None, wall_time=None):
+    """writes the phase totals, the phase times of each template and URL, and the raw spans (times in seconds) to a JSON file"""
+    if spans is None:
+        spans = get_profile_spans()
+    if wall_time is None:
+        wall_time = _get_wall_time()
+    phase_totals, subject_totals = get_profile_summary(spans)
+    profile_data = {
+        'wall_time': wall_time,
+        'phases': phase_totals,
+        'subjects': subject_totals,
+        'spans': [{'phase': phase, 'subject': subject, 'start': start_time, 'duration': duration, 'pid': pid, 'tid': tid} for phase, subject, start_time, duration, pid, tid in sorted(spans, key=lambda span: span[2])],
+    }
+    with open(file_path, 'w') as f:
+        json.dump(profile_data, f, indent=2, sort_keys=True)
+
+
+########################################
+#
+#  [write_trace_json]
+#       public function
+#       - --trace Chrome trace events
+#
+########################################
+
+def write_trace_json(file_path, spans=None):
+    """writes the spans in the Chrome trace event format (chrome://tracing, https://ui.perfetto.dev).  Each build process is a
+    track (the worker processes of a multi-template build), each thread is a row of the track (the remote file fetch threads)"""
+    if spans is None:
+        spans = get_profile_spans()
+    main_pid = os.getpid()
+    start_time = min([span[2] for span in spans] + [_profile_start_time or time.time()])
+    trace_events = []
+    thread_numbers = {}  # (pid, tid) : trace thread number in the order of the first span, thread idents are large numbers
+    for phase, subject, span_start_time, duration, pid, tid in sorted(spans, key=lambda span: span[2]):
+        if (pid, tid) not in thread_numbers:
+            thread_number = len([key for key in thread_numbers if key[0] == pid])
+            thread_numbers[(pid, tid)] = thread_number
+            if thread_number == 0:
+                process_name = "doxx build" if pid == main_pid else "doxx build worker"
+                trace_events.append({'ph': 'M', 'name': 'process_name', 'pid': pid, 'tid': 0, 'args': {'name': process_name + " (" + str(pid) + ")"}})
+                trace_events.append({'ph': 'M', 'name': 'process_sort_index', 'pid': pid, 'tid': 0, 'args': {'sort_index': 0 if pid == main_pid else 1}})
+            trace_events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': thread_number, 'args': {'name': "main" if thread_number == 0 else "thread " + str(thread_number)}})
+        trace_events.append({
+            'ph': 'X',
+            'name': phase + " " + subject if subject else phase,
+            'cat': phase,
+            'pid': pid,
+            'tid': thread_numbers[(pid, tid)],
+            'ts': round((span_start_time - start_time) * 1000000.0, 1),   # microseconds from the start of the build
+            'dur': round(duration * 1000000.0, 1),
+            'args': {'subject': subject},
+        })
+    with open(file_path, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+def _get_wall_time():
+    if _profile_start_time is None:
+        return 0.0
+    return time.time() - _profile_start_time
+
+
+def _format_seconds(seconds):
+    if seconds < 1.0:
+        return "%.1fms" % (seconds * 1000.0)
+    return "%.3fs" % seconds
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import array
+import marshal
+import hashlib
+
+from Naked.toolshed.python import is_py2
+
+
+class BigramIndex(object):
+    """Inverted index of the character bigrams in the package names of the package repository list.  Narrows the package names that are
+    compared by the FuzzySearcher ratios for the best results (ratio > 0.8) to the names that share a bigram with the search string.
+
+    A difflib ratio 2M/(L+H) > 0.8 of two strings with L + H >= 5 characters requires a matching block of two or more characters: the
+    matching blocks are separated by at least one unmatched character, so M single character blocks require 3M <= L + H + 1.  The
+    FuzzySearcher compares the search string (or its alphabetically sorted words) with the name, a substring of the name, or name tokens
+    joined with spaces, the index includes the bigrams of the name with '-' and with space separators padded with a space on both ends so
+    that every bigram of these strings is indexed.  Search strings with fewer than 4 characters (L + H < 5) search the entire list"""
+    format_version = 2  # bump when the stored format changes
+
+    def __init__(self, postings=None, list_hash=""):
+        self.postings = postings if postings is not None else {}   # bigram : array of package list indices (stored as bytes)
+        self.list_hash = list_hash                                  # hash of the package list text that the index was built from
+
+    @classmethod
+    def build(cls, package_list, list_hash):
+        """builds the index for the package list (list of package name strings)"""
+        index_lists = {}
+        for index, package_name in enumerate(package_list):
+            for bigram in get_name_bigrams(package_name):
+                index_lists.setdefault(bigram, []).append(index)
+        postings = {}
+        for bigram in index_lists:
+            postings[bigram] = _array_to_bytes(array.array('i', index_lists[bigram]))  # bytes load from the cache without an object per index
+        return cls(postings, list_hash)
+
+    @classmethod
+    def loads(cls, index_bytes):
+        """returns the index from bytes that were created with the dumps method or None if the bytes are not a valid index"""
+        try:
+            format_version, list_hash, postings = marshal.loads(index_bytes)
+            if format_version != cls.format_version:
+                return None
+            return cls(postings, list_hash)
+        except Exception:
+            return None
+
+    def dumps(self):
+        return marshal.dumps((self.format_version, self.list_hash, self.postings))
+
+    def get_candidate_indices(self, search_string):
+        """returns the sorted list of package list indices that share a bigram with the search string or None if the search string is
+        shorter than 4 characters and all package names must be searched"""
+        normalized_search_string = search_string.lower().strip()
+        if len(normalized_search_string) < 4:
+            return None
+        search_bigrams = get_bigrams(normalized_search_string)
+        search_bigrams.update(get_bigrams(" ".join(sorted(normalized_search_string.split(" ")))))  # multi word FuzzySearcher ratios
+        candidate_set = set()
+        for bigram in search_bigrams:
+            posting = self.postings.get(bigram)
+            if posting is not None:
+                candidate_set.update(_array_from_bytes(posting))
+        return sorted(candidate_set)  # original package list order, FuzzySearcher results with the same ratio keep the list order
+
+
+def get_bigrams(text):
+    """returns the set of character bigrams in the text"""
+    return set(text[x:x + 2] for x in range(len(text) - 1))
+
+
+def get_name_bigrams(package_name):
+    """returns the set of character bigrams of a normalized package name and of the name with space separated tokens, padded with a space"""
+    normalized_name = package_name.lower().strip()
+    bigrams = get_bigrams(u" " + normalized_name + u" ")
+    bigrams.update(get_bigrams(u" " + normalized_name.replace(u"-", u" ") + u" "))
+    return bigrams
+
+
+def hash_package_list(master_text):
+    """returns the hash of the package list text, used to detect a changed package list"""
+    return hashlib.sha1(master_text.encode('utf-8')).hexdigest()
+
+
+def _array_to_bytes(index_array):
+    if is_py2():
+        return index_array.tostring()
+    else:
+        return index_array.tobytes()
+
+
+def _array_from_bytes(index_bytes):
+    index_array = array.array('i')
+    if is_py2():
+        index_array.fromstring(index_bytes)
+    else:
+        index_array.frombytes(index_bytes)
+    return index_array
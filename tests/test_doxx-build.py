@@ -6,11 +6,19 @@ import os
 import unittest
 import unicodedata
 import shutil
+import tempfile
+import subprocess
+import multiprocessing
+import multiprocessing.pool
 
 from Naked.toolshed.system import make_path, file_exists, dir_exists
 from Naked.toolshed.file import FileReader, FileWriter
 from doxx.datatypes.key import DoxxKey
-from doxx.commands.build import Builder
+from doxx.datatypes.manifest import DoxxBuildManifest
+import doxx
+from doxx.commands.build import Builder, multi_process_build
+from doxx.commands.batch import BatchBuilder
+from doxx.datatypes import template as doxx_template
 
 
 # single template, ASCII text build test
@@ -834,4 +842,238 @@ class OfficialPackageRepositoryTests(unittest.TestCase):
             raise e
     
     def test_package_repo_build_badpackage(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class IncrementalBuildTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.incremental_testdir = "build-tests/incremental"
+        self.single_key = "key.yaml"
+        self.multi_key = "multi-key.yaml"
+        self.mit_standard_text = FileReader("standards/mit-license.txt").read()
+        
+    def tearDown(self):
+        for test_file in ('mit.txt', 'mit-verbatim', '.key.yaml.doxxmanifest', '.multi-key.yaml.doxxmanifest'):
+            if file_exists(test_file):
+                os.remove(test_file)
+        os.chdir(self.cwd)
+    
+    # unchanged output files are not rewritten on the second build
+    def test_incremental_single_template_build(self):
+        os.chdir(self.incremental_testdir)
+        Builder(self.single_key, incremental=True).run()
+        self.assertTrue(file_exists('.key.yaml.doxxmanifest'))
+        self.assertEqual(self.mit_standard_text, FileReader('mit.txt').read())
+        os.utime('mit.txt', (0, 0))
+        Builder(self.single_key, incremental=True).run()
+        self.assertEqual(0, os.path.getmtime('mit.txt'))  # skipped
+        
+    # modified output files are rebuilt
+    def test_incremental_build_modified_output(self):
+        os.chdir(self.incremental_testdir)
+        Builder(self.single_key, incremental=True).run()
+        FileWriter('mit.txt').write(u"modified")
+        Builder(self.single_key, incremental=True).run()
+        self.assertEqual(self.mit_standard_text, FileReader('mit.txt').read())
+        
+    # verbatim templates are copied from the template file, the output is the same as the decoded template text
+    def test_verbatim_copy_build(self):
+        os.chdir(self.incremental_testdir)
+        Builder(self.multi_key).run()
+        verbatim_text = FileReader('../../templates/mit-verbatim.doxt').read().split(u"---doxx---")[2][1:]
+        self.assertEqual(verbatim_text, FileReader('mit-verbatim').read())
+        
+    # multi-template incremental build
+    def test_incremental_multi_template_build(self):
+        os.chdir(self.incremental_testdir)
+        Builder(self.multi_key, incremental=True).run()
+        self.assertTrue(file_exists('mit.txt'))
+        self.assertTrue(file_exists('mit-verbatim'))
+        os.utime('mit.txt', (0, 0))
+        os.utime('mit-verbatim', (0, 0))
+        Builder(self.multi_key, incremental=True).run()
+        self.assertEqual(0, os.path.getmtime('mit.txt'))
+        self.assertEqual(0, os.path.getmtime('mit-verbatim'))
+
+
+    # a manifest write that fails keeps the manifest of the last build
+    def test_incremental_manifest_write_failure(self):
+        os.chdir(self.incremental_testdir)
+        Builder(self.single_key, incremental=True).run()
+        manifest_text = FileReader('.key.yaml.doxxmanifest').read()
+        manifest = DoxxBuildManifest(self.single_key)
+        manifest.entries['unserializable.doxt'] = object()
+        self.assertRaises(TypeError, manifest.write)
+        self.assertEqual(manifest_text, FileReader('.key.yaml.doxxmanifest').read())
+        self.assertEqual([], [file_name for file_name in os.listdir('.') if file_name.endswith('.tmp')])
+
+
+class RecordingPool(multiprocessing.pool.Pool):
+    """records the worker process count and the imap_unordered chunk size of the multi-template build pool"""
+    calls = []
+
+    def __init__(self, processes=None, *args, **kwargs):
+        RecordingPool.calls.append(('processes', processes))
+        multiprocessing.pool.Pool.__init__(self, processes, *args, **kwargs)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        RecordingPool.calls.append(('chunksize', chunksize))
+        return multiprocessing.pool.Pool.imap_unordered(self, func, iterable, chunksize)
+
+
+class MultiProcessBuildTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+        self.saved_pool = multiprocessing.Pool
+        multiprocessing.Pool = RecordingPool
+        RecordingPool.calls = []
+        
+    def tearDown(self):
+        multiprocessing.Pool = self.saved_pool
+        os.chdir(self.cwd)
+        shutil.rmtree(self.test_dir)
+    
+    def write_key(self, template_count, extra_templates=()):
+        template_paths = []
+        for x in range(template_count):
+            template_path = "t" + str(x) + ".doxt"
+            FileWriter(template_path).write(u"---doxx---\nbasename: t" + str(x) + u"\nextension: txt\n---doxx---\nName: {{name}} " + str(x) + u"\n")
+            template_paths.append(template_path)
+        template_paths.extend(extra_templates)
+        FileWriter("key.yaml").write(u"---\ntemplates: [" + u", ".join(template_paths) + u"]\n---\nname: Chris Simpkins\n")
+    
+    # the templates are rendered by a pool of worker processes in chunks of about 1/4 of the templates of each process
+    def test_multi_process_build_pool(self):
+        self.write_key(20)
+        Builder("key.yaml", processes=2).run()
+        self.assertEqual([('processes', 2), ('chunksize', 3)], RecordingPool.calls)
+        for x in range(20):
+            self.assertEqual(u"Name: Chris Simpkins " + str(x) + u"\n", FileReader("t" + str(x) + ".txt").read())
+    
+    # the pool does not start more worker processes than templates
+    def test_multi_process_build_processes_limit(self):
+        self.write_key(3)
+        Builder("key.yaml", processes=8).run()
+        self.assertEqual([('processes', 3), ('chunksize', 1)], RecordingPool.calls)
+        self.assertTrue(file_exists("t2.txt"))
+    
+    def test_multi_process_build_empty_templates(self):
+        self.write_key(1)
+        key = DoxxKey("key.yaml")
+        key.meta_data['templates'] = []
+        self.assertEqual([], multi_process_build(key, "key.yaml"))
+        self.assertEqual([], RecordingPool.calls)
+    
+    # failed templates are reported after the other templates are built, the build exit status is 1
+    def test_multi_process_build_failed_templates(self):
+        FileWriter("bad.doxt").write(u"Name: {{name}}\n")  # no build specification header
+        self.write_key(2, ["bad.doxt"])
+        self.assertEqual(["bad.doxt"], multi_process_build(DoxxKey("key.yaml"), "key.yaml", processes=2))
+        with self.assertRaises(SystemExit) as cm:
+            Builder("key.yaml", processes=2).run()
+        self.assertEqual(1, cm.exception.code)
+        self.assertTrue(file_exists("t0.txt"))
+        self.assertTrue(file_exists("t1.txt"))
+    
+    # a missing template file is reported and the other templates are built with exit status 0
+    def test_multi_process_build_missing_template(self):
+        self.write_key(2, ["missing.doxt"])
+        self.assertEqual([], multi_process_build(DoxxKey("key.yaml"), "key.yaml", processes=2))
+        Builder("key.yaml", processes=2).run()
+        self.assertTrue(file_exists("t1.txt"))
+    
+    def test_build_jobs_option(self):
+        self.write_key(4)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(doxx.__file__)))
+        script = "import sys; sys.argv = ['doxx'] + sys.argv[1:]; from doxx.app import main; main()"
+        process = subprocess.Popen([sys.executable, '-c', script, 'build', 'key.yaml', '--jobs', '2', '--no-serve'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        process.communicate()
+        self.assertEqual(0, process.returncode)
+        self.assertEqual(u"Name: Chris Simpkins 3\n", FileReader("t3.txt").read())
+        process = subprocess.Popen([sys.executable, '-c', script, 'build', 'key.yaml', '--jobs', 'two', '--no-serve'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        stderr_text = process.communicate()[1].decode('utf-8')
+        self.assertEqual(1, process.returncode)
+        self.assertTrue("The --jobs option requires an integer" in stderr_text)
+
+
+class StreamBuildTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.mit_standard_text = FileReader("standards/mit-license.txt").read()
+        self.stream_min_bytes = doxx_template.STREAM_TEMPLATE_MIN_BYTES
+        self.stream_chunk_size = doxx_template.STREAM_CHUNK_SIZE
+        doxx_template.STREAM_TEMPLATE_MIN_BYTES = 0  # stream every local template
+        os.chdir("build-tests/incremental")
+        
+    def tearDown(self):
+        doxx_template.STREAM_TEMPLATE_MIN_BYTES = self.stream_min_bytes
+        doxx_template.STREAM_CHUNK_SIZE = self.stream_chunk_size
+        for test_file in ('mit.txt', 'mit-verbatim', '.key.yaml.doxxmanifest'):
+            if file_exists(test_file):
+                os.remove(test_file)
+        os.chdir(self.cwd)
+    
+    # streamed renders are equal to the in memory render for chunks that split delimiters and variable names
+    def test_stream_build_single_template(self):
+        for chunk_size in (1, 7, 4096):
+            doxx_template.STREAM_CHUNK_SIZE = chunk_size
+            Builder("key.yaml").run()
+            self.assertEqual(self.mit_standard_text, FileReader('mit.txt').read())
+    
+    def test_stream_build_multi_template(self):
+        doxx_template.STREAM_CHUNK_SIZE = 5
+        Builder("multi-key.yaml", processes=2).run()
+        self.assertEqual(self.mit_standard_text, FileReader('mit.txt').read())
+        self.assertTrue(file_exists('mit-verbatim'))
+    
+    # streamed templates are skipped in incremental builds when the template file and key are unchanged
+    def test_stream_build_incremental(self):
+        Builder("key.yaml", incremental=True).run()
+        os.utime('mit.txt', (0, 0))
+        Builder("key.yaml", incremental=True).run()
+        self.assertEqual(0, os.path.getmtime('mit.txt'))
+    
+
+class BatchBuildTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.batch_testdir = "build-tests/batch"
+        self.out_dir = "batch-out"
+        self.mit_standard_text = FileReader("standards/mit-license.txt").read()
+        os.chdir(self.batch_testdir)
+        
+    def tearDown(self):
+        if dir_exists(self.out_dir):
+            shutil.rmtree(self.out_dir)
+        os.chdir(self.cwd)
+    
+    # key files from a directory write to a directory named with the key file
+    def test_batch_build_key_directory(self):
+        BatchBuilder(["keys"], output_dir=self.out_dir, processes=2).run()
+        self.assertEqual(["acme", "beta"], sorted(os.listdir(self.out_dir)))
+        self.assertTrue(u"Copyright (c) 2020 acme" in FileReader(make_path(self.out_dir, "acme", "mit.txt")).read())
+        self.assertTrue(u"Copyright (c) 2020 beta" in FileReader(make_path(self.out_dir, "beta", "mit.txt")).read())
+    
+    # key records use the templates and default key values in the template key file
+    def test_batch_build_key_records(self):
+        BatchBuilder(["records.jsonl", "records.csv"], template_key_path="key.yaml", output_dir=self.out_dir, processes=1).run()
+        self.assertEqual(["key-2", "one", "three"], sorted(os.listdir(self.out_dir)))
+        self.assertEqual(self.mit_standard_text.replace(u"Chris Simpkins", u"Tenant One"), FileReader(make_path(self.out_dir, "one", "mit.txt")).read())
+        self.assertTrue(u"Copyright (c) 1999 Tenant Two" in FileReader(make_path(self.out_dir, "key-2", "mit.txt")).read())
+        self.assertTrue(u"Copyright (c) 2015 Tenant Three" in FileReader(make_path(self.out_dir, "three", "mit.txt")).read())
+        self.assertTrue(file_exists(make_path(self.out_dir, "three", "mit-verbatim")))
+    
+    # keys with the same name would write to the same output directory
+    def test_batch_build_duplicate_key_names(self):
+        with self.assertRaises(SystemExit):
+            BatchBuilder(["records.jsonl", "records.jsonl"], output_dir=self.out_dir).run()
+        self.assertFalse(dir_exists(self.out_dir))
+
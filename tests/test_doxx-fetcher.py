@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from Naked.toolshed.python import is_py2
+from Naked.toolshed.system import file_exists
+import doxx.utilities.fetcher
+from doxx.utilities.fetcher import fetch_all, fetch_binary_file, fetch_text, fetch_text_file, open_stream, FetchError
+from doxx.commands.pull import pull_targz_archive
+from doxx.utilities.profiler import disable_profile, enable_profile, get_profile_spans
+
+if is_py2():
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import TCPServer, ThreadingMixIn
+else:
+    from http.server import SimpleHTTPRequestHandler
+    from socketserver import TCPServer, ThreadingMixIn
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive connections
+
+    def send_response(self, code, message=None):
+        self.server.status_codes.append(code)
+        SimpleHTTPRequestHandler.send_response(self, code, message)
+
+    def translate_path(self, path):
+        return os.path.join(self.server.serve_dir, os.path.basename(path.split('?')[0]))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalHTTPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class DoxxFetcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.serve_dir = tempfile.mkdtemp()
+        self.write_dir = tempfile.mkdtemp()
+        for x in range(20):
+            with open(os.path.join(self.serve_dir, "file" + str(x) + ".txt"), "wb") as f:
+                f.write(b"file " + str(x).encode('ascii') + b"\n")
+        self.server = LocalHTTPServer(("127.0.0.1", 0), QuietHTTPRequestHandler)
+        self.server.serve_dir = self.serve_dir
+        self.server.status_codes = []
+        self.cache_dir = tempfile.mkdtemp()
+        doxx.utilities.fetcher.HTTP_CACHE_DIR = self.cache_dir
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.base_url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/"
+        os.chdir(self.write_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.serve_dir)
+        shutil.rmtree(self.write_dir)
+        shutil.rmtree(self.cache_dir)
+        doxx.utilities.fetcher.HTTP_CACHE_DIR = None
+        if "DOXX_OFFLINE" in os.environ:
+            del os.environ["DOXX_OFFLINE"]
+
+    def test_fetch_text(self):
+        self.assertEqual(u"file 1\n", fetch_text(self.base_url + "file1.txt"))
+
+    # responses without a charset are decoded as utf-8 when requests has no encoding detector (requests.compat.chardet is None)
+    def test_fetch_text_without_chardet(self):
+        saved_chardet = doxx.utilities.fetcher.chardet
+        doxx.utilities.fetcher.chardet = None
+        try:
+            with open(os.path.join(self.serve_dir, "template.doxt"), "wb") as f:
+                f.write(u"Copyright \u00a9 2015\n".encode('utf-8'))  # application/octet-stream response
+            self.assertEqual(u"Copyright \u00a9 2015\n", fetch_text(self.base_url + "template.doxt"))
+        finally:
+            doxx.utilities.fetcher.chardet = saved_chardet
+
+    # --profile records a fetch span for each URL in the fetch threads
+    def test_fetch_profile_spans(self):
+        enable_profile()
+        try:
+            url_dict = dict(("file" + str(x) + ".txt", self.base_url + "file" + str(x) + ".txt") for x in range(10))
+            list(fetch_all(fetch_binary_file, url_dict))
+            spans = get_profile_spans()
+        finally:
+            disable_profile()
+        self.assertEqual(sorted(url_dict.values()), sorted(span[1] for span in spans))
+        self.assertEqual(set(["fetch"]), set(span[0] for span in spans))
+        self.assertTrue(len(set(span[5] for span in spans)) > 1)  # thread ids
+
+    def test_fetch_text_file_makes_dirs(self):
+        fetch_text_file(self.base_url + "file2.txt", os.path.join("sub", "file2.txt"))
+        self.assertTrue(file_exists(os.path.join("sub", "file2.txt")))
+
+    def test_fetch_binary_file(self):
+        self.assertEqual("file3.txt", fetch_binary_file(self.base_url + "file3.txt", "file3.txt"))
+        with open("file3.txt", "rb") as f:
+            self.assertEqual(b"file 3\n", f.read())
+
+    # HTTP error status codes raise FetchError and do not leave a file
+    def test_fetch_binary_file_404(self):
+        with self.assertRaises(FetchError) as cm:
+            fetch_binary_file(self.base_url + "nonexistent.txt", "nonexistent.txt")
+        self.assertEqual(404, cm.exception.status_code)
+        self.assertEqual([], os.listdir("."))
+
+    # concurrent pulls return a result for every file, failed pulls include an error message
+    def test_fetch_all(self):
+        url_dict = {}
+        for x in range(20):
+            url_dict[os.path.join("out", "file" + str(x) + ".txt")] = self.base_url + "file" + str(x) + ".txt"
+        url_dict["bad.txt"] = self.base_url + "nonexistent.txt"
+        results = list(fetch_all(fetch_binary_file, url_dict, concurrency=4))
+        self.assertEqual(21, len(results))
+        errors = [result for result in results if result[3] is not None]
+        self.assertEqual(1, len(errors))
+        self.assertEqual("bad.txt", errors[0][0])
+        self.assertEqual(20, len(os.listdir("out")))
+        with open(os.path.join("out", "file7.txt"), "rb") as f:
+            self.assertEqual(b"file 7\n", f.read())
+
+    # cached bodies are revalidated with a conditional GET, the 304 response is served from the cache
+    def test_fetch_conditional_get(self):
+        self.assertEqual(u"file 4\n", fetch_text(self.base_url + "file4.txt"))
+        fetch_binary_file(self.base_url + "file4.txt", "file4.txt")
+        self.assertEqual([200, 304], self.server.status_codes)
+        with open("file4.txt", "rb") as f:
+            self.assertEqual(b"file 4\n", f.read())
+
+    # changed remote files are downloaded again
+    def test_fetch_modified_file(self):
+        fetch_text(self.base_url + "file5.txt")
+        remote_path = os.path.join(self.serve_dir, "file5.txt")
+        with open(remote_path, "wb") as f:
+            f.write(b"changed\n")
+        os.utime(remote_path, (os.path.getatime(remote_path), os.path.getmtime(remote_path) + 10))
+        self.assertEqual(u"changed\n", fetch_text(self.base_url + "file5.txt"))
+        self.assertEqual([200, 200], self.server.status_codes)
+
+    # offline mode uses the cached body without a request
+    def test_fetch_offline_mode(self):
+        fetch_text(self.base_url + "file6.txt")
+        os.environ["DOXX_OFFLINE"] = "1"
+        self.assertEqual(u"file 6\n", fetch_text(self.base_url + "file6.txt"))
+        self.assertEqual([200], self.server.status_codes)
+
+    # the stream returns the body in the requested read sizes
+    def test_open_stream(self):
+        with open(os.path.join(self.serve_dir, "large.bin"), "wb") as f:
+            f.write(os.urandom(1000000))
+        stream = open_stream(self.base_url + "large.bin")
+        data = []
+        chunk = stream.read(10240)
+        while chunk:
+            self.assertTrue(len(chunk) <= 10240)
+            data.append(chunk)
+            chunk = stream.read(10240)
+        stream.close()
+        with open(os.path.join(self.serve_dir, "large.bin"), "rb") as f:
+            self.assertEqual(f.read(), b"".join(data))
+
+    # tar.gz archives are unpacked from the response stream without an archive file on disk
+    def test_pull_targz_archive(self):
+        os.makedirs(os.path.join(self.write_dir, "project", "templates"))
+        for file_path in (os.path.join("project", "key.yaml"), os.path.join("project", "templates", "index.doxt")):
+            with open(os.path.join(self.write_dir, file_path), "wb") as f:
+                f.write(b"test " + file_path.encode('utf-8'))
+        tar = tarfile.open(os.path.join(self.serve_dir, "project.tar.gz"), "w:gz")
+        tar.add("project")
+        tar.close()
+        shutil.rmtree("project")
+        self.assertEqual("project", pull_targz_archive(self.base_url + "project.tar.gz"))
+        self.assertEqual(["project"], os.listdir("."))
+        with open(os.path.join("project", "templates", "index.doxt"), "rb") as f:
+            self.assertEqual(b"test " + os.path.join("project", "templates", "index.doxt").encode('utf-8'), f.read())
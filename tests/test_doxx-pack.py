@@ -1,14 +1,25 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import io
 import os
 import sys
+import gzip
+import shutil
+import tarfile
+import tempfile
 import unittest
+import zipfile
+import zlib
 
 from Naked.toolshed.system import file_exists
 
-from doxx.commands.pack import tar_gzip_package_directory, zip_package_directory
-from doxx.commands.unpack import unpack_run, remove_compressed_archive_file
+import doxx.commands.pack
+import doxx.commands.unpack
+from doxx.commands.pack import tar_gzip_package_directory, tar_package_directory, zip_package_directory, get_pack_level, ParallelGzipWriter
+from doxx.commands.pack import incremental_pack_directory, PACK_DELTA_FILE_NAME
+from doxx.commands.unpack import unpack_run, remove_compressed_archive_file, unpack_targz_stream_members, extract_tar_members, DoxxArchive, get_archive_format
+from doxx.datatypes.cache import DoxxPackStore
 
 class DoxxPackTests(unittest.TestCase):
 
@@ -125,4 +136,399 @@ class DoxxPackTests(unittest.TestCase):
             os.chdir(self.cwd)
         except Exception as e:
             os.chdir(self.cwd)
-            raise e        
\ No newline at end of file
+            raise e        
+
+
+class DoxxParallelPackTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+        self.saved_block_size = doxx.commands.pack.PACK_BLOCK_SIZE
+        self.saved_min_members = doxx.commands.unpack.UNPACK_PARALLEL_MIN_MEMBERS
+        doxx.commands.pack.PACK_BLOCK_SIZE = 4096  # many blocks for the small test project
+        doxx.commands.unpack.UNPACK_PARALLEL_MIN_MEMBERS = 1
+        self.files = {}
+        os.makedirs(os.path.join("project", "sub"))
+        for x in range(20):
+            file_path = os.path.join("project", "sub" if x % 2 else "", "file" + str(x) + ".txt")
+            self.files[os.path.normpath(file_path)] = (u"line " + str(x) + u" of the test project file\n").encode('utf-8') * (50 * x + 1)
+        self.files[os.path.join("project", "random.bin")] = os.urandom(20000)
+        for file_path in self.files:
+            with open(file_path, 'wb') as f:
+                f.write(self.files[file_path])
+
+    def tearDown(self):
+        doxx.commands.pack.PACK_BLOCK_SIZE = self.saved_block_size
+        doxx.commands.unpack.UNPACK_PARALLEL_MIN_MEMBERS = self.saved_min_members
+        os.chdir(self.cwd)
+        shutil.rmtree(self.test_dir)
+
+    def test_doxx_parallel_gzip_writer(self):
+        data = b"".join(self.files[file_path] for file_path in sorted(self.files))
+        for processes in (1, 4):
+            writer = ParallelGzipWriter(open("test.gz", 'wb'), processes=processes, block_size=4096)
+            for x in range(0, len(data), 1000):
+                writer.write(data[x:x + 1000])
+            writer.close()
+            with gzip.open("test.gz", 'rb') as f:
+                self.assertEqual(data, f.read())
+
+    # the blocks are one gzip member, tar.gz pulls read the archive with the tarfile stream mode
+    def test_doxx_parallel_targz_pack_stream_read(self):
+        tar_gzip_package_directory("packed", "project", processes=4)
+        tar = tarfile.open("packed.tar.gz", "r|gz")
+        unpacked_files = {}
+        for tarinfo in tar:
+            if tarinfo.isfile():
+                unpacked_files[os.path.normpath(os.path.join("project", tarinfo.name))] = tar.extractfile(tarinfo).read()
+        tar.close()
+        self.assertEqual(self.files, unpacked_files)
+
+    def test_doxx_parallel_zip_pack(self):
+        zip_package_directory("packed", "project", processes=4)
+        zipper = zipfile.ZipFile("packed.zip")
+        self.assertEqual(None, zipper.testzip())
+        unpacked_files = dict((os.path.normpath(os.path.join("project", name)), zipper.read(name)) for name in zipper.namelist())
+        self.assertEqual(self.files, unpacked_files)
+        self.assertEqual(zipfile.ZIP_STORED, zipper.getinfo("random.bin").compress_type)  # does not compress
+        self.assertEqual(zipfile.ZIP_DEFLATED, zipper.getinfo("file4.txt").compress_type)
+        zipper.close()
+
+    # large members are compressed with a streamed write, sizes and offsets over the zip64 limit are written in the zip64 records
+    def test_doxx_parallel_zip_pack_streamed_zip64(self):
+        saved_memory_limit = doxx.commands.pack.PACK_ZIP_MEMORY_LIMIT
+        saved_zip64_limit = doxx.commands.pack.PACK_ZIP64_LIMIT
+        doxx.commands.pack.PACK_ZIP_MEMORY_LIMIT = 1000
+        doxx.commands.pack.PACK_ZIP64_LIMIT = 2000
+        non_ascii_path = os.path.join("project", u"caf\u00e9.txt")
+        self.files[non_ascii_path] = b"non ascii member name\n"
+        with open(non_ascii_path, 'wb') as f:
+            f.write(self.files[non_ascii_path])
+        try:
+            for processes in (1, 4):
+                zip_package_directory("packed", "project", processes=processes)
+                zipper = zipfile.ZipFile("packed.zip")
+                self.assertEqual(None, zipper.testzip())
+                unpacked_files = dict((os.path.normpath(os.path.join("project", name)), zipper.read(name)) for name in zipper.namelist())
+                self.assertEqual(self.files, unpacked_files)
+                self.assertEqual(zipfile.ZIP_DEFLATED, zipper.getinfo("random.bin").compress_type)  # streamed write
+                zipper.close()
+        finally:
+            doxx.commands.pack.PACK_ZIP_MEMORY_LIMIT = saved_memory_limit
+            doxx.commands.pack.PACK_ZIP64_LIMIT = saved_zip64_limit
+
+    def get_unpacked_files(self, unpack_dir):
+        unpacked_files = {}
+        for root, dirs, files in os.walk(unpack_dir):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                with open(file_path, 'rb') as f:
+                    unpacked_files[os.path.join("project", os.path.relpath(file_path, unpack_dir))] = f.read()
+        return unpacked_files
+
+    def test_doxx_parallel_targz_unpack(self):
+        os.chmod(os.path.join("project", "file2.txt"), 0o600)
+        tar_gzip_package_directory("packed", "project", processes=4)
+        os.mkdir("unpacked")
+        os.chdir("unpacked")
+        self.assertEqual(".", unpack_run(os.path.join("..", "packed.tar.gz"), processes=4))
+        os.chdir(self.test_dir)
+        self.assertEqual(self.files, self.get_unpacked_files("unpacked"))
+        self.assertEqual(0o600, os.stat(os.path.join("unpacked", "file2.txt")).st_mode & 0o777)  # archive member modes
+
+    # an archive path that is written twice keeps the data of the last member
+    def test_doxx_parallel_targz_unpack_duplicate_member(self):
+        tar = tarfile.open("duplicate.tar.gz", "w:gz")
+        for data in (b"first", b"second"):
+            with open("data.txt", 'wb') as f:
+                f.write(data)
+            tar.add("data.txt", arcname="./data.txt" if data == b"first" else "data.txt")
+        tar.close()
+        os.mkdir("unpacked")
+        os.chdir("unpacked")
+        unpack_run(os.path.join("..", "duplicate.tar.gz"), processes=4)
+        with open("data.txt", 'rb') as f:
+            self.assertEqual(b"second", f.read())
+
+    def make_link_archive(self, link_name, link_target, file_name):
+        tar = tarfile.open("links.tar", "w")
+        link_info = tarfile.TarInfo(link_name)
+        link_info.type = tarfile.SYMTYPE
+        link_info.linkname = link_target
+        tar.addfile(link_info)
+        file_info = tarfile.TarInfo(file_name)
+        file_info.size = 6
+        tar.addfile(file_info, io.BytesIO(b"inside"))
+        tar.close()
+
+    # the write threads do not follow a symbolic link member to a directory outside of the unpack directory
+    def test_doxx_parallel_tar_unpack_link_directory(self):
+        os.mkdir("outside")
+        self.make_link_archive("a", os.path.join(self.test_dir, "outside"), "a/x.txt")
+        os.mkdir("unpacked")
+        os.chdir("unpacked")
+        tar = tarfile.open(os.path.join("..", "links.tar"))
+        self.assertRaises((ValueError, tarfile.TarError), extract_tar_members, tar, processes=4)
+        tar.close()
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "outside", "x.txt")))
+
+    # a file member replaces a symbolic link member with the same path, the link target is not written
+    def test_doxx_parallel_tar_unpack_link_file(self):
+        with open("target.txt", 'wb') as f:
+            f.write(b"target")
+        self.make_link_archive("link.txt", os.path.join(self.test_dir, "target.txt"), "link.txt")
+        os.mkdir("unpacked")
+        os.chdir("unpacked")
+        tar = tarfile.open(os.path.join("..", "links.tar"))
+        extract_tar_members(tar, processes=4)
+        tar.close()
+        self.assertFalse(os.path.islink("link.txt"))
+        with open("link.txt", 'rb') as f:
+            self.assertEqual(b"inside", f.read())
+        with open(os.path.join(self.test_dir, "target.txt"), 'rb') as f:
+            self.assertEqual(b"target", f.read())
+
+    def test_doxx_parallel_targz_stream_members(self):
+        tar_gzip_package_directory("packed", "project", processes=4)
+        os.mkdir("unpacked")
+        os.chdir("unpacked")
+        with open(os.path.join("..", "packed.tar.gz"), 'rb') as f:
+            unpack_targz_stream_members(f, lambda tarinfo: os.path.basename(tarinfo.name) if tarinfo.name.startswith("./sub/") else None)
+        self.assertEqual(sorted("file" + str(x) + ".txt" for x in range(1, 20, 2)), sorted(os.listdir(".")))
+
+    def test_doxx_parallel_zip_unpack(self):
+        zip_package_directory("packed", "project", processes=4)
+        os.mkdir("unpacked")
+        os.chdir("unpacked")
+        unpack_run(os.path.join("..", "packed.zip"), processes=2)
+        os.chdir(self.test_dir)
+        self.assertEqual(self.files, self.get_unpacked_files("unpacked"))
+
+
+class _SequentialStream(object):
+    """file object without seek and tell (e.g. a HTTP response stream)"""
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.data.read(min(size, 100) if size > 0 else size)  # short reads
+
+
+class DoxxArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+        os.makedirs(os.path.join("project", "sub"))
+        for file_path in (os.path.join("project", "key.yaml"), os.path.join("project", "sub", "test.doxt")):
+            with open(file_path, 'wb') as f:
+                f.write(b"test file " + file_path.encode('utf-8'))
+        for compression in ("gz", "bz2", "xz", ""):
+            tar = tarfile.open("project.tar" + ("." + compression if compression else ""), "w:" + compression)
+            tar.add("project")
+            tar.close()
+        zip_package_directory("project", "project")
+        os.mkdir("unpacked")
+        os.chdir("unpacked")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.test_dir)
+
+    def read_archive(self, file_name):
+        with open(os.path.join(self.test_dir, file_name), 'rb') as f:
+            return f.read()
+
+    def test_doxx_archive_format(self):
+        self.assertEqual(("tar", "gz"), get_archive_format(self.read_archive("project.tar.gz")))
+        self.assertEqual(("tar", "bz2"), get_archive_format(self.read_archive("project.tar.bz2")))
+        self.assertEqual(("tar", "xz"), get_archive_format(self.read_archive("project.tar.xz")))
+        self.assertEqual(("tar", ""), get_archive_format(self.read_archive("project.tar")))
+        self.assertEqual(("zip", None), get_archive_format(self.read_archive("project.zip")))
+        self.assertEqual(None, get_archive_format(b"---\ntemplate: test.doxt\n---\n"))
+
+    def test_doxx_archive_unpack_run_bz2(self):
+        self.assertEqual("project", unpack_run(os.path.join("..", "project.tar.bz2")))
+        self.assertTrue(file_exists(os.path.join("project", "sub", "test.doxt")))
+
+    def test_doxx_archive_sequential_stream_tar(self):
+        archive = DoxxArchive(fileobj=_SequentialStream(self.read_archive("project.tar.xz")))
+        self.assertTrue(archive.open())
+        self.assertEqual(("tar", "xz", False), (archive.archive_type, archive.compression, archive.seekable))
+        self.assertEqual("project", archive.extract())
+        self.assertTrue(file_exists(os.path.join("project", "key.yaml")))
+
+    # zip archives are spooled to a temporary file
+    def test_doxx_archive_sequential_stream_zip(self):
+        archive = DoxxArchive(fileobj=_SequentialStream(self.read_archive("project.zip")))
+        self.assertTrue(archive.open())
+        self.assertEqual("zip", archive.archive_type)
+        archive.extract()
+        archive.close()
+        self.assertTrue(file_exists("key.yaml"))
+        self.assertTrue(file_exists(os.path.join("sub", "test.doxt")))
+
+    def test_doxx_archive_unsupported_format(self):
+        with open("key.yaml", 'w') as f:
+            f.write("---\ntemplate: test.doxt\n---\n")
+        archive = DoxxArchive("key.yaml")
+        self.assertFalse(archive.open())
+        archive.close()
+
+    def test_doxx_archive_pack_codecs(self):
+        os.chdir(self.test_dir)
+        for codec, file_name, archive_format in (("gzip", "codec.tar.gz", ("tar", "gz")), ("bz2", "codec.tar.bz2", ("tar", "bz2")),
+                                                 ("xz", "codec.tar.xz", ("tar", "xz")), ("stored", "codec.tar", ("tar", ""))):
+            self.assertEqual(file_name, tar_package_directory("codec", "project", codec=codec, level=get_pack_level(codec, fast=True)))
+            self.assertEqual(archive_format, get_archive_format(self.read_archive(file_name)))
+            unpack_dir = tempfile.mkdtemp(dir=self.test_dir)
+            os.chdir(unpack_dir)
+            self.assertEqual(".", unpack_run(os.path.join(self.test_dir, file_name)))
+            self.assertTrue(file_exists(os.path.join("sub", "test.doxt")))
+            os.chdir(self.test_dir)
+
+    def test_doxx_archive_pack_zip_stored(self):
+        os.chdir(self.test_dir)
+        zip_package_directory("stored", "project", codec="stored")
+        zipper = zipfile.ZipFile("stored.zip")
+        self.assertEqual([zipfile.ZIP_STORED], list(set(zipinfo.compress_type for zipinfo in zipper.infolist())))
+        zipper.close()
+
+    def test_doxx_archive_pack_level(self):
+        self.assertEqual(9, get_pack_level("gzip"))
+        self.assertEqual(1, get_pack_level("gzip", fast=True))
+        self.assertEqual(0, get_pack_level("xz", fast=True))
+        self.assertEqual(4, get_pack_level("bz2", 4, fast=True))
+        self.assertEqual(None, get_pack_level("stored"))
+        self.assertEqual(-1, get_pack_level("gzip", -1, zip_archive=True))  # zlib.Z_DEFAULT_COMPRESSION
+        self.assertRaises(ValueError, get_pack_level, "gzip", 10)
+        self.assertRaises(ValueError, get_pack_level, "xz", zip_archive=True)
+        self.assertRaises(ValueError, get_pack_level, "zstd")
+
+
+class DoxxIncrementalPackTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+        self.pack_store = DoxxPackStore(cache_dir=os.path.join(self.test_dir, "store"))
+        self.files = {}
+        os.makedirs(os.path.join("project", "sub"))
+        os.makedirs(os.path.join("project", "old"))
+        for x in range(10):
+            self.write_file(os.path.join("sub" if x % 2 else "", "file" + str(x) + ".txt"), (u"line " + str(x) + u" of the test file\n").encode('utf-8') * (100 * x))
+        self.write_file(os.path.join("old", "removed.txt"), b"removed in the delta")
+        self.write_file("random.bin", os.urandom(20000))
+        self.saved_make_pack_object = doxx.commands.pack._make_pack_object
+        self.compressed_files = []
+        def make_pack_object(file_path, level, pack_store):
+            self.compressed_files.append(file_path)
+            return self.saved_make_pack_object(file_path, level, pack_store)
+        doxx.commands.pack._make_pack_object = make_pack_object
+
+    def tearDown(self):
+        doxx.commands.pack._make_pack_object = self.saved_make_pack_object
+        os.chdir(self.cwd)
+        shutil.rmtree(self.test_dir)
+
+    def write_file(self, file_path, data):
+        with open(os.path.join(self.test_dir, "project", file_path), 'wb') as f:
+            f.write(data)
+        self.files[os.path.normpath(file_path)] = data
+
+    def get_unpacked_files(self, unpack_dir):
+        unpacked_files = {}
+        for root, dirs, files in os.walk(unpack_dir):
+            for file_name in files:
+                with open(os.path.join(root, file_name), 'rb') as f:
+                    unpacked_files[os.path.relpath(os.path.join(root, file_name), unpack_dir)] = f.read()
+        return unpacked_files
+
+    def unpack(self, file_name, unpack_dir, delta=False):
+        if not os.path.isdir(unpack_dir):
+            os.mkdir(unpack_dir)
+        os.chdir(unpack_dir)
+        unpack_run(os.path.join(self.test_dir, file_name), delta=delta)
+        os.chdir(self.test_dir)
+
+    def test_doxx_incremental_pack_targz(self):
+        self.assertEqual("project.tar.gz", incremental_pack_directory("project", "project", pack_store=self.pack_store))
+        self.assertEqual(12, len(self.compressed_files))
+        with gzip.open("project.tar.gz", 'rb') as f:
+            first_archive_data = f.read()
+        self.unpack("project.tar.gz", "unpacked1")
+        self.assertEqual(self.files, self.get_unpacked_files("unpacked1"))
+        # unchanged files are copied from the pack store
+        self.compressed_files = []
+        self.write_file("file3.txt", b"changed")
+        incremental_pack_directory("project", "project", pack_store=self.pack_store)
+        self.assertEqual([os.path.join(".", "file3.txt").replace(os.sep, "/")], self.compressed_files)
+        self.unpack("project.tar.gz", "unpacked2")
+        self.assertEqual(self.files, self.get_unpacked_files("unpacked2"))
+        with gzip.open("project.tar.gz", 'rb') as f:
+            self.assertNotEqual(first_archive_data, f.read())
+
+    # the stored deflate streams are spliced into one gzip member, tar.gz pulls read the archive with the tarfile stream mode
+    def test_doxx_incremental_pack_targz_stream_read(self):
+        incremental_pack_directory("project", "project", pack_store=self.pack_store)
+        incremental_pack_directory("project", "project", pack_store=self.pack_store)
+        tar = tarfile.open("project.tar.gz", "r|gz")
+        unpacked_files = {}
+        for tarinfo in tar:
+            if tarinfo.isfile():
+                unpacked_files[os.path.normpath(tarinfo.name)] = tar.extractfile(tarinfo).read()
+        tar.close()
+        self.assertEqual(self.files, unpacked_files)
+
+    def test_doxx_incremental_pack_zip(self):
+        incremental_pack_directory("project", "project", zip_archive=True, pack_store=self.pack_store)
+        self.compressed_files = []
+        self.assertEqual("project.zip", incremental_pack_directory("project", "project", zip_archive=True, pack_store=self.pack_store))
+        self.assertEqual([], self.compressed_files)
+        zipper = zipfile.ZipFile("project.zip")
+        self.assertEqual(None, zipper.testzip())
+        self.assertEqual(self.files, dict((os.path.normpath(name), zipper.read(name)) for name in zipper.namelist()))
+        zipper.close()
+
+    def test_doxx_incremental_pack_delta(self):
+        incremental_pack_directory("project", "project", pack_store=self.pack_store)
+        self.unpack("project.tar.gz", "unpacked")
+        self.write_file("file4.txt", b"changed")
+        self.write_file(os.path.join("sub", "added.txt"), b"added")
+        os.remove(os.path.join("project", "old", "removed.txt"))
+        os.rmdir(os.path.join("project", "old"))
+        del self.files[os.path.join("old", "removed.txt")]
+        self.assertEqual("project.delta.tar.gz", incremental_pack_directory("project", "project", delta=True, pack_store=self.pack_store))
+        tar = tarfile.open("project.delta.tar.gz", "r:gz")
+        self.assertEqual([".", "./" + PACK_DELTA_FILE_NAME, "./file4.txt", "./sub/added.txt"], tar.getnames())
+        tar.close()
+        self.unpack("project.delta.tar.gz", "unpacked", delta=True)
+        self.assertEqual(self.files, self.get_unpacked_files("unpacked"))
+        self.assertFalse(os.path.isdir(os.path.join("unpacked", "old")))
+
+    # the removed files of a delta archive are kept without the --delta unpack option
+    def test_doxx_incremental_pack_delta_requires_option(self):
+        incremental_pack_directory("project", "project", pack_store=self.pack_store)
+        self.unpack("project.tar.gz", "unpacked")
+        os.remove(os.path.join("project", "old", "removed.txt"))
+        incremental_pack_directory("project", "project", delta=True, pack_store=self.pack_store)
+        self.unpack("project.delta.tar.gz", "unpacked")
+        self.assertTrue(os.path.isfile(os.path.join("unpacked", "old", "removed.txt")))
+        self.assertTrue(os.path.isfile(os.path.join("unpacked", PACK_DELTA_FILE_NAME)))
+
+    def test_doxx_incremental_pack_pruned_store(self):
+        incremental_pack_directory("project", "project", pack_store=self.pack_store)
+        shutil.rmtree(os.path.join(self.test_dir, "store", "objects"))
+        incremental_pack_directory("project", "project", pack_store=self.pack_store)
+        self.unpack("project.tar.gz", "unpacked")
+        self.assertEqual(self.files, self.get_unpacked_files("unpacked"))
+
+    def test_doxx_incremental_pack_crc_combine(self):
+        first_data = os.urandom(5000)
+        second_data = os.urandom(3000000)
+        self.assertEqual(zlib.crc32(first_data + second_data) & 0xffffffff,
+                         doxx.commands.pack._crc32_combine(zlib.crc32(first_data) & 0xffffffff, zlib.crc32(second_data) & 0xffffffff, len(second_data)))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from Naked.toolshed.system import file_exists
+from doxx.commands.build import Builder
+from doxx.utilities.profiler import disable_profile, enable_profile, format_profile_report, get_profile_spans, timed_phase, write_profile_json, write_trace_json
+
+
+class DoxxProfileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir("build-tests/incremental")
+
+    def tearDown(self):
+        disable_profile()
+        for test_file in ('mit.txt', 'mit-verbatim'):
+            if file_exists(test_file):
+                os.remove(test_file)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.test_dir)
+
+    def get_phases(self, subject):
+        return sorted(set(span[0] for span in get_profile_spans() if span[1] == subject))
+
+    # spans are not recorded unless the profile is enabled
+    def test_profile_disabled(self):
+        with timed_phase("render", "test.doxt"):
+            pass
+        self.assertEqual([], get_profile_spans())
+
+    # single template build phases
+    def test_profile_single_template_build(self):
+        enable_profile()
+        Builder("key.yaml").run()
+        self.assertEqual(["key"], self.get_phases("key.yaml"))
+        self.assertEqual(["load", "mkdir", "parse", "render", "write"], self.get_phases("../../templates/mit.doxt"))
+
+    # the spans from the build worker processes are returned to the parent process
+    def test_profile_multi_template_build(self):
+        enable_profile()
+        Builder("multi-key.yaml", processes=2).run()
+        self.assertEqual(["load", "mkdir", "parse", "render", "write"], self.get_phases("../../templates/mit.doxt"))
+        self.assertEqual(["load", "mkdir", "parse", "write"], self.get_phases("../../templates/mit-verbatim.doxt"))
+        self.assertTrue(len(set(span[4] for span in get_profile_spans())) > 1)  # parent and worker process ids
+
+    # the report sorts the phases by total time
+    def test_profile_report(self):
+        enable_profile()
+        Builder("key.yaml").run()
+        report_lines = format_profile_report().splitlines()
+        self.assertTrue(report_lines[0].startswith("[*] doxx: Build profile:"))
+        self.assertEqual(6, len([line for line in report_lines[2:8] if line.split()[0] in ("key", "load", "parse", "render", "mkdir", "write")]))
+        self.assertTrue("../../templates/mit.doxt (" in format_profile_report())
+
+    def test_profile_json(self):
+        enable_profile()
+        Builder("key.yaml").run()
+        json_path = os.path.join(self.test_dir, "profile.json")
+        write_profile_json(json_path)
+        with open(json_path) as f:
+            profile_data = json.load(f)
+        self.assertEqual(1, profile_data['phases']['render']['count'])
+        self.assertTrue('write' in profile_data['subjects']['../../templates/mit.doxt'])
+        self.assertEqual(len(get_profile_spans()), len(profile_data['spans']))
+
+    # Chrome trace events: one named track per build process, one complete event per span
+    def test_profile_trace_json(self):
+        enable_profile()
+        Builder("multi-key.yaml", processes=2).run()
+        trace_path = os.path.join(self.test_dir, "trace.json")
+        write_trace_json(trace_path)
+        with open(trace_path) as f:
+            trace_events = json.load(f)['traceEvents']
+        span_events = [event for event in trace_events if event['ph'] == 'X']
+        process_names = dict((event['pid'], event['args']['name']) for event in trace_events if event['ph'] == 'M' and event['name'] == 'process_name')
+        self.assertEqual(len(get_profile_spans()), len(span_events))
+        self.assertEqual(set(event['pid'] for event in span_events), set(process_names))
+        self.assertTrue(process_names[os.getpid()].startswith("doxx build ("))
+        self.assertTrue(len([name for name in process_names.values() if name.startswith("doxx build worker")]) >= 1)
+        self.assertTrue("render ../../templates/mit.doxt" in [event['name'] for event in span_events])
+        self.assertTrue(min(event['ts'] for event in span_events) >= 0)
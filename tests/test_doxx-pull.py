@@ -5,12 +5,31 @@ import sys
 import os
 import unittest
 import shutil
+import io
+import json
+import hashlib
+import tarfile
+import tempfile
+import threading
 
+from Naked.toolshed.python import is_py2
 from Naked.toolshed.system import file_exists, dir_exists
 from Naked.toolshed.file import FileReader
 
-from doxx.commands.pull import get_file_name, is_gzip_file, is_url, is_tar_gz_archive, is_zip_archive, run_pull
+import doxx.utilities.fetcher
+from doxx.commands.pack import tar_gzip_package_directory, write_package_manifest
+from doxx.commands.pull import get_file_name, is_gzip_file, is_url, is_tar_gz_archive, is_tar_archive, is_zip_archive, run_pull, GithubCherryPick
+from doxx.commands.pull import pull_package_delta
+from doxx.commands.unpack import unpack_targz_stream_members
 from doxx.commands.pullkey import run_pullkey
+from doxx.utilities.fetcher import FetchError
+
+if is_py2():
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import TCPServer, ThreadingMixIn
+else:
+    from http.server import SimpleHTTPRequestHandler
+    from socketserver import TCPServer, ThreadingMixIn
 
 
 class DoxxPullTests(unittest.TestCase):
@@ -65,6 +84,14 @@ class DoxxPullTests(unittest.TestCase):
     def test_doxx_pull_targz_incorrect(self):
         self.assertFalse(is_tar_gz_archive('test.txt'))
         
+    def test_doxx_pull_tar_archive_correct(self):
+        for file_name in ('test.tar', 'test.tar.gz', 'test.TGZ', 'test.tar.bz2', 'test.tar.xz', 'test.txz'):
+            self.assertTrue(is_tar_archive(file_name))
+
+    def test_doxx_pull_tar_archive_incorrect(self):
+        self.assertFalse(is_tar_archive('test.gz'))
+        self.assertFalse(is_tar_archive('test.zip'))
+
     def test_doxx_pull_zip_correct(self):
         self.assertTrue(is_zip_archive('test.zip'))
         
@@ -416,5 +443,223 @@ class DoxxPullGithubRepoShortcodeTests(unittest.TestCase):
         except Exception as e:
             os.chdir(self.cwd)
             raise e
-        
-    
\ No newline at end of file
+
+
+class DoxxGithubCherryPickTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.write_dir = tempfile.mkdtemp()
+        # in memory repository archive with the Github archive layout (all files in a `repo-branch` root directory)
+        archive_bytes = io.BytesIO()
+        tar = tarfile.open(fileobj=archive_bytes, mode="w:gz")
+        for member_path in ("repo-master/README.md", "repo-master/docs/a/b/c/d/index.doxt", "repo-master/docs/a/b/c/d/key.yaml", "repo-master/src/big.txt"):
+            member_data = ("data " + member_path).encode('utf-8')
+            tarinfo = tarfile.TarInfo(member_path)
+            tarinfo.size = len(member_data)
+            tar.addfile(tarinfo, io.BytesIO(member_data))
+        tar.close()
+        self.archive_bytes = archive_bytes.getvalue()
+        os.chdir(self.write_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.write_dir)
+
+    def cherry_pick(self, keep_path):
+        cherry_pick = GithubCherryPick(keep_path)
+        unpack_targz_stream_members(io.BytesIO(self.archive_bytes), cherry_pick.get_local_path)
+        return cherry_pick
+
+    # directories are extracted at any depth, other members are not written
+    def test_cherry_pick_directory(self):
+        cherry_pick = self.cherry_pick("docs/a/b/c/d")
+        self.assertEqual(os.path.join("docs", "a", "b", "c", "d"), cherry_pick.local_path)
+        self.assertTrue(file_exists(os.path.join("docs", "a", "b", "c", "d", "index.doxt")))
+        self.assertTrue(file_exists(os.path.join("docs", "a", "b", "c", "d", "key.yaml")))
+        self.assertEqual(["docs"], os.listdir("."))
+
+    # existing directories are not overwritten
+    def test_cherry_pick_existing_directory(self):
+        self.cherry_pick("docs/a")
+        cherry_pick = self.cherry_pick("docs/a")
+        self.assertEqual(os.path.join("docs", "a-new"), cherry_pick.local_path)
+        self.assertTrue(file_exists(os.path.join("docs", "a-new", "b", "c", "d", "index.doxt")))
+
+    # files are written to the working directory
+    def test_cherry_pick_file(self):
+        cherry_pick = self.cherry_pick("docs/a/b/c/d/key.yaml")
+        self.assertEqual("key.yaml", cherry_pick.local_path)
+        fr = FileReader("key.yaml")
+        self.assertEqual(u"data repo-master/docs/a/b/c/d/key.yaml", fr.read())
+        self.assertEqual(["key.yaml"], os.listdir("."))
+        cherry_pick = self.cherry_pick("docs/a/b/c/d/key.yaml")
+        self.assertEqual("key-new.yaml", cherry_pick.local_path)
+
+    def test_cherry_pick_missing_path(self):
+        cherry_pick = self.cherry_pick("docs/missing")
+        self.assertEqual(None, cherry_pick.local_path)
+        self.assertEqual([], os.listdir("."))
+
+    def test_cherry_pick_parent_path(self):
+        with self.assertRaises(ValueError):
+            GithubCherryPick("../docs")
+
+
+class PackageHTTPRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive connections
+
+    def translate_path(self, path):
+        request_path = path.split('?')[0].lstrip('/')
+        self.server.request_paths.append(request_path)
+        return os.path.join(self.server.serve_dir, *request_path.split('/'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PackageHTTPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class DoxxPackageDeltaPullTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        self.serve_dir = os.path.join(self.test_dir, "release")
+        self.package_dir = os.path.join(self.test_dir, "package")
+        self.pull_dir = os.path.join(self.test_dir, "pull")
+        for dir_path in (self.serve_dir, os.path.join(self.package_dir, "templates"), self.pull_dir):
+            os.makedirs(dir_path)
+        self.write_package_file("pkey.yaml", u"---\ntemplate: templates/index.doxt\n---\ntitle: Test\n")
+        for x in range(5):
+            self.write_package_file(os.path.join("templates", "t" + str(x) + ".doxt"), u"template " + str(x) + u" {{title}}\n")
+        self.publish()
+        self.server = PackageHTTPServer(("127.0.0.1", 0), PackageHTTPRequestHandler)
+        self.server.serve_dir = self.serve_dir
+        self.server.request_paths = []
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.base_url = "http://127.0.0.1:" + str(self.server.server_address[1]) + "/"
+        os.chdir(self.pull_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.server.shutdown()
+        self.server.server_close()
+        doxx.utilities.fetcher.HTTP_CACHE_DIR = None
+        shutil.rmtree(self.test_dir)
+
+    def write_package_file(self, file_path, text):
+        with io.open(os.path.join(self.package_dir, file_path), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def publish(self, manifest=True):
+        """writes the package archive and the package manifest to the release directory of the server"""
+        os.chdir(self.serve_dir)
+        tar_gzip_package_directory("package", self.package_dir)
+        if manifest:
+            write_package_manifest("package", self.package_dir)
+        os.chdir(self.pull_dir)
+
+    def pull(self, manifest=True):
+        self.server.request_paths = []
+        doxx.utilities.fetcher.HTTP_CACHE_DIR = tempfile.mkdtemp(dir=self.test_dir)  # the release files are replaced within the Last-Modified resolution
+        return pull_package_delta("package", self.base_url + "package.tar.gz", self.base_url + "package.manifest.json" if manifest else None)
+
+    def read_file(self, file_path):
+        with io.open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def set_old_mtime(self, file_path):
+        os.utime(file_path, (1000000000, 1000000000))
+
+    def test_pull_package_delta_first_pull(self):
+        self.assertEqual(".", self.pull())
+        self.assertEqual(["package.tar.gz"], self.server.request_paths)  # the archive is downloaded for the first pull
+        self.assertEqual(u"template 3 {{title}}\n", self.read_file(os.path.join("templates", "t3.doxt")))
+        self.assertTrue(file_exists(".package.doxxpull"))
+        with open(".package.doxxpull") as f:
+            self.assertEqual(6, len(json.load(f)))
+
+    def test_pull_package_delta_manifest(self):
+        self.pull()
+        self.set_old_mtime(os.path.join("templates", "t1.doxt"))
+        self.write_package_file(os.path.join("templates", "t2.doxt"), u"changed template")
+        self.write_package_file(os.path.join("templates", "t5.doxt"), u"added template")
+        self.publish()
+        self.pull()
+        changed_object = "package-objects/" + hashlib.sha256(b"changed template").hexdigest()
+        added_object = "package-objects/" + hashlib.sha256(b"added template").hexdigest()
+        self.assertEqual(sorted(["package.manifest.json", added_object, changed_object]), sorted(self.server.request_paths))
+        self.assertEqual(u"changed template", self.read_file(os.path.join("templates", "t2.doxt")))
+        self.assertEqual(u"added template", self.read_file(os.path.join("templates", "t5.doxt")))
+        self.assertEqual(1000000000, int(os.path.getmtime(os.path.join("templates", "t1.doxt"))))  # unchanged files are not written
+
+    def test_pull_package_delta_archive(self):
+        self.pull(manifest=False)
+        self.set_old_mtime(os.path.join("templates", "t1.doxt"))
+        self.set_old_mtime(os.path.join("templates", "t2.doxt"))
+        self.write_package_file(os.path.join("templates", "t2.doxt"), u"changed template")
+        self.publish(manifest=False)
+        self.pull(manifest=False)
+        self.assertEqual(["package.tar.gz"], self.server.request_paths)
+        self.assertEqual(u"changed template", self.read_file(os.path.join("templates", "t2.doxt")))
+        self.assertEqual(1000000000, int(os.path.getmtime(os.path.join("templates", "t1.doxt"))))
+        self.assertNotEqual(1000000000, int(os.path.getmtime(os.path.join("templates", "t2.doxt"))))
+
+    # files that were removed from the package are reported and kept
+    def test_pull_package_delta_removed_files(self):
+        self.pull()
+        with io.open(os.path.join("templates", "t4.doxt"), 'w', encoding='utf-8') as f:
+            f.write(u"local changes")
+        os.remove(os.path.join(self.package_dir, "templates", "t3.doxt"))
+        os.remove(os.path.join(self.package_dir, "templates", "t4.doxt"))
+        self.publish()
+        saved_stdout = sys.stdout
+        sys.stdout = io.StringIO() if not is_py2() else io.BytesIO()
+        try:
+            self.pull()
+            pull_output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = saved_stdout
+        self.assertTrue(u"    " + os.path.join("templates", "t3.doxt") in pull_output)
+        self.assertTrue(u"    " + os.path.join("templates", "t4.doxt") in pull_output)
+        self.assertEqual(u"template 3 {{title}}\n", self.read_file(os.path.join("templates", "t3.doxt")))
+        self.assertEqual(u"local changes", self.read_file(os.path.join("templates", "t4.doxt")))
+
+    # links to paths outside of the package are not written, later members under the link path are written in the package
+    def test_pull_package_delta_archive_links(self):
+        outside_dir = os.path.join(self.test_dir, "outside")
+        os.mkdir(outside_dir)
+        tar = tarfile.open(os.path.join(self.serve_dir, "package.tar.gz"), "w:gz")
+        for link_name, link_target in (("./templates/latest.doxt", "t0.doxt"), ("./absolute", outside_dir), ("./parent", "../outside")):
+            link_info = tarfile.TarInfo(link_name)
+            link_info.type = tarfile.SYMTYPE
+            link_info.linkname = link_target
+            tar.addfile(link_info)
+        for file_name in ("./templates/t0.doxt", "./absolute/x.doxt", "./parent/y.doxt"):
+            file_info = tarfile.TarInfo(file_name)
+            file_info.size = 7
+            tar.addfile(file_info, io.BytesIO(b"package"))
+        tar.close()
+        self.pull(manifest=False)
+        self.assertEqual(u"package", self.read_file(os.path.join("templates", "latest.doxt")))
+        self.assertFalse(os.path.islink("absolute"))
+        self.assertFalse(os.path.islink("parent"))
+        self.assertEqual(u"package", self.read_file(os.path.join("absolute", "x.doxt")))
+        self.assertEqual([], os.listdir(outside_dir))
+
+    # downloads that do not match the manifest hash do not replace the local file
+    def test_pull_package_delta_hash_mismatch(self):
+        self.pull()
+        self.write_package_file(os.path.join("templates", "t0.doxt"), u"changed template")
+        self.publish()
+        with open(os.path.join(self.serve_dir, "package-objects", hashlib.sha256(b"changed template").hexdigest()), 'wb') as f:
+            f.write(b"damaged object")
+        self.assertRaises(FetchError, self.pull)
+        self.assertEqual(u"template 0 {{title}}\n", self.read_file(os.path.join("templates", "t0.doxt")))
+        self.assertEqual([".package.doxxpull", "pkey.yaml", "templates"], sorted(os.listdir(".")))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import unittest
+
+from Naked.toolshed.python import is_py2
+
+if is_py2():
+    from doxx.renderer.inkpy2 import Template as InkTemplate
+    from doxx.renderer.inkpy2 import Renderer as InkRenderer
+    from doxx.renderer.inkpy2 import StreamRenderer as InkStreamRenderer
+else:
+    from doxx.renderer.inkpy3 import Template as InkTemplate
+    from doxx.renderer.inkpy3 import Renderer as InkRenderer
+    from doxx.renderer.inkpy3 import StreamRenderer as InkStreamRenderer
+
+
+class DoxxInkRendererTests(unittest.TestCase):
+
+    def setUp(self):
+        self.template_text = u"The {{test}} of the {{document}} {{type}} and more of the {{test}} {{document}}"
+        self.key = {u'test': u'ব য', u'document': u'testing document', u'type': u'of mine', u'bogus': u'bogus test'}
+
+    # the template is tokenized into alternating literal and variable segments
+    def test_ink_template_segments(self):
+        template = InkTemplate(u"a {{b}} c {{d}}")
+        self.assertEqual([u"a ", u"b", u" c ", u"d", u""], template.segments)
+        self.assertEqual(set([u"b", u"d"]), template.varlist)
+
+    # all variables that are defined in the key are replaced
+    def test_ink_render_replacements(self):
+        template = InkTemplate(self.template_text)
+        rendered = InkRenderer(template, self.key).render()
+        self.assertEqual(u"The ব য of the testing document of mine and more of the ব য testing document", rendered)
+
+    # variables without a key definition are left in the rendered text
+    def test_ink_render_undefined_variable(self):
+        template = InkTemplate(u"{{defined}} and {{undefined}}")
+        rendered = InkRenderer(template, {u'defined': u'yes'}).render()
+        self.assertEqual(u"yes and {{undefined}}", rendered)
+
+    # template without variables renders to the same text
+    def test_ink_render_no_variables(self):
+        template = InkTemplate(u"no variables here\n")
+        rendered = InkRenderer(template, self.key).render()
+        self.assertEqual(u"no variables here\n", rendered)
+
+    # variables do not span lines
+    def test_ink_render_multiline_delimiters(self):
+        template = InkTemplate(u"{{test\n}} {{test}}")
+        rendered = InkRenderer(template, self.key).render()
+        self.assertEqual(u"{{test\n}} ব য", rendered)
+
+    # html entity encoding of the replacement values
+    def test_ink_render_html_entities(self):
+        template = InkTemplate(u"<p>{{value}}</p>")
+        rendered = InkRenderer(template, {u'value': u'a < b & c'}, html_entities=True).render()
+        self.assertEqual(u"<p>a &lt; b &amp; c</p>", rendered)
+
+    # a variable in a replacement value is not replaced, the value is written verbatim in every key order
+    def test_ink_render_variable_in_value(self):
+        template = InkTemplate(u"{{first}} {{second}}")
+        rendered = InkRenderer(template, {u'first': u'{{second}}', u'second': u'value'}).render()
+        self.assertEqual(u"{{second}} value", rendered)
+        rendered = InkRenderer(template, {u'second': u'value', u'first': u'{{second}}'}).render()
+        self.assertEqual(u"{{second}} value", rendered)
+
+    # the variable tag is the innermost opening delimiter, the extra braces are literal text
+    def test_ink_render_triple_braces(self):
+        template = InkTemplate(u"{{{name}}}")
+        self.assertEqual(set([u"name"]), template.varlist)
+        rendered = InkRenderer(template, {u'name': u'value'}).render()
+        self.assertEqual(u"{value}", rendered)
+        rendered = u"".join(InkStreamRenderer({u'name': u'value'}).render_chunks([u"{{{na", u"me}}}"]))
+        self.assertEqual(u"{value}", rendered)
+
+    # user defined delimiters with regex special characters
+    def test_ink_render_escaped_delimiters(self):
+        template = InkTemplate(u"[[test]] {{test}}", "[[", "]]", escape_regex=True)
+        rendered = InkRenderer(template, self.key).render()
+        self.assertEqual(u"ব য {{test}}", rendered)
+
+    # the streamed render of every two chunk split of the template text is equal to the Renderer output
+    def test_ink_stream_render_chunk_splits(self):
+        template_text = u"{{test}}\n{ {{document}}{{\n}} {{type}}}} {{undefined}}"
+        expected = InkRenderer(InkTemplate(template_text), self.key).render()
+        for split_index in range(len(template_text) + 1):
+            stream_renderer = InkStreamRenderer(self.key)
+            rendered = u"".join(stream_renderer.render_chunks([template_text[:split_index], template_text[split_index:]]))
+            self.assertEqual(expected, rendered)
+        self.assertEqual(set([u"test", u"document", u"type", u"undefined"]), stream_renderer.varlist)
+
+    # user defined delimiters that are split between chunks
+    def test_ink_stream_render_split_delimiters(self):
+        chunks = [u"<p>[", u"[val", u"ue]", u"]</p>"]
+        rendered = u"".join(InkStreamRenderer({u'value': u'a < b'}, "[[", "]]", html_entities=True).render_chunks(chunks))
+        self.assertEqual(u"<p>a &lt; b</p>", rendered)
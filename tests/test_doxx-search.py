@@ -1,14 +1,23 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import io
 import os
+import sys
+import random
+import shutil
+import tempfile
 import unittest
 
+from Naked.toolshed.python import is_py2
+
 from Naked.toolshed.system import file_exists, dir_exists
 
-from doxx.commands.search import run_search
+from doxx.commands.search import run_search, _rank_repositories
 from doxx.commands.whatis import run_whatis
 from doxx.datatypes.cache import DoxxCache
+from doxx.utilities.fuzzysearch import FuzzySearcher
+from doxx.utilities.searchindex import BigramIndex, get_bigrams, get_name_bigrams, hash_package_list
 
 class DoxxSearchCommandTests(unittest.TestCase):
     
@@ -47,4 +56,87 @@ class DoxxWhatisCommandTests(unittest.TestCase):
     def test_doxx_whatis_command_missing_package(self):
         with self.assertRaises(SystemExit):
             run_whatis('completely-bogus-package')
-        self.assertTrue(file_exists(self.cached_package_json_path))  # confirm that despite the exception, a cached packages.json file was generated
\ No newline at end of file
+        self.assertTrue(file_exists(self.cached_package_json_path))  # confirm that despite the exception, a cached packages.json file was generated
+
+
+class DoxxSearchIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.package_list = [u"license-mit", u"license-apache", u"html-boilerplate", u"flask-starter", u"css"]
+        self.index = BigramIndex.build(self.package_list, hash_package_list(u"\n".join(self.package_list)))
+
+    def test_name_bigrams(self):
+        self.assertEqual(set([u" c", u"cs", u"ss", u"s "]), get_name_bigrams(u"CSS"))
+        self.assertEqual(set([u" j", u"js", u"s-", u"-u", u"ui", u"i ", u"s ", u" u"]), get_name_bigrams(u"js-ui"))
+        self.assertEqual(set([u"ab", u"bc"]), get_bigrams(u"abc"))
+
+    # candidates share a bigram with the search string and are returned in package list order
+    def test_candidate_indices(self):
+        self.assertEqual([0, 1], self.index.get_candidate_indices(u"licnese"))
+        self.assertEqual([2, 3], self.index.get_candidate_indices(u"starter html"))
+        self.assertEqual([], self.index.get_candidate_indices(u"zzzz"))
+
+    # search strings that are shorter than 4 characters search the entire list
+    def test_candidate_indices_short_search_string(self):
+        self.assertEqual(None, self.index.get_candidate_indices(u"js"))
+        self.assertEqual(None, self.index.get_candidate_indices(u"css"))
+
+    def test_index_serialization(self):
+        index = BigramIndex.loads(self.index.dumps())
+        self.assertEqual(self.index.list_hash, index.list_hash)
+        self.assertEqual([4], index.get_candidate_indices(u"csss"))
+        self.assertEqual(None, BigramIndex.loads(b"bogus"))
+
+
+class DoxxSearchRankingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_home = os.environ.get("HOME")
+        self.home_dir = tempfile.mkdtemp()
+        os.environ["HOME"] = self.home_dir  # the doxx cache directory (~/.doxx) of the tests
+        self.package_list = [u"chicago-theme", u"django", u"django-blog", u"flask-starter", u"html5-boilerplate", u"license-mit",
+                             u"license-apache", u"bootstrap-landing", u"js", u"react-app", u"vue-starter"]
+        DoxxCache().cache_packagerepo_list(u"\n".join(self.package_list))
+
+    def tearDown(self):
+        os.environ["HOME"] = self.saved_home
+        shutil.rmtree(self.home_dir)
+
+    def search(self, search_string):
+        saved_stdout = sys.stdout
+        sys.stdout = io.StringIO() if not is_py2() else io.BytesIO()
+        try:
+            run_search(search_string)
+            return sys.stdout.getvalue().split("\n")
+        finally:
+            sys.stdout = saved_stdout
+
+    def full_scan(self, search_string):
+        best_results, possible_results = _rank_repositories(FuzzySearcher(search_string), search_string, self.package_list)
+        return (sorted(best_results), sorted(possible_results))
+
+    # transpositions do not share a trigram with the package name, the full scan ratio puts them in the best and possible results
+    def test_search_transposition_typos(self):
+        self.assertIn(u"django", self.search(u"djnago"))
+        self.assertIn(u"html5-boilerplate", self.search(u"hmtl5"))
+        self.assertIn(u"[*] doxx: Do any of these work? :", self.search(u"hmtl5"))
+
+    # the candidates of the bigram index have the best results of a full scan
+    def test_search_candidate_best_results(self):
+        index = BigramIndex.build(self.package_list, u"")
+        rng = random.Random(0)
+        for x in range(500):
+            search_chars = list(rng.choice(self.package_list))
+            for y in range(rng.randint(0, 2)):  # transpositions and substitutions
+                position = rng.randrange(len(search_chars))
+                if rng.random() < 0.5 and position + 1 < len(search_chars):
+                    search_chars[position], search_chars[position + 1] = search_chars[position + 1], search_chars[position]
+                else:
+                    search_chars[position] = rng.choice(u"abcdefghijklmnopqrstuvwxyz -")
+            search_string = u"".join(search_chars).replace(u"-", u" ")
+            candidate_indices = index.get_candidate_indices(search_string)
+            if candidate_indices is None:
+                continue
+            candidate_list = [self.package_list[i] for i in candidate_indices]
+            best_results, possible_results = _rank_repositories(FuzzySearcher(search_string), search_string, candidate_list)
+            self.assertEqual(sorted(name for ratio, i, name in self.full_scan(search_string)[0]), sorted(name for ratio, i, name in best_results))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from Naked.toolshed.file import FileReader, FileWriter
+import doxx
+import doxx.commands.serve
+from doxx.app import main
+from doxx.commands.serve import is_serve_supported, _get_build_request
+
+# runs a doxx command with the arguments in argv
+DOXX_SCRIPT = "import sys; sys.argv = ['doxx'] + sys.argv[1:]; from doxx.app import main; main()"
+
+# prints the forward_build return value for the key path in argv (None = no daemon)
+FORWARD_SCRIPT = "import sys; from doxx.commands.serve import forward_build; result = forward_build(sys.argv[1]); sys.stdout.flush(); sys.stdout.write('\\nforwarded:' + str(result) + '\\n')"
+
+
+class DoxxServeTests(unittest.TestCase):
+
+    def setUp(self):
+        if not is_serve_supported():
+            self.skipTest("doxx serve requires Unix domain sockets and Python 3.3+")
+        self.test_dir = tempfile.mkdtemp()
+        shutil.copy(os.path.join("templates", "mit.doxt"), self.test_dir)
+        FileWriter(os.path.join(self.test_dir, "key.yaml")).write(u"---\ntemplate: mit.doxt\n---\nname: Chris Simpkins\nyear: 2015\n")
+        self.socket_path = os.path.join(self.test_dir, "doxx.sock")
+        self.env = dict(os.environ)
+        self.env['DOXX_SOCKET'] = self.socket_path
+        self.env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(doxx.__file__)))  # the commands run in the test directory
+        self.daemon = subprocess.Popen([sys.executable, '-c', DOXX_SCRIPT, 'serve'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env, cwd=self.test_dir)
+        for x in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        if hasattr(self, 'daemon'):
+            if self.daemon.poll() is None:
+                self.daemon.terminate()
+            self.daemon.communicate()
+            shutil.rmtree(self.test_dir)
+
+    def run_script(self, script, args):
+        process = subprocess.Popen([sys.executable, '-c', script] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env, cwd=self.test_dir)
+        stdout_bytes, stderr_bytes = process.communicate()
+        return (process.returncode, stdout_bytes.decode('utf-8'), stderr_bytes.decode('utf-8'))
+
+    # the daemon builds in the client working directory and writes the build output to the client stdout
+    def test_serve_forward_build(self):
+        returncode, stdout_text, stderr_text = self.run_script(FORWARD_SCRIPT, ['key.yaml'])
+        self.assertEqual(0, returncode)
+        self.assertTrue("forwarded:0" in stdout_text)
+        self.assertTrue("mit.txt ... check" in stdout_text)
+        self.assertTrue(u"Copyright (c) 2015 Chris Simpkins" in FileReader(os.path.join(self.test_dir, "mit.txt")).read())
+
+    # modified key files are parsed again
+    def test_serve_modified_key(self):
+        self.run_script(DOXX_SCRIPT, ['build', 'key.yaml'])
+        FileWriter(os.path.join(self.test_dir, "key.yaml")).write(u"---\ntemplate: mit.doxt\n---\nname: Somebody Else\nyear: 2016\n")
+        returncode, stdout_text, stderr_text = self.run_script(DOXX_SCRIPT, ['build', 'key.yaml'])
+        self.assertEqual(0, returncode)
+        self.assertTrue(u"Copyright (c) 2016 Somebody Else" in FileReader(os.path.join(self.test_dir, "mit.txt")).read())
+
+    # build errors are written to the client stderr and set the client exit code
+    def test_serve_build_error(self):
+        returncode, stdout_text, stderr_text = self.run_script(DOXX_SCRIPT, ['build', 'missing.yaml'])
+        self.assertEqual(1, returncode)
+        self.assertTrue("Unable to load the requested key missing.yaml" in stderr_text)
+
+    # builds run locally without a daemon
+    def test_serve_stop(self):
+        returncode, stdout_text, stderr_text = self.run_script(DOXX_SCRIPT, ['serve', '--stop'])
+        self.assertEqual(0, returncode)
+        self.daemon.wait()
+        self.assertFalse(os.path.exists(self.socket_path))
+        returncode, stdout_text, stderr_text = self.run_script(FORWARD_SCRIPT, ['key.yaml'])
+        self.assertTrue("forwarded:None" in stdout_text)
+
+
+class DoxxServeOptInTests(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        shutil.copy(os.path.join("templates", "mit.doxt"), self.test_dir)
+        FileWriter(os.path.join(self.test_dir, "key.yaml")).write(u"---\ntemplate: mit.doxt\n---\nname: Chris Simpkins\nyear: 2015\n")
+        self.saved_cwd = os.getcwd()
+        self.saved_argv = sys.argv
+        self.saved_socket = os.environ.pop("DOXX_SOCKET", None)
+        self.saved_forward_build = doxx.commands.serve.forward_build
+        self.forwarded = []
+        doxx.commands.serve.forward_build = self.record_forward_build
+        os.chdir(self.test_dir)
+
+    def tearDown(self):
+        os.chdir(self.saved_cwd)
+        sys.argv = self.saved_argv
+        doxx.commands.serve.forward_build = self.saved_forward_build
+        os.environ.pop("DOXX_SOCKET", None)
+        if self.saved_socket is not None:
+            os.environ["DOXX_SOCKET"] = self.saved_socket
+        shutil.rmtree(self.test_dir)
+
+    def record_forward_build(self, key_path, incremental=False, processes=None, offline=False):
+        self.forwarded.append(key_path)
+        return 0
+
+    def run_build(self, args):
+        sys.argv = ['doxx', 'build'] + args
+        try:
+            main()
+        except SystemExit as e:
+            return e.code
+        return 0
+
+    # builds run in this process unless forwarding is requested
+    def test_serve_build_not_forwarded_by_default(self):
+        self.assertEqual(0, self.run_build(['key.yaml']))
+        self.assertEqual([], self.forwarded)
+        self.assertTrue(os.path.isfile(os.path.join(self.test_dir, "mit.txt")))
+
+    # the --serve option forwards the build
+    def test_serve_build_forwarded_with_option(self):
+        self.assertEqual(0, self.run_build(['key.yaml', '--serve']))
+        self.assertEqual(['key.yaml'], self.forwarded)
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "mit.txt")))
+
+    # the DOXX_SOCKET environment variable forwards the build, --no-serve builds in this process
+    def test_serve_build_forwarded_with_socket_variable(self):
+        os.environ["DOXX_SOCKET"] = os.path.join(self.test_dir, "doxx.sock")
+        self.assertEqual(0, self.run_build(['key.yaml']))
+        self.assertEqual(['key.yaml'], self.forwarded)
+        self.assertEqual(0, self.run_build(['key.yaml', '--no-serve']))
+        self.assertEqual(['key.yaml'], self.forwarded)
+        self.assertTrue(os.path.isfile(os.path.join(self.test_dir, "mit.txt")))
+
+
+class DoxxServeRequestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_offline = os.environ.pop("DOXX_OFFLINE", None)
+
+    def tearDown(self):
+        os.environ.pop("DOXX_OFFLINE", None)
+        if self.saved_offline is not None:
+            os.environ["DOXX_OFFLINE"] = self.saved_offline
+
+    # the --offline option and the DOXX_OFFLINE environment variable of the client shell are sent to the daemon
+    def test_serve_build_request_offline(self):
+        self.assertFalse(_get_build_request("key.yaml", False, None, False)['offline'])
+        self.assertTrue(_get_build_request("key.yaml", False, None, True)['offline'])
+        os.environ["DOXX_OFFLINE"] = "1"
+        self.assertTrue(_get_build_request("key.yaml", False, None, False)['offline'])
+        os.environ["DOXX_OFFLINE"] = "0"
+        self.assertFalse(_get_build_request("key.yaml", False, None, False)['offline'])
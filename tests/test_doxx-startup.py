@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import doxx
+
+# import time budgets (milliseconds) for the doxx modules that a command imports, measured with python -X importtime
+# the measurement includes the third party modules (Naked, yaml, requests) that the doxx modules import
+STARTUP_IMPORT_BUDGET_MS = {
+    'make': 50,
+    'clean': 50,
+    'build': 150,
+}
+
+# script that runs the doxx command in argv, then prints the names of the modules that should only be imported on use that the command imported
+STARTUP_SCRIPT = """
+import sys
+sys.argv = ['doxx'] + sys.argv[1:]
+startup_modules = set(sys.modules)  # modules that the interpreter start up imported (e.g. site)
+from doxx.app import main
+try:
+    main()
+except SystemExit:
+    pass
+sys.stdout.write('\\nloaded:' + ','.join(m for m in ('requests', 'multiprocessing', 'tarfile', 'zipfile', 'yaml') if m in sys.modules and m not in startup_modules) + '\\n')
+"""
+
+
+class DoxxStartupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.key_path = os.path.abspath(os.path.join("build-tests", "incremental", "key.yaml"))
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.test_dir)
+        mit_path = os.path.join(os.path.dirname(self.key_path), "mit.txt")
+        if os.path.isfile(mit_path):
+            os.remove(mit_path)
+
+    def run_command(self, args, importtime=False):
+        """runs a doxx command in a new interpreter, returns a (loaded module name list, stderr text) tuple"""
+        interpreter_options = ['-X', 'importtime'] if importtime else []
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(doxx.__file__)))  # the tests run from a temporary directory
+        process = subprocess.Popen([sys.executable] + interpreter_options + ['-c', STARTUP_SCRIPT] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        stdout_bytes, stderr_bytes = process.communicate()
+        loaded_line = stdout_bytes.decode('utf-8').strip().splitlines()[-1]
+        loaded_modules = [m for m in loaded_line[len('loaded:'):].split(',') if m]
+        return (loaded_modules, stderr_bytes.decode('utf-8'))
+
+    def get_import_time_ms(self, importtime_text):
+        """returns the sum of the cumulative import times of the top level doxx and Naked modules in python -X importtime output"""
+        total_us = 0
+        for line in importtime_text.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                fields = line.split('|')
+                module_name = fields[2]
+                if module_name.startswith(' doxx') or module_name.startswith(' Naked'):  # one space = top level import
+                    total_us += int(fields[1].strip())
+        return total_us / 1000.0
+
+    # commands that do not build or pull do not import the build, HTTP, archive, or multiprocessing modules
+    def test_startup_make_key_imports(self):
+        loaded_modules, errors = self.run_command(['make', 'key', 'key.yaml'])
+        self.assertEqual([], loaded_modules)
+
+    def test_startup_clean_imports(self):
+        loaded_modules, errors = self.run_command(['clean'])
+        self.assertEqual([], loaded_modules)
+
+    # single template builds do not import the HTTP, archive, or multiprocessing modules
+    def test_startup_build_imports(self):
+        loaded_modules, errors = self.run_command(['build', self.key_path])
+        self.assertEqual(['yaml'], loaded_modules)
+
+    def test_startup_import_time_budget(self):
+        if sys.version_info < (3, 7):
+            self.skipTest("python -X importtime requires Python 3.7+")
+        for command, args in (('make', ['make', 'key', 'key.yaml']), ('clean', ['clean']), ('build', ['build', self.key_path])):
+            loaded_modules, importtime_text = self.run_command(args, importtime=True)
+            import_time_ms = self.get_import_time_ms(importtime_text)
+            self.assertTrue(import_time_ms < STARTUP_IMPORT_BUDGET_MS[command], "doxx " + command + " import time " + str(import_time_ms) + "ms exceeds the " + str(STARTUP_IMPORT_BUDGET_MS[command]) + "ms budget")
@@ -3,12 +3,18 @@
 
 import sys
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 from Naked.toolshed.system import make_path
 from Naked.toolshed.file import FileReader
 from Naked.toolshed.python import is_py2
 from doxx.datatypes.template import DoxxTemplate, RemoteDoxxTemplate
+import doxx.datatypes.cache
+from doxx.datatypes.cache import DoxxTemplateCache
 
 class DoxxASCIITemplateTests(unittest.TestCase):
     
@@ -336,4 +342,125 @@ class DoxxTemplateErrorsTests(unittest.TestCase):
             temp.split_data()
             temp.parse_template_for_errors()
             temp.parse_template_text()
-         
\ No newline at end of file
+
+
+class DoxxTemplateCacheTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.ascii_template = "templates/ascii_template.doxt"
+        self.cache_dir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        
+    def load_template(self, template_path):
+        temp = DoxxTemplate(template_path)
+        temp.load_data()
+        temp.split_data()
+        return temp
+    
+    # compiled template round trip through the cache
+    def test_template_cache_roundtrip(self):
+        temp = self.load_template(self.ascii_template)
+        cache = DoxxTemplateCache(cache_dir=self.cache_dir)
+        self.assertTrue(cache.cache_compiled_template(temp.raw_text, temp.meta_data, len(temp.raw_text) - len(temp.text), temp.segments))
+        cached_template = cache.get_compiled_template(temp.raw_text)
+        self.assertFalse(cached_template == None)
+        self.assertEqual(temp.meta_data, cached_template[0])
+        self.assertEqual(temp.text, cached_template[1])
+        self.assertEqual(temp.segments, cached_template[2])
+        
+    # changed template text is a cache miss
+    def test_template_cache_miss(self):
+        temp = self.load_template(self.ascii_template)
+        cache = DoxxTemplateCache(cache_dir=self.cache_dir)
+        cache.cache_compiled_template(temp.raw_text, temp.meta_data, len(temp.raw_text) - len(temp.text), temp.segments)
+        self.assertEqual(None, cache.get_compiled_template(temp.raw_text + u" "))
+        self.assertEqual(None, cache.get_compiled_template(temp.raw_text, "[[", "]]"))
+        
+    # cached template data are identical to the parsed template data
+    def test_template_cache_split_data(self):
+        first_temp = self.load_template(self.ascii_template)  # writes the compiled template to the cache
+        second_temp = self.load_template(self.ascii_template)  # reads the compiled template from the cache
+        self.assertEqual(first_temp.meta_data, second_temp.meta_data)
+        self.assertEqual(first_temp.text, second_temp.text)
+        self.assertEqual(first_temp.segments, second_temp.segments)
+        
+    # least recently used files are removed when the cache is over the size limit
+    def test_template_cache_size_limit(self):
+        cache = DoxxTemplateCache(max_bytes=2048, cache_dir=self.cache_dir)
+        for x in range(50):
+            text = u"---doxx---\nextension: txt\n---doxx---\n" + (u"{{test}} %d " % x) * 100
+            cache.cache_compiled_template(text, {u"extension": u"txt"}, 36, [u"", u"test", u" %d " % x])
+        total_bytes = 0
+        for file_name in os.listdir(self.cache_dir):
+            total_bytes += os.path.getsize(os.path.join(self.cache_dir, file_name))
+        self.assertTrue(total_bytes <= 2048)
+
+    # temporary files that are being written are not pruned, abandoned temporary files are
+    def test_template_cache_prune_temp_files(self):
+        cache = DoxxTemplateCache(cache_dir=self.cache_dir)
+        for file_name in ("old.cache", "writing.tmp", "abandoned.tmp"):
+            with open(os.path.join(self.cache_dir, file_name), "wb") as writer:
+                writer.write(b"x" * 1024)
+        old_time = time.time() - doxx.datatypes.cache.CACHE_TEMP_FILE_MAX_AGE - 60
+        os.utime(os.path.join(self.cache_dir, "old.cache"), (old_time, old_time))
+        os.utime(os.path.join(self.cache_dir, "abandoned.tmp"), (old_time, old_time))
+        self.assertEqual(0, cache._prune_directory(self.cache_dir, 0))
+        self.assertEqual(["writing.tmp"], os.listdir(self.cache_dir))
+
+    # concurrent size updates from several threads are all counted
+    def test_template_cache_concurrent_size_updates(self):
+        cache = DoxxTemplateCache(cache_dir=self.cache_dir)
+        cache._update_directory_bytes(self.cache_dir, 0)  # assigns the size of the empty directory
+
+        def update_size():
+            for x in range(1000):
+                cache._update_directory_bytes(self.cache_dir, 1)
+
+        threads = [threading.Thread(target=update_size) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        try:
+            self.assertEqual(8000, doxx.datatypes.cache._cache_directory_bytes[self.cache_dir])
+        finally:
+            del doxx.datatypes.cache._cache_directory_bytes[self.cache_dir]
+
+
+class DoxxTemplateCopyRangeTests(unittest.TestCase):
+    
+    def load_template(self, template_path, no_replacements=False):
+        temp = DoxxTemplate(template_path, no_replacements=no_replacements)
+        temp.load_data()
+        temp.split_data()
+        return temp
+    
+    def read_template_text(self, template_path):
+        return FileReader(template_path).read().split(u"---doxx---")[2][1:]
+    
+    # ASCII verbatim template text is copied from the file without a decode
+    def test_template_copy_range_verbatim(self):
+        temp = self.load_template("templates/mit-verbatim.doxt")
+        self.assertFalse(temp.copy_range == None)
+        self.assertEqual(None, temp.text)
+        self.assertEqual(True, temp.meta_data['verbatim'])
+        self.assertFalse(temp.parse_template_for_errors()[0])
+        with open("templates/mit-verbatim.doxt", 'rb') as f:
+            f.seek(temp.copy_range[0])
+            copied_bytes = f.read(temp.copy_range[1])
+        self.assertEqual(self.read_template_text("templates/mit-verbatim.doxt"), copied_bytes.decode('utf-8'))
+        
+    # templates that are written without key replacements
+    def test_template_copy_range_no_replacements(self):
+        self.assertFalse(self.load_template("templates/mit.doxt", no_replacements=True).copy_range == None)
+        temp = self.load_template("templates/mit.doxt")
+        self.assertEqual(None, temp.copy_range)
+        self.assertEqual(self.read_template_text("templates/mit.doxt"), temp.text)
+        
+    # non-ASCII template text is decoded and normalized
+    def test_template_copy_range_unicode(self):
+        temp = self.load_template("templates/unicode_template.doxt", no_replacements=True)
+        self.assertEqual(None, temp.copy_range)
+        self.assertEqual(self.read_template_text("templates/unicode_template.doxt"), temp.text)
@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import io
+import os
 import sys
+import errno
 import shutil
+import tempfile
 import unittest
-from doxx.utilities.filesystem import _make_os_dependent_path, _create_dirs
+import doxx.utilities.filesystem
+from doxx.utilities.filesystem import _make_os_dependent_path, _create_dirs, _copy_file_atomic, _copy_bytes, _read_write
+from doxx.utilities.filesystem import _write_file_atomic, _write_chunks_atomic
 from Naked.toolshed.system import dir_exists
 
 class DoxxPathUtilitiesTests(unittest.TestCase):
@@ -76,4 +82,100 @@ class DoxxDirectoryUtilitiesTest(unittest.TestCase):
         self.assertTrue(dir_exists(self.testpath2))
         shutil.rmtree(self.testpath2)
     
-    
\ No newline at end of file
+    # another process creates the directory path between the directory check and os.makedirs
+    def test_doxx_make_dirs_race(self):
+        saved_makedirs = doxx.utilities.filesystem.os.makedirs
+        def makedirs_race(dir_path):
+            saved_makedirs(dir_path)
+            raise OSError(errno.EEXIST, "File exists", dir_path)
+        doxx.utilities.filesystem.os.makedirs = makedirs_race
+        try:
+            _create_dirs(self.testpath2_missingdir)
+            self.assertTrue(dir_exists(self.testpath2))
+        finally:
+            doxx.utilities.filesystem.os.makedirs = saved_makedirs
+            shutil.rmtree(self.testpath2)
+    
+    # other makedirs errors are raised
+    def test_doxx_make_dirs_error(self):
+        saved_makedirs = doxx.utilities.filesystem.os.makedirs
+        def makedirs_error(dir_path):
+            raise OSError(errno.EACCES, "Permission denied", dir_path)
+        doxx.utilities.filesystem.os.makedirs = makedirs_error
+        try:
+            self.assertRaises(OSError, _create_dirs, self.testpath2_missingdir)
+        finally:
+            doxx.utilities.filesystem.os.makedirs = saved_makedirs
+    
+    
+
+
+class DoxxFileUtilitiesTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.test_dir, "source.txt")
+        self.source_bytes = b"".join(("line %d\n" % x).encode('ascii') for x in range(10000))
+        with open(self.source_path, 'wb') as f:
+            f.write(self.source_bytes)
+            
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        
+    def read_file(self, file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+        
+    # byte range copy with the platform kernel copy functions
+    def test_doxx_copy_file_range(self):
+        destination_path = os.path.join(self.test_dir, "out", "copy.txt")
+        _create_dirs(destination_path)
+        _copy_file_atomic(destination_path, self.source_path, 7, 50000)
+        self.assertEqual(self.source_bytes[7:50007], self.read_file(destination_path))
+        self.assertEqual(["copy.txt"], os.listdir(os.path.dirname(destination_path)))  # the temporary file was renamed
+        
+    # byte range copy with the read / write fallback
+    def test_doxx_copy_bytes_read_write(self):
+        destination_path = os.path.join(self.test_dir, "copy.txt")
+        with open(self.source_path, 'rb') as source_file:
+            with open(destination_path, 'wb') as destination_file:
+                offset = 3
+                while offset < len(self.source_bytes):
+                    offset += _read_write(source_file.fileno(), destination_file.fileno(), offset, len(self.source_bytes) - offset)
+        self.assertEqual(self.source_bytes[3:], self.read_file(destination_path))
+        
+    # a source file that ends before the byte range
+    def test_doxx_copy_bytes_short_source(self):
+        destination_path = os.path.join(self.test_dir, "copy.txt")
+        with open(self.source_path, 'rb') as source_file:
+            with open(destination_path, 'wb') as destination_file:
+                self.assertRaises(IOError, _copy_bytes, source_file.fileno(), destination_file.fileno(), 0, len(self.source_bytes) + 10)
+        
+    # new files have the default permissions of the umask, replaced files keep their permissions
+    def test_doxx_write_file_atomic(self):
+        file_path = os.path.join(self.test_dir, "atomic.txt")
+        saved_umask = os.umask(0o027)
+        try:
+            _write_file_atomic(file_path, u"first \u00e9")
+        finally:
+            os.umask(saved_umask)
+        self.assertEqual(u"first \u00e9".encode('utf-8'), self.read_file(file_path))
+        if os.name != 'nt':
+            self.assertEqual(0o640, os.stat(file_path).st_mode & 0o777)
+            os.chmod(file_path, 0o600)
+        _write_file_atomic(file_path, u"second")
+        self.assertEqual(b"second", self.read_file(file_path))
+        if os.name != 'nt':
+            self.assertEqual(0o600, os.stat(file_path).st_mode & 0o777)
+        self.assertEqual(["atomic.txt", "source.txt"], sorted(os.listdir(self.test_dir)))
+        
+    # a failed write removes the temporary file and does not replace the existing file
+    def test_doxx_write_atomic_failure(self):
+        file_path = os.path.join(self.test_dir, "atomic.txt")
+        _write_file_atomic(file_path, u"existing")
+        def text_chunks():
+            yield u"partial"
+            raise ValueError("render error")
+        self.assertRaises(ValueError, _write_chunks_atomic, file_path, text_chunks())
+        self.assertEqual(b"existing", self.read_file(file_path))
+        self.assertEqual(["atomic.txt", "source.txt"], sorted(os.listdir(self.test_dir)))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from Naked.toolshed.file import FileReader, FileWriter
+from doxx.commands.watch import DoxxWatcher, get_changed_variables
+
+
+class DoxxWatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.chdir(self.test_dir)
+        self.write_count = 0
+        self.write_file("name.doxt", u"---doxx---\nbasename: name\nextension: txt\n---doxx---\nName: {{name}}\n")
+        self.write_file("year.doxt", u"---doxx---\nbasename: year\nextension: txt\n---doxx---\nYear: {{year}}\n")
+        self.write_file("key.yaml", u"---\ntemplates: [name.doxt, year.doxt]\n---\nname: Chris Simpkins\nyear: 2015\n")
+        self.watcher = DoxxWatcher("key.yaml", processes=1)
+        self.watcher.build_all()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.test_dir)
+
+    def write_file(self, file_path, text):
+        """writes the file with a new modification time (file system timestamps can have a coarse resolution)"""
+        FileWriter(file_path).write(text)
+        self.write_count += 1
+        new_mtime = time.time() + 10 * self.write_count
+        os.utime(file_path, (new_mtime, new_mtime))
+
+    def test_watch_no_changes(self):
+        self.assertEqual([], self.watcher.check_for_changes())
+
+    # a key value change renders the templates that use the variable
+    def test_watch_key_value_change(self):
+        self.write_file("key.yaml", u"---\ntemplates: [name.doxt, year.doxt]\n---\nname: Chris Simpkins\nyear: 2016\n")
+        self.assertEqual(["year.doxt"], self.watcher.check_for_changes())
+        self.assertEqual(u"Year: 2016\n", FileReader("year.txt").read())
+
+    # a template change renders the template and updates the variable : templates dependency map
+    def test_watch_template_change(self):
+        self.write_file("name.doxt", u"---doxx---\nbasename: name\nextension: txt\n---doxx---\nName: {{name}} {{year}}\n")
+        self.assertEqual(["name.doxt"], self.watcher.check_for_changes())
+        self.assertEqual(u"Name: Chris Simpkins 2015\n", FileReader("name.txt").read())
+        self.write_file("key.yaml", u"---\ntemplates: [name.doxt, year.doxt]\n---\nname: Chris Simpkins\nyear: 2016\n")
+        self.assertEqual(["name.doxt", "year.doxt"], self.watcher.check_for_changes())
+
+    # templates that are added to the key are rendered and watched
+    def test_watch_key_adds_template(self):
+        self.write_file("both.doxt", u"---doxx---\nbasename: both\nextension: txt\n---doxx---\n{{name}} {{year}}\n")
+        self.write_file("key.yaml", u"---\ntemplates: [name.doxt, year.doxt, both.doxt]\n---\nname: Chris Simpkins\nyear: 2015\n")
+        self.assertEqual(["both.doxt"], self.watcher.check_for_changes())
+        self.assertTrue("both.doxt" in self.watcher.file_stats)
+
+    # an invalid YAML key is reported, the last good key is kept and the next valid save rebuilds
+    def test_watch_malformed_key(self):
+        self.write_file("key.yaml", u"---\ntemplates: [name.doxt, year.doxt\n---\nname: Chris Simpkins\nyear: 2016\n")
+        self.assertEqual([], self.watcher.check_for_changes())
+        self.assertEqual(u"Chris Simpkins", self.watcher.key.key_data['name'])
+        self.write_file("key.yaml", u"---\ntemplates: [name.doxt, year.doxt]\n---\nname: Chris Simpkins\nyear: 2016\n")
+        self.assertEqual(["year.doxt"], self.watcher.check_for_changes())
+        self.assertEqual(u"Year: 2016\n", FileReader("year.txt").read())
+
+    # a key without a template or templates field is reported, the last good key is kept and the next valid save rebuilds
+    def test_watch_key_without_templates(self):
+        self.write_file("key.yaml", u"---\ntextfiles:\n  readme.txt: https://example.com/readme.txt\n---\nname: Chris Simpkins\nyear: 2016\n")
+        self.assertEqual([], self.watcher.check_for_changes())
+        self.assertEqual(["name.doxt", "year.doxt"], self.watcher.template_paths)
+        self.write_file("key.yaml", u"---\ntemplates: [name.doxt, year.doxt]\n---\nname: Chris\nyear: 2015\n")
+        self.assertEqual(["name.doxt"], self.watcher.check_for_changes())
+        self.assertEqual(u"Name: Chris\n", FileReader("name.txt").read())
+
+    def test_watch_changed_variables(self):
+        self.assertEqual(set(['b', 'c', 'd']), get_changed_variables({'a': u"1", 'b': u"2", 'c': u"3"}, {'a': u"1", 'b': u"5", 'd': u"4"}))